@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import time
+import numpy as np
+
+from ngts_transmission.aperture import ApertureEngine
+from ngts_transmission.transmission import photometry_local
+from synthetic import synthetic_stars, render_frame
+
+
+def best_time(fn, repeats):
+    best, result = np.inf, None
+    for _ in range(repeats):
+        start = time.time()
+        result = fn()
+        best = min(best, time.time() - start)
+    return best, result
+
+
+def main(args):
+    x, y, flux = synthetic_stars(50000, seed=args.seed)
+    data = render_frame(x, y, flux, seed=args.seed)
+
+    print('{:>8s} {:>16s} {:>16s} {:>16s} {:>12s}'.format(
+        'nstars', 'photutils (ms)', 'precompute (ms)', 'stamps (ms)',
+        'max rel diff'))
+    for nstars in args.nstars:
+        cx, cy = x[:nstars], y[:nstars]
+        photutils_time, expected = best_time(
+            lambda: photometry_local(data, cx, cy, args.radius,
+                                     args.radius_inner, args.radius_outer),
+            args.repeats)
+        precompute_time, engine = best_time(
+            lambda: ApertureEngine(cx, cy, args.radius, args.radius_inner,
+                                   args.radius_outer),
+            args.repeats)
+        stamps_time, result = best_time(lambda: engine(data), args.repeats)
+
+        valid = np.isfinite(expected) & (np.abs(expected) > 0)
+        rel_diff = np.max(np.abs(result[valid] - expected[valid]) /
+                          np.abs(expected[valid]))
+        print('{:8d} {:16.2f} {:16.2f} {:16.2f} {:12.2e}'.format(
+            nstars, photutils_time * 1E3, precompute_time * 1E3,
+            stamps_time * 1E3, rel_diff))
+
+
+if __name__ == '__main__':
+    description = '''
+    Compare photutils aperture photometry with the precomputed stamp engine
+    on a synthetic frame. The precompute cost is paid once per reference
+    catalogue.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--nstars', type=int, nargs='+',
+                        default=[100, 500, 2000, 10000])
+    parser.add_argument('--radius', type=float, default=3.)
+    parser.add_argument('--radius-inner', type=float, default=4.)
+    parser.add_argument('--radius-outer', type=float, default=8.)
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('-s', '--seed', type=int, default=42)
+    main(parser.parse_args())
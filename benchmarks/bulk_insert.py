@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import time
+import numpy as np
+
+from ngts_transmission.catalogue import (TransmissionCatalogueEntry,
+                                         store_catalogue)
+from ngts_transmission.db import bulk_insert, insert_settings
+from ngts_transmission.transmission import TransmissionEntry, upload_entries
+from standin import StandInConnection, create_tables
+
+
+def catalogue_rows(nrows):
+    rng = np.random.RandomState(42)
+    return [TransmissionCatalogueEntry(
+        ref_image_id=10101, x_coordinate=float(x), y_coordinate=float(y),
+        inc_prescan=1, flux_adu=float(flux), aperture_radius=3.)
+        for (x, y, flux) in zip(rng.uniform(532, 1536, nrows),
+                                rng.uniform(512, 1536, nrows),
+                                rng.uniform(2E3, 9E4, nrows))]
+
+
+def transmission_rows(nrows):
+    return [TransmissionEntry(image_id=i, image_mean_flux=1E4,
+                              mean_flux_ratio=1., median_flux_ratio=1.,
+                              flux_ratio_err=0.01, flux_ratio_lq=0.9,
+                              flux_ratio_uq=1.1, flux_ratio_stdev=0.1, flag=0)
+            for i in range(nrows)]
+
+
+def upload_catalogue_row_by_row(rows, cursor):
+    for row in rows:
+        bulk_insert(cursor, 'transmission_sources', row._fields, [row])
+
+
+def upload_catalogue(rows, cursor, chunk_size):
+    insert_settings.chunk_size = chunk_size
+    store_catalogue(rows, cursor)
+
+
+def upload_entries_row_by_row(rows, cursor):
+    for row in rows:
+        row.upload_to_database(cursor)
+
+
+def time_upload(fn, rows, latency, **kwargs):
+    connection = StandInConnection(latency=latency)
+    create_tables(connection)
+    cursor = connection.cursor()
+    start = time.time()
+    fn(rows, cursor, **kwargs)
+    connection.commit()
+    elapsed = time.time() - start
+    connection.close()
+    return len(rows) / elapsed, cursor.statements
+
+
+def main(args):
+    latency = args.latency / 1E3
+    tables = [
+        ('transmission_sources', catalogue_rows(args.nrows),
+         upload_catalogue_row_by_row, upload_catalogue),
+        ('transmission_log', transmission_rows(args.nrows),
+         upload_entries_row_by_row, upload_entries),
+    ]
+
+    print('{:>22s} {:>12s} {:>12s} {:>12s}'.format(
+        'table', 'chunk size', 'rows/s', 'statements'))
+    for table_name, rows, row_by_row, batched in tables:
+        rate, statements = time_upload(row_by_row, rows, latency)
+        print('{:>22s} {:>12s} {:12.0f} {:12d}'.format(
+            table_name, 'single row', rate, statements))
+        for chunk_size in args.chunk_sizes:
+            rate, statements = time_upload(batched, rows, latency,
+                                           chunk_size=chunk_size)
+            print('{:>22s} {:12d} {:12.0f} {:12d}'.format(
+                table_name, chunk_size, rate, statements))
+
+
+if __name__ == '__main__':
+    description = '''
+    Compare single row and batched uploads of catalogue and transmission rows
+    against a local database stand-in, with an emulated round trip latency
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--nrows', type=int, default=2000,
+                        help='Number of rows to upload')
+    parser.add_argument('-l', '--latency', type=float, default=0.5,
+                        help='Emulated round trip time per statement (ms)')
+    parser.add_argument('-c', '--chunk-sizes', type=int, nargs='+',
+                        default=[10, 100, 500, 1000],
+                        help='Batch sizes to test')
+    main(parser.parse_args())
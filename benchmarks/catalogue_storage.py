@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import json
+import sys
+import numpy as np
+
+from ngts_transmission.catalogue import TransmissionCatalogueEntry
+from ngts_transmission.db import (connect_to_database_from_args,
+                                  add_database_arguments, database_schema,
+                                  raw_create_table)
+from ngts_transmission.storage import (STORAGES, catalogue_store,
+                                       migrate_catalogue)
+from ngts_transmission.transmission import Photometry
+from run_suite import timed, summarise, metadata, compare
+from standin import StandInConnection, create_tables
+
+TABLES = ['transmission_sources', 'transmission_catalogues']
+
+
+def synthetic_catalogue(ref_image_id, nstars, rng):
+    return [TransmissionCatalogueEntry(
+        ref_image_id=ref_image_id, x_coordinate=float(x),
+        y_coordinate=float(y), inc_prescan=1, flux_adu=float(flux),
+        aperture_radius=3.)
+        for (x, y, flux) in zip(rng.uniform(20, 2028, nstars),
+                                rng.uniform(0, 2048, nstars),
+                                rng.uniform(2E3, 9E4, nstars))]
+
+
+def seed_tables(cursor, sizes):
+    '''
+    Store one catalogue per size as rows, then migrate each to a packed
+    record. Returns the reference image id of each size.
+    '''
+    rng = np.random.RandomState(42)
+    ref_image_ids = {}
+    catalogue_store.use('rows')
+    for ref_image_id, nstars in enumerate(sizes, start=1):
+        catalogue_store.replace(
+            cursor, ref_image_id,
+            synthetic_catalogue(ref_image_id, nstars, rng))
+        migrate_catalogue(cursor, ref_image_id)
+        ref_image_ids[nstars] = ref_image_id
+        print('Seeded {} sources'.format(nstars), file=sys.stderr)
+    return ref_image_ids
+
+
+def mysql_connection(args):
+    if args.db_name == 'ngts_ops':
+        raise ValueError('Refusing to seed the operations database, '
+                         'choose a scratch database with --db-name')
+    connection = connect_to_database_from_args(args)
+    schema = database_schema()
+    with connection as cursor:
+        for table_name in TABLES:
+            cursor.execute('drop table if exists {}'.format(table_name))
+            cursor.execute(raw_create_table(table_name, schema))
+    return connection
+
+
+def main(args):
+    if args.mysql:
+        connection = mysql_connection(args)
+    else:
+        connection = StandInConnection(latency=args.latency)
+        create_tables(connection)
+
+    with connection as cursor:
+        ref_image_ids = seed_tables(cursor, args.sizes)
+
+    raw = {}
+    try:
+        for name in STORAGES:
+            catalogue_store.use(name)
+            for nstars in args.sizes:
+                with connection as cursor:
+                    raw['load.{}.{}'.format(name, nstars)] = timed(
+                        lambda _: Photometry.from_database(
+                            cursor, ref_image_ids[nstars]),
+                        args.repeats)
+    finally:
+        catalogue_store.use('rows')
+
+    results = dict((name, summarise(times)) for (name, times) in raw.items())
+    for nstars in args.sizes:
+        rows, blob = [results['load.{}.{}'.format(name, nstars)]['median']
+                      for name in STORAGES]
+        print('{:>8d} stars: rows {:9.3f} ms, blob {:9.3f} ms '
+              '({:.1f}x)'.format(nstars, rows * 1E3, blob * 1E3, rows / blob))
+
+    if args.output is not None:
+        with open(args.output, 'w') as outfile:
+            json.dump({'metadata': metadata(args), 'results': results},
+                      outfile, indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)['results']
+        if compare(results, baseline, args.tolerance, args.min_time / 1E3):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    description = '''
+    Compare the time to load a reference catalogue stored one row per source
+    with one stored as a packed record, for catalogues of each size. Uses
+    an in-memory stand in for the database unless --mysql is given, which
+    must be run against a scratch database.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument('--mysql', action='store_true',
+                        help='Use the MySQL server given by the database '
+                        'arguments')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[500, 5000, 50000],
+                        help='Number of stars in each catalogue')
+    parser.add_argument('-r', '--repeats', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='Round trip time added to each statement of '
+                        'the stand in (s)')
+    parser.add_argument('-o', '--output', help='Write the results as JSON')
+    parser.add_argument('-c', '--compare',
+                        help='Results file from an earlier run to compare '
+                        'against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='Fractional slow down reported as a '
+                        'regression')
+    parser.add_argument('--min-time', type=float, default=1.,
+                        help='Smallest slow down reported as a regression '
+                        '(ms)')
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import time
+import numpy as np
+
+from ngts_transmission.transmission import TransmissionEntry
+from ngts_transmission.watching import Job, commit_in_groups, upload_results
+from standin import StandInConnection, create_tables
+
+
+def seed_queue(connection, njobs):
+    cursor = connection.cursor()
+    cursor.execute('create table job_queue (job_id integer primary key)')
+    for job_id in range(njobs):
+        cursor.execute('insert into job_queue (job_id) values (%s)',
+                       (job_id,))
+    connection.commit()
+    return [Job(job_id=job_id, filename='IMAGE{}.fits'.format(job_id))
+            for job_id in range(njobs)]
+
+
+def simulated_process(work_time, failures=()):
+    '''
+    `process_jobs` with the photometry replaced by a fixed delay. Jobs in
+    `failures` raise, as a bad file would.
+    '''
+    def process(cursor, jobs):
+        completed = []
+        for job in jobs:
+            time.sleep(work_time)
+            if job.job_id in failures:
+                continue
+            completed.append((job, TransmissionEntry(
+                image_id=job.job_id, image_mean_flux=1E4,
+                mean_flux_ratio=1., median_flux_ratio=1.,
+                flux_ratio_err=0.01, flux_ratio_lq=0.9, flux_ratio_uq=1.1,
+                flux_ratio_stdev=0.1, flag=0)))
+        upload_results(cursor, completed)
+    return process
+
+
+def run(args, commit_every):
+    connection = StandInConnection(latency=args.latency / 1E3)
+    create_tables(connection)
+    jobs = seed_queue(connection, args.njobs)
+
+    timings = []
+    start = time.time()
+    commit_in_groups(connection, jobs,
+                     simulated_process(args.work_time, failures=[1]),
+                     commit_every=commit_every, timings=timings)
+    elapsed = time.time() - start
+
+    cursor = connection.cursor()
+    cursor.execute('select count(*) from job_queue')
+    remaining, = cursor.fetchone()
+    connection.close()
+    return {
+        'elapsed': elapsed,
+        'first_visible': timings[0],
+        'mean_hold': np.mean(timings),
+        'max_hold': np.max(timings),
+        'transactions': len(timings),
+        'remaining': remaining,
+    }
+
+
+def main(args):
+    print('{:>12s} {:>6s} {:>10s} {:>14s} {:>14s} {:>14s} {:>10s}'.format(
+        'commit', 'txns', 'total (s)', 'first seen (s)', 'mean hold (s)',
+        'max hold (s)', 'remaining'))
+    for commit_every in args.commit_every:
+        label = 'batch' if commit_every == 0 else 'every {}'.format(
+            commit_every)
+        result = run(args, commit_every)
+        print('{:>12s} {transactions:6d} {elapsed:10.3f} '
+              '{first_visible:14.3f} {mean_hold:14.3f} {max_hold:14.3f} '
+              '{remaining:10d}'.format(label, **result))
+
+
+if __name__ == '__main__':
+    description = '''
+    Compare how long the watcher holds its transaction open, and how soon
+    the first results become visible, when committing once per batch or
+    every N jobs. One job in the batch fails and must stay queued.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-j', '--njobs', type=int, default=20,
+                        help='Jobs per batch')
+    parser.add_argument('-w', '--work-time', type=float, default=0.1,
+                        help='Simulated processing time per job (s)')
+    parser.add_argument('-l', '--latency', type=float, default=1.,
+                        help='Simulated database round trip (ms)')
+    parser.add_argument('-c', '--commit-every', type=int, nargs='+',
+                        default=[0, 5, 1],
+                        help='Commit granularities to compare, 0 for once '
+                        'per batch')
+    main(parser.parse_args())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from ngts_transmission.image import ImageFile
+from ngts_transmission.transmission import Photometry
+from synthetic import synthetic_stars, render_frame, write_frame
+
+
+def central_catalogue(x, y, flux, margin=532, size=1024):
+    index = ((x > margin) & (x < margin + size) &
+             (y > margin - 20) & (y < margin - 20 + size))
+    return Photometry(x[index], y[index], np.ones(index.sum()) * 3.,
+                      flux[index])
+
+
+def measure(filename, catalogue, cutout):
+    tracemalloc.start()
+    start = time.time()
+    with ImageFile(filename) as image:
+        Photometry.extract_from_file(filename, catalogue, 4., 8., image=image,
+                                     cutout=cutout)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, image.bytes_decompressed
+
+
+def main(args):
+    x, y, flux = synthetic_stars(args.nstars, seed=args.seed)
+    data = render_frame(x, y, flux, seed=args.seed)
+    catalogue = central_catalogue(x, y, flux)
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        base = os.path.join(tempdir, 'IMAGE.fits')
+        files = [('fits', write_frame(data, base)),
+                 ('fits.bz2', write_frame(data, base, compress=True))]
+
+        print('{:>9s} {:>10s} {:>10s} {:>14s} {:>18s}'.format(
+            'format', 'mode', 'time (s)', 'peak mem (MB)',
+            'decompressed (MB)'))
+        for label, filename in files:
+            for mode, cutout in [('full', False), ('cutout', True)]:
+                results = [measure(filename, catalogue, cutout)
+                           for _ in range(args.repeats)]
+                elapsed = min(result[0] for result in results)
+                peak = max(result[1] for result in results)
+                decompressed = results[0][2]
+                print('{:>9s} {:>10s} {:10.3f} {:14.1f} {:18.1f}'.format(
+                    label, mode, elapsed, peak / 1E6, decompressed / 1E6))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    description = '''
+    Compare the time and peak memory of full frame and cutout photometry on
+    a synthetic frame, uncompressed and bz2 compressed
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--nstars', type=int, default=5000)
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('-s', '--seed', type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import datetime
+import multiprocessing
+import time
+import pymysql
+
+from ngts_transmission.db import (add_database_arguments, database_schema,
+                                  raw_create_table, transaction)
+from ngts_transmission.leases import JobLeases
+from ngts_transmission.watching import fetch_transmission_jobs
+
+JOB_TABLES = [
+    '''create table job_queue (
+    job_id int(11) not null auto_increment,
+    job_type char(20) default null,
+    submitted datetime default null,
+    expires datetime default null,
+    primary key (job_id)) engine=InnoDB''',
+    '''create table job_args (
+    job_id int(11) not null default '0',
+    arg_key char(50) not null default '',
+    arg_value text,
+    primary key (job_id, arg_key)) engine=InnoDB''',
+]
+
+
+def connect(args):
+    kwargs = dict(user=args.db_user, db=args.db_name)
+    if args.db_host is not None:
+        kwargs['host'] = args.db_host
+    elif args.db_socket is not None:
+        kwargs['unix_socket'] = args.db_socket
+    return pymysql.connect(**kwargs)
+
+
+def seed_jobs(args):
+    connection = connect(args)
+    with transaction(connection) as cursor:
+        for table_name in ['job_args', 'job_queue', 'transmission_job_lease']:
+            cursor.execute('drop table if exists {}'.format(table_name))
+        for query in JOB_TABLES:
+            cursor.execute(query)
+        cursor.execute(raw_create_table('transmission_job_lease',
+                                        database_schema()))
+
+        now = datetime.datetime.utcnow()
+        expires = now + datetime.timedelta(days=1)
+        for i in range(args.njobs):
+            cursor.execute('''insert into job_queue
+                           (job_type, submitted, expires) values (%s, %s, %s)
+                           ''', ('transparency', now, expires))
+            cursor.execute('''insert into job_args (job_id, arg_key, arg_value)
+                           values (%s, %s, %s)''',
+                           (cursor.lastrowid, 'file',
+                            'IMAGE{:06d}.fits'.format(i)))
+
+
+def worker(args, owner, processed, abandon=False):
+    '''
+    Run the claim/process/release cycle of `watcher_loop_step`, replacing
+    the photometry with a fixed sleep. If `abandon` is set, claim one batch
+    and exit without processing it, as a crashed watcher would.
+    '''
+    connection = connect(args)
+    leases = JobLeases(owner=owner, duration=args.lease_time)
+    while True:
+        with transaction(connection) as cursor:
+            jobs = fetch_transmission_jobs(cursor, leases=leases)
+            if not jobs:
+                cursor.execute('select count(*) from job_queue')
+                remaining, = cursor.fetchone()
+        if abandon:
+            return
+        if not jobs:
+            # Other watchers hold the remaining jobs, or they were
+            # abandoned and will be reclaimed when their leases expire
+            if not remaining:
+                return
+            time.sleep(args.poll_time)
+            continue
+
+        with transaction(connection) as cursor:
+            for job in jobs:
+                time.sleep(args.work_time)
+                job.remove_from_database(cursor)
+            leases.release(cursor)
+        for job in jobs:
+            processed.put((owner, job.job_id))
+
+
+def run(args, nworkers):
+    seed_jobs(args)
+    processed = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=worker, args=(args, 'worker{}'.format(i), processed))
+                 for i in range(nworkers)]
+    if args.abandon:
+        processes.insert(0, multiprocessing.Process(
+            target=worker, args=(args, 'crashed', processed, True)))
+
+    start = time.time()
+    for process in processes:
+        process.start()
+    results = [processed.get() for _ in range(args.njobs)]
+    elapsed = time.time() - start
+    for process in processes:
+        process.join()
+
+    job_ids = [job_id for (_, job_id) in results]
+    duplicates = len(job_ids) - len(set(job_ids))
+    return elapsed, duplicates
+
+
+def main(args):
+    if args.db_name == 'ngts_ops':
+        raise ValueError('Refusing to seed the operations database, '
+                         'choose a scratch database with --db-name')
+
+    baseline = None
+    for nworkers in args.workers:
+        elapsed, duplicates = run(args, nworkers)
+        baseline = baseline or elapsed * nworkers
+        print('{:3d} workers: {:8.2f} jobs/s, speedup {:5.2f}, '
+              '{} duplicates'.format(nworkers, args.njobs / elapsed,
+                                     baseline / elapsed, duplicates))
+
+
+if __name__ == '__main__':
+    description = '''
+    Share a job queue between several local watcher processes using job
+    leases, and check every job is processed exactly once. Must be run
+    against a scratch database.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument('--njobs', type=int, default=400,
+                        help='Number of jobs to queue')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8],
+                        help='Numbers of watcher processes to compare')
+    parser.add_argument('--work-time', type=float, default=0.05,
+                        help='Simulated processing time per job (s)')
+    parser.add_argument('--poll-time', type=float, default=0.1,
+                        help='Sleep between empty polls (s)')
+    parser.add_argument('--lease-time', type=int, default=5,
+                        help='Lease duration (s)')
+    parser.add_argument('--abandon', action='store_true',
+                        help='Add a watcher which claims a batch and dies, '
+                        'so its jobs must be reclaimed after the lease '
+                        'expires')
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import time
+import numpy as np
+
+from ngts_transmission.catalogue import default_filters
+
+
+def synthetic_source_table(nsources, image_size=2048, seed=None):
+    '''
+    Uniformly distributed sources with a power law flux distribution, with
+    the same columns as the imcore output
+    '''
+    rng = np.random.RandomState(seed)
+    table = np.zeros(nsources, dtype=[('X_coordinate', np.float64),
+                                      ('Y_coordinate', np.float64),
+                                      ('Aper_flux_3', np.float64)])
+    table['X_coordinate'] = rng.uniform(0, image_size, nsources)
+    table['Y_coordinate'] = rng.uniform(0, image_size, nsources)
+    table['Aper_flux_3'] = 1E2 * (1. - rng.uniform(0, 1, nsources)) ** -1.5
+    return table
+
+
+def time_stages(source_table, filters, repeats):
+    timings = []
+    for source_filter in filters:
+        timings.append([source_filter.__class__.__name__, np.inf, 0])
+
+    for _ in range(repeats):
+        index = np.ones(len(source_table), dtype=bool)
+        for timing, source_filter in zip(timings, filters):
+            start = time.time()
+            index = source_filter(source_table, index)
+            timing[1] = min(timing[1], time.time() - start)
+            timing[2] = int(index.sum())
+
+    return timings
+
+
+def main(args):
+    filters = default_filters(isolation_radius=args.isolation_radius)
+    print('{:>8s} {:>18s} {:>10s} {:>10s}'.format(
+        'nsources', 'stage', 'time (ms)', 'remaining'))
+    for nsources in args.nsources:
+        source_table = synthetic_source_table(nsources, seed=args.seed)
+        total = 0.
+        for name, elapsed, remaining in time_stages(source_table, filters,
+                                                    args.repeats):
+            total += elapsed
+            print('{:8d} {:>18s} {:10.3f} {:10d}'.format(
+                nsources, name, elapsed * 1E3, remaining))
+        print('{:8d} {:>18s} {:10.3f}'.format(nsources, 'total', total * 1E3))
+
+
+if __name__ == '__main__':
+    description = '''
+    Time each stage of the reference catalogue source filter on synthetic
+    source tables
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--nsources',
+                        nargs='+',
+                        type=int,
+                        default=[1000, 5000, 20000, 50000, 100000, 200000],
+                        help='Number of sources in each synthetic field')
+    parser.add_argument('-i', '--isolation-radius',
+                        default=6.,
+                        type=float,
+                        help='Isolation distance (pix)')
+    parser.add_argument('-r', '--repeats',
+                        default=3,
+                        type=int,
+                        help='Take the fastest of this many runs')
+    parser.add_argument('-s', '--seed', default=42, type=int)
+    main(parser.parse_args())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from run_suite import summarise, metadata, compare
+
+MODULES = [
+    'ngts_transmission.logs',
+    'ngts_transmission.db',
+    'ngts_transmission.transmission',
+    'ngts_transmission.catalogue',
+    'ngts_transmission.watching',
+    'ngts_transmission.backfill',
+    'ngts_transmission.prebuild',
+]
+
+SCRIPTS = [
+    'initialise_database.py',
+    'upload_transmission.py',
+    'build_catalogue.py',
+    'reprocess_transmission.py',
+    'prebuild_catalogues.py',
+]
+
+# Dependencies which should only be imported by the code needing them
+HEAVY = ['astropy', 'photutils', 'scipy', 'Pyro4']
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'bin')
+
+IMPORT_CODE = '''
+import json, sys, time
+start = time.time()
+import {module}
+elapsed = time.time() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{'elapsed': elapsed, 'heavy': heavy}}))
+'''
+
+
+def time_import(module):
+    '''
+    Seconds to import `module` in a fresh interpreter, and the heavy
+    dependencies it pulled in
+    '''
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_CODE.format(module=module, heavy=HEAVY)])
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result['elapsed'], result['heavy']
+
+
+def time_command(argv):
+    '''
+    Seconds for the command `argv` to exit
+    '''
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(argv, stdout=devnull)
+    return time.time() - start
+
+
+def main(args):
+    raw, heavy = {}, {}
+    for module in MODULES:
+        times = []
+        for _ in range(args.repeats):
+            elapsed, loaded = time_import(module)
+            times.append(elapsed)
+        raw['import.' + module] = times
+        heavy[module] = loaded
+    # Scripts are timed from start to exit, including the interpreter
+    raw['startup.python'] = [time_command([sys.executable, '-c', 'pass'])
+                             for _ in range(args.repeats)]
+    for script in SCRIPTS:
+        argv = [sys.executable, os.path.join(BIN_DIR, script), '--help']
+        raw['startup.' + script] = [time_command(argv)
+                                    for _ in range(args.repeats)]
+
+    results = dict((name, summarise(times)) for (name, times) in raw.items())
+    for name in sorted(results):
+        print('{:>55s}: {median:10.4f} s (min {min:.4f} s)'.format(
+            name, **results[name]))
+    for module in MODULES:
+        if heavy[module]:
+            print('{} imports {}'.format(module, ', '.join(heavy[module])))
+
+    if args.output is not None:
+        with open(args.output, 'w') as outfile:
+            json.dump({'metadata': metadata(args), 'results': results,
+                       'heavy_imports': heavy},
+                      outfile, indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)['results']
+        if compare(results, baseline, args.tolerance, args.min_time / 1E3):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    description = '''
+    Time importing the package modules and starting the command line
+    scripts, each in a fresh interpreter, and list the heavy dependencies
+    imported by each module. Save the results with --output, and compare a
+    later release with --compare.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    parser.add_argument('-o', '--output', help='Write the results as JSON')
+    parser.add_argument('-c', '--compare',
+                        help='Results file from an earlier run to compare '
+                        'against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='Fractional slow down reported as a '
+                        'regression')
+    parser.add_argument('--min-time', type=float, default=20.,
+                        help='Smallest slow down reported as a regression '
+                        '(ms)')
+    main(parser.parse_args())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from ngts_transmission import logs
+from ngts_transmission.logs import logger, configure_logging
+from ngts_transmission.transmission import TransmissionEntry
+from ngts_transmission.watching import watcher_loop_step
+from run_suite import Field
+from standin import queue_job
+
+MODES = [
+    # name, configure_logging arguments
+    ('off', dict(level='CRITICAL')),
+    ('sync', dict(level='DEBUG')),
+    ('async', dict(level='DEBUG', asynchronous=True)),
+    ('async+sampled', dict(level='DEBUG', asynchronous=True)),
+    ('sync.info', dict(level='INFO')),
+]
+
+
+class Recorder(logging.Handler):
+
+    def __init__(self):
+        super(Recorder, self).__init__()
+        self.calls = []
+
+    def emit(self, record):
+        self.calls.append((record.levelno, record.msg, record.args))
+
+
+class NullCursor(object):
+
+    def execute(self, query, args=None):
+        pass
+
+
+def record_job(args, tempdir):
+    '''
+    The log calls made while the watcher processes one synthetic frame
+    '''
+    field = Field(argparse.Namespace(
+        nstars=args.nstars, njobs=1, seeing=args.seeing,
+        transparency=args.transparency, compress=False,
+        detector=args.detector, latency=0., seed=args.seed), tempdir)
+    connection = field.connection()
+    queue_job(connection.cursor(), field.filenames[0])
+    connection.commit()
+
+    recorder = Recorder()
+    configure_logging(handlers=[recorder])
+    watcher_loop_step(connection)
+    return recorder.calls
+
+
+def replay(calls, njobs, rows):
+    '''
+    Make the log calls of `njobs` jobs, each uploading `rows` entries one
+    at a time
+    '''
+    entry = TransmissionEntry(
+        image_id=1, image_mean_flux=1E4, mean_flux_ratio=1.,
+        median_flux_ratio=1., flux_ratio_err=0.01, flux_ratio_lq=0.9,
+        flux_ratio_uq=1.1, flux_ratio_stdev=0.1, flag=0)
+    cursor = NullCursor()
+    for _ in range(njobs):
+        for level, msg, msg_args in calls:
+            if isinstance(msg_args, dict):
+                msg_args = (msg_args,)
+            logger.log(level, msg, *msg_args)
+        for _ in range(rows):
+            entry.upload_to_database(cursor)
+
+
+def run_mode(calls, args, tempdir, name, options):
+    devnull = open(os.devnull, 'w')
+    handlers = [logging.FileHandler(os.path.join(tempdir, name + '.log')),
+                logging.StreamHandler(devnull)]
+    for handler in handlers:
+        handler.setFormatter(logs.formatter)
+    sample_every = args.sample if name.endswith('sampled') else 1
+    configure_logging(handlers=handlers, sample_every=sample_every,
+                      queue_size=args.queue_size, **options)
+
+    start = time.time()
+    replay(calls, args.njobs, args.rows)
+    elapsed = time.time() - start
+
+    queue_handler = logs.logging_state.queue_handler
+    dropped = queue_handler.dropped if queue_handler is not None else 0
+    start = time.time()
+    logs.logging_state.stop_async()
+    drain = time.time() - start
+
+    for handler in handlers:
+        handler.close()
+    devnull.close()
+    return elapsed, drain, dropped
+
+
+def main(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        calls = record_job(args, tempdir)
+        print('{} log calls per job, plus {} per-row uploads'.format(
+            len(calls), args.rows))
+
+        results = [(name,) + run_mode(calls, args, tempdir, name, options)
+                   for (name, options) in MODES]
+    finally:
+        configure_logging(handlers=[logs.fh, logs.ch])
+        shutil.rmtree(tempdir)
+
+    baseline = results[0][1]
+    print('{:>15s} {:>12s} {:>12s} {:>12s} {:>8s}'.format(
+        'mode', 'us/job', 'logging', 'drain (s)', 'dropped'))
+    for name, elapsed, drain, dropped in results:
+        print('{:>15s} {:12.1f} {:12.1f} {:12.3f} {:8d}'.format(
+            name, elapsed / args.njobs * 1E6,
+            (elapsed - baseline) / args.njobs * 1E6, drain, dropped))
+
+
+if __name__ == '__main__':
+    description = '''
+    Time how long logging takes the processing thread per job. The log calls
+    the watcher makes for one synthetic frame are recorded, then replayed
+    for many jobs, together with per-row uploads, with each logging mode.
+    "logging" is the time per job over that with logging off.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-j', '--njobs', type=int, default=2000,
+                        help='Jobs to replay')
+    parser.add_argument('--rows', type=int, default=10,
+                        help='Entries uploaded one at a time per job')
+    parser.add_argument('--sample', type=int, default=100,
+                        help='Per-row sampling in the sampled mode')
+    parser.add_argument('--queue-size', type=int, default=0,
+                        help='Records queued before dropping, 0 for no '
+                        'limit (the watcher uses {})'.format(logs.QUEUE_SIZE))
+    parser.add_argument('-n', '--nstars', type=int, default=500,
+                        help='Stars in the recorded field')
+    parser.add_argument('--seeing', type=float, default=2.5)
+    parser.add_argument('--transparency', type=float, default=0.8)
+    parser.add_argument('--detector', default='native',
+                        choices=['imcore', 'native'])
+    parser.add_argument('-s', '--seed', type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import mock
+import numpy as np
+
+from ngts_transmission import watching
+from ngts_transmission.image import ImageFile
+from ngts_transmission.transmission import Photometry
+from ngts_transmission.watching import (Job, measure_transmission,
+                                        process_jobs_pipelined)
+from synthetic import synthetic_stars, render_frame, write_frame
+
+
+def write_jobs(tempdir, njobs, nstars, seed):
+    x, y, flux = synthetic_stars(nstars, seed=seed)
+    index = (x > 532) & (x < 1556) & (y > 512) & (y < 1536)
+    catalogue = Photometry(x[index], y[index], np.ones(index.sum()) * 3.,
+                           flux[index], ref_image_id=10101)
+
+    jobs = []
+    for i in range(njobs):
+        data = render_frame(x, y, flux, seed=seed + i)
+        filename = write_frame(
+            data, os.path.join(tempdir, 'IMAGE{}.fits'.format(i)),
+            header={'image_id': i, 'agrefimg': 10101}, compress=True)
+        jobs.append(Job(job_id=i, filename=filename[:-len('.bz2')]))
+    return jobs, catalogue
+
+
+def run_serial(jobs, catalogue, db_latency, io_latency):
+    '''
+    The work of `process_jobs` for each job in turn, with the database
+    replaced by a fixed delay
+    '''
+    for transmission_job in jobs:
+        time.sleep(io_latency)
+        with ImageFile(transmission_job.real_filename) as image:
+            image.header
+            time.sleep(db_latency)
+            measure_transmission((transmission_job, image, catalogue))
+    time.sleep(db_latency)
+
+
+def run_pipelined(jobs, catalogue, db_latency, io_latency, depth,
+                  prefetch_threads):
+    read_image = watching.prefetch_image
+
+    def prefetch_image(item):
+        time.sleep(io_latency)
+        return read_image(item)
+
+    def prepare_image(cursor, image):
+        time.sleep(db_latency)
+        return catalogue
+
+    def upload_results(cursor, completed):
+        time.sleep(db_latency)
+
+    with mock.patch.object(watching, 'prefetch_image', prefetch_image), \
+            mock.patch.object(watching, 'prepare_image', prepare_image), \
+            mock.patch.object(watching, 'upload_results', upload_results):
+        return process_jobs_pipelined(None, jobs, depth=depth,
+                                      prefetch_threads=prefetch_threads)
+
+
+def main(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        jobs, catalogue = write_jobs(tempdir, args.njobs, args.nstars,
+                                     args.seed)
+
+        start = time.time()
+        run_serial(jobs, catalogue, args.db_latency, args.io_latency)
+        serial = time.time() - start
+        print('{:>10s}: {:8.3f} s'.format('serial', serial))
+
+        for threads in args.prefetch_threads:
+            start = time.time()
+            stats = run_pipelined(jobs, catalogue, args.db_latency,
+                                  args.io_latency, args.depth, threads)
+            pipelined = time.time() - start
+            print('{:>10s}: {:8.3f} s, speedup {:.2f}, {} prefetch '
+                  'threads'.format('pipelined', pipelined,
+                                   serial / pipelined, threads))
+
+            for stage in stats:
+                print('{name:>10s}: busy {busy:8.3f} s, utilisation '
+                      '{utilisation:5.1%}, queue depth mean {mean_depth:.1f} '
+                      'max {max_depth}'.format(**stage))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    description = '''
+    Compare processing a batch of synthetic bz2 compressed frames one at a
+    time with the pipelined watcher, which reads and decompresses the next
+    frame while measuring the current one
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-j', '--njobs', type=int, default=10)
+    parser.add_argument('-n', '--nstars', type=int, default=5000)
+    parser.add_argument('-d', '--depth', type=int, default=2,
+                        help='Pipeline queue depth')
+    parser.add_argument('-t', '--prefetch-threads', type=int, nargs='+',
+                        default=[1, 2, 4],
+                        help='Numbers of prefetch threads to compare')
+    parser.add_argument('--db-latency', type=float, default=0.02,
+                        help='Simulated database time per query (s)')
+    parser.add_argument('--io-latency', type=float, default=0.5,
+                        help='Simulated network filesystem delay per '
+                        'image (s)')
+    parser.add_argument('-s', '--seed', type=int, default=42)
+    main(parser.parse_args())
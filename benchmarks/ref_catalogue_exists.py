@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import sys
+import time
+import numpy as np
+
+from ngts_transmission.db import (connect_to_database_from_args,
+                                  add_database_arguments, database_schema,
+                                  database_indexes, raw_create_table,
+                                  raw_create_indexes)
+from ngts_transmission.watching import ref_catalogue_exists
+
+LEGACY_QUERY = 'select distinct ref_image_id from transmission_sources'
+UNINDEXED_QUERY = '''select 1 from transmission_sources
+ignore index (ref_image_id_idx) where ref_image_id = %s limit 1'''
+
+
+def legacy_ref_catalogue_exists(cursor, ref_id):
+    cursor.execute(LEGACY_QUERY)
+    ref_ids = set([row[0] for row in cursor])
+    return ref_id in ref_ids
+
+
+def unindexed_ref_catalogue_exists(cursor, ref_id):
+    cursor.execute(UNINDEXED_QUERY, (ref_id,))
+    return any(True for _ in cursor)
+
+
+def seed_table(cursor, nrows, nrefs, chunk_size=10000):
+    schema = database_schema()
+    cursor.execute('drop table if exists transmission_sources')
+    cursor.execute(raw_create_table('transmission_sources', schema))
+    for query in raw_create_indexes('transmission_sources',
+                                    database_indexes()):
+        cursor.execute(query)
+
+    query = '''insert into transmission_sources
+    (ref_image_id, x_coordinate, y_coordinate, inc_prescan, flux_adu,
+     aperture_radius) values (%s, %s, %s, %s, %s, %s)'''
+    rng = np.random.RandomState(42)
+    for start in range(0, nrows, chunk_size):
+        n = min(chunk_size, nrows - start)
+        ref_ids = (start + np.arange(n)) % nrefs
+        rows = [(int(ref_id), float(x), float(y), 1, float(flux), 3.)
+                for (ref_id, x, y, flux) in zip(
+                    ref_ids,
+                    rng.uniform(532, 1536, n),
+                    rng.uniform(512, 1536, n),
+                    rng.uniform(2E3, 9E4, n))]
+        cursor.executemany(query, rows)
+        print('Seeded {} rows'.format(start + n), file=sys.stderr)
+
+
+def time_lookups(fn, cursor, ref_ids, **kwargs):
+    start = time.time()
+    for ref_id in ref_ids:
+        fn(cursor, ref_id, **kwargs)
+    return (time.time() - start) / len(ref_ids)
+
+
+def main(args):
+    if args.db_name == 'ngts_ops':
+        raise ValueError('Refusing to seed the operations database, '
+                         'choose a scratch database with --db-name')
+
+    with connect_to_database_from_args(args) as cursor:
+        if args.seed:
+            seed_table(cursor, args.nrows, args.nrefs)
+
+        # Half of the lookups are for catalogues which do not exist
+        ref_ids = list(range(0, 2 * args.nrefs, max(1, args.nrefs // 50)))
+        known_ref_ids = set()
+
+        results = [
+            ('legacy full scan', time_lookups(
+                legacy_ref_catalogue_exists, cursor, ref_ids[:args.legacy])),
+            ('point lookup, no index', time_lookups(
+                unindexed_ref_catalogue_exists, cursor,
+                ref_ids[:args.legacy])),
+            ('point lookup, indexed', time_lookups(
+                ref_catalogue_exists, cursor, ref_ids)),
+            ('indexed, known set (cold)', time_lookups(
+                ref_catalogue_exists, cursor, ref_ids,
+                known_ref_ids=known_ref_ids)),
+            ('indexed, known set (warm)', time_lookups(
+                ref_catalogue_exists, cursor, ref_ids,
+                known_ref_ids=known_ref_ids)),
+        ]
+
+    for name, elapsed in results:
+        print('{:>28s}: {:10.3f} ms per lookup'.format(name, elapsed * 1E3))
+
+
+if __name__ == '__main__':
+    description = '''
+    Compare the cost of checking for an existing reference catalogue against
+    a transmission_sources table seeded with millions of rows. Must be run
+    against a scratch database.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument('--seed', action='store_true',
+                        help='(Re)create and seed the table first')
+    parser.add_argument('--nrows', type=int, default=5000000,
+                        help='Number of source rows to seed')
+    parser.add_argument('--nrefs', type=int, default=2500,
+                        help='Number of distinct reference catalogues')
+    parser.add_argument('--legacy', type=int, default=5,
+                        help='Number of lookups to time for the slow methods')
+    main(parser.parse_args())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from ngts_transmission.catalogue import build_catalogue
+from ngts_transmission.cache import reference_catalogues
+from ngts_transmission.metrics import metrics
+from ngts_transmission.transmission import (
+    extract_photometry_results_from_ref_id)
+from ngts_transmission.watching import watcher_loop_step
+from synthetic import synthetic_stars, render_frame, write_frame
+from standin import (StandInConnection, create_tables, create_ops_tables,
+                     queue_job)
+
+REF_IMAGE_ID = 10101
+FIELD, CAMERA_ID = 'NG0000-0000', 801
+
+
+class Field(object):
+    '''
+    Synthetic reference and science frames of one field, and a stand-in
+    database describing them
+    '''
+
+    def __init__(self, args, tempdir):
+        self.args = args
+        self.tempdir = tempdir
+        self.stars = synthetic_stars(args.nstars, seed=args.seed)
+        self.ref_filename = write_frame(
+            render_frame(*self.stars, fwhm=args.seeing, seed=args.seed),
+            os.path.join(tempdir, 'REF.fits'),
+            header={'image_id': REF_IMAGE_ID})
+        self.filenames = []
+        for i in range(args.njobs):
+            data = render_frame(*self.stars, fwhm=args.seeing,
+                                transparency=args.transparency,
+                                seed=args.seed + i + 1)
+            filename = os.path.join(tempdir, 'IMAGE{}.fits'.format(i))
+            write_frame(data, filename,
+                        header={'image_id': i, 'agrefimg': REF_IMAGE_ID},
+                        compress=args.compress)
+            self.filenames.append(filename)
+
+    def connection(self, with_catalogue=True):
+        connection = StandInConnection(latency=self.args.latency / 1E3)
+        create_tables(connection)
+        create_ops_tables(connection)
+        cursor = connection.cursor()
+        cursor.execute('''insert into ngts_ops.autoguider_refimage
+        (ref_image_id, field, camera_id, filename) values (%s, %s, %s, %s)
+        ''', (REF_IMAGE_ID, FIELD, CAMERA_ID, self.ref_filename))
+        for i in range(self.args.njobs):
+            cursor.execute('''insert into ngts_ops.raw_image_list
+            (image_id, field, camera_id) values (%s, %s, %s)''',
+                           (i, FIELD, CAMERA_ID))
+        if with_catalogue:
+            self.build_catalogue(cursor)
+        connection.commit()
+        return connection
+
+    def build_catalogue(self, cursor):
+        build_catalogue(self.ref_filename, cursor,
+                        detector=self.args.detector)
+
+    def image_filename(self, i):
+        return self.filenames[i] + ('.bz2' if self.args.compress else '')
+
+
+def timed(fn, repeats, setup=None):
+    '''
+    Run `fn(state)` `repeats` times, where `state` is the result of
+    `setup()`, which is not timed
+    '''
+    times = []
+    for _ in range(repeats):
+        state = setup() if setup is not None else None
+        start = time.time()
+        fn(state)
+        times.append(time.time() - start)
+    return times
+
+
+def bench_build_catalogue(field, repeats):
+    def setup():
+        return field.connection(with_catalogue=False).cursor()
+    return {'build_catalogue': timed(field.build_catalogue, repeats, setup)}
+
+
+def bench_photometry(field, repeats):
+    cursor = field.connection().cursor()
+    filename = field.image_filename(0)
+
+    def measure(cache):
+        extract_photometry_results_from_ref_id(
+            filename, REF_IMAGE_ID, cursor, 4., 8., cache=cache)
+
+    def cold(_):
+        measure(None)
+
+    reference_catalogues.invalidate()
+    measure(reference_catalogues)
+    return {
+        'photometry.uncached_catalogue': timed(cold, repeats),
+        'photometry.cached_catalogue': timed(
+            lambda _: measure(reference_catalogues), repeats),
+    }
+
+
+def bench_watcher(field, repeats, name, **kwargs):
+    '''
+    Time per job of draining the queue with `watcher_loop_step`, and the
+    median time of each stage
+    '''
+    def setup():
+        connection = field.connection()
+        cursor = connection.cursor()
+        for filename in field.filenames:
+            queue_job(cursor, filename)
+        connection.commit()
+        reference_catalogues.invalidate()
+        metrics.reset()
+        return connection
+
+    def drain(connection):
+        while True:
+            watcher_loop_step(connection, **kwargs)
+            cursor = connection.cursor()
+            cursor.execute('select count(*) from job_queue')
+            if not cursor.fetchone()[0]:
+                break
+
+    times = [t / field.args.njobs for t in timed(drain, repeats, setup)]
+    results = {name: times}
+    for histogram in metrics.snapshot()['histograms']:
+        if histogram['name'] == 'stage_seconds':
+            results['{}.stage.{}'.format(
+                name, histogram['labels']['stage'])] = [histogram['p50']]
+    return results
+
+
+def summarise(times):
+    return {'median': float(np.median(times)), 'min': float(np.min(times)),
+            'repeats': len(times), 'unit': 's'}
+
+
+def metadata(args):
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'parameters': vars(args),
+    }
+
+
+def compare(results, baseline, tolerance, min_time):
+    '''
+    Print the change in median time of each benchmark against `baseline`,
+    returning the names of those slower by more than `tolerance`. Changes
+    of less than `min_time` are timing noise, and never reported.
+    '''
+    regressions = []
+    print('{:>55s} {:>12s} {:>12s} {:>8s}'.format(
+        'benchmark', 'baseline (s)', 'now (s)', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median'], results[name]['median']
+        change = after / before - 1 if before > 0 else 0.
+        flag = ''
+        if change > tolerance and after - before > min_time:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('{:>55s} {:12.4f} {:12.4f} {:+7.1%}{}'.format(
+            name, before, after, change, flag))
+    return regressions
+
+
+def main(args):
+    tempdir = tempfile.mkdtemp()
+    try:
+        field = Field(args, tempdir)
+        raw = {}
+        raw.update(bench_build_catalogue(field, args.repeats))
+        raw.update(bench_photometry(field, args.repeats))
+        raw.update(bench_watcher(field, args.repeats, 'watcher_loop_step'))
+        raw.update(bench_watcher(field, args.repeats,
+                                 'watcher_loop_step.pipelined',
+                                 pipeline_depth=2))
+    finally:
+        shutil.rmtree(tempdir)
+
+    results = dict((name, summarise(times)) for (name, times) in raw.items())
+    for name in sorted(results):
+        print('{:>55s}: {median:10.4f} s (min {min:.4f} s)'.format(
+            name, **results[name]))
+
+    if args.output is not None:
+        with open(args.output, 'w') as outfile:
+            json.dump({'metadata': metadata(args), 'results': results},
+                      outfile, indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)['results']
+        if compare(results, baseline, args.tolerance, args.min_time / 1E3):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    description = '''
+    Benchmark catalogue building, photometry and the watcher loop on
+    synthetic frames against a local stand-in database. Save the results
+    with --output, and compare a later run with --compare to catch
+    regressions.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--nstars', type=int, default=5000,
+                        help='Stars in the field')
+    parser.add_argument('-j', '--njobs', type=int, default=5,
+                        help='Science frames to process')
+    parser.add_argument('--seeing', type=float, default=2.5,
+                        help='PSF FWHM (pixels)')
+    parser.add_argument('--transparency', type=float, default=0.8,
+                        help='Flux of the science frames relative to the '
+                        'reference')
+    parser.add_argument('--compress', action='store_true',
+                        help='bz2 compress the science frames')
+    parser.add_argument('--detector', default='native',
+                        choices=['imcore', 'native'],
+                        help='Source detection backend')
+    parser.add_argument('-l', '--latency', type=float, default=0.,
+                        help='Simulated database round trip (ms)')
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('-s', '--seed', type=int, default=42)
+    parser.add_argument('-o', '--output', help='Write the results as JSON')
+    parser.add_argument('-c', '--compare',
+                        help='Results file from an earlier run to compare '
+                        'against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='Fractional slow down reported as a '
+                        'regression')
+    parser.add_argument('--min-time', type=float, default=1.,
+                        help='Smallest slow down reported as a regression '
+                        '(ms)')
+    main(parser.parse_args())
@@ -0,0 +1,147 @@
+'''
+A local database stand-in for the MySQL server, for benchmarks that must
+run without access to the observatory database.
+
+Wraps an in-memory sqlite database in the pymysql interface used by the
+package, translating the handful of MySQL specific constructs we rely on.
+An optional per-statement latency emulates the network round trip to the
+real server.
+
+Times are stored as unix timestamps, so `now()` and `unix_timestamp()`
+translate to integer seconds. The operations tables queried with an
+explicit `ngts_ops.` prefix live in an attached database of that name.
+'''
+
+import re
+import sqlite3
+import time
+
+from ngts_transmission.db import database_schema, raw_create_table
+
+GROUP_CONCAT = re.compile(
+    r"group_concat\(concat_ws\('(.*?)', (\w+), (\w+)\) separator '(.*?)'\)")
+
+OPS_TABLES = [
+    '''create table job_queue (
+    job_id integer primary key autoincrement, job_type text,
+    submitted integer, expires integer)''',
+    '''create table job_args (
+    job_id integer, arg_key text, arg_value text,
+    primary key (job_id, arg_key))''',
+    '''create table ngts_ops.raw_image_list (
+    image_id integer primary key, field text, camera_id integer)''',
+    '''create table ngts_ops.autoguider_refimage (
+    ref_image_id integer primary key, field text, camera_id integer,
+    filename text)''',
+]
+
+
+def translate(query):
+    query = query.replace('%s', '?')
+    query = GROUP_CONCAT.sub(r"group_concat(\2 || '\1' || \3, '\4')", query)
+    return (query
+            .replace('auto_increment', 'autoincrement')
+            .replace('unix_timestamp(submitted)', 'submitted')
+            .replace('now()', "cast(strftime('%s', 'now') as integer)"))
+
+
+class StandInCursor(object):
+
+    def __init__(self, cursor, latency=0.):
+        self._cursor = cursor
+        self.latency = latency
+        self.statements = 0
+
+    def _round_trip(self):
+        self.statements += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def execute(self, query, args=None):
+        self._round_trip()
+        self._cursor.execute(translate(query), tuple(args or ()))
+        return self._cursor.rowcount
+
+    def executemany(self, query, args):
+        self._round_trip()
+        self._cursor.executemany(translate(query), [tuple(a) for a in args])
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+
+class StandInConnection(object):
+    '''
+    Behaves like a pymysql connection: used as a context manager it yields a
+    cursor and commits on success
+    '''
+
+    def __init__(self, path=':memory:', latency=0.):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("attach ':memory:' as ngts_ops")
+        self.latency = latency
+
+    def cursor(self):
+        return StandInCursor(self._connection.cursor(), latency=self.latency)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self.cursor()
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+def create_tables(connection):
+    schema = database_schema()
+    cursor = connection.cursor()
+    for table_name in schema:
+        cursor.execute(raw_create_table(table_name, schema))
+    connection.commit()
+
+
+def create_ops_tables(connection):
+    '''
+    The parts of the operations database the watcher reads: the job queue,
+    and the tables linking images to their autoguider reference image
+    '''
+    cursor = connection.cursor()
+    for query in OPS_TABLES:
+        cursor.execute(query)
+    connection.commit()
+
+
+def queue_job(cursor, filename, lifetime=86400):
+    now = int(time.time())
+    cursor.execute('''insert into job_queue (job_type, submitted, expires)
+    values (%s, %s, %s)''', ('transparency', now, now + lifetime))
+    job_id = cursor.lastrowid
+    cursor.execute('''insert into job_args (job_id, arg_key, arg_value)
+    values (%s, %s, %s)''', (job_id, 'file', filename))
+    return job_id
@@ -0,0 +1,67 @@
+'''
+Synthetic NGTS frames with stars of a known PSF, for benchmarks which must
+run without access to real data
+'''
+
+import bz2
+import numpy as np
+from astropy.io import fits
+
+# Full frame including the prescan and overscan regions
+FRAME_SHAPE = (2048, 2088)
+
+
+def synthetic_stars(nstars, shape=FRAME_SHAPE, seed=None):
+    '''
+    Uniformly distributed star positions with a power law flux distribution
+    '''
+    rng = np.random.RandomState(seed)
+    ny, nx = shape
+    x = rng.uniform(0, nx, nstars)
+    y = rng.uniform(0, ny, nstars)
+    flux = 2E3 * (1. - rng.uniform(0, 1, nstars)) ** -1.2
+    return x, y, flux
+
+
+def render_frame(x, y, flux, shape=FRAME_SHAPE, fwhm=2.5, sky=1000.,
+                 transparency=1., read_noise=10., seed=None):
+    '''
+    Render gaussian stars of total `flux` scaled by `transparency`, onto a
+    sky background with poisson and read noise, as a 16 bit image
+    '''
+    rng = np.random.RandomState(seed)
+    sigma = fwhm / 2.3548
+    half_width = int(np.ceil(5 * sigma))
+    image = np.zeros(shape)
+    ny, nx = shape
+
+    yy, xx = np.mgrid[-half_width:half_width + 1, -half_width:half_width + 1]
+    for xc, yc, f in zip(x, y, flux * transparency):
+        ix, iy = int(round(xc)), int(round(yc))
+        x0, x1 = max(ix - half_width, 0), min(ix + half_width + 1, nx)
+        y0, y1 = max(iy - half_width, 0), min(iy + half_width + 1, ny)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        stamp = np.exp(-((xx + ix - xc) ** 2 + (yy + iy - yc) ** 2) /
+                       (2 * sigma ** 2))
+        stamp *= f / (2 * np.pi * sigma ** 2)
+        image[y0:y1, x0:x1] += stamp[y0 - iy + half_width:y1 - iy + half_width,
+                                     x0 - ix + half_width:x1 - ix + half_width]
+
+    image = rng.poisson(image + sky) + rng.normal(0, read_noise, shape)
+    return np.clip(image, 0, 2 ** 16 - 1).astype(np.uint16)
+
+
+def write_frame(data, filename, header=None, compress=False):
+    '''
+    Write the frame, optionally bz2 compressed, returning the filename
+    '''
+    phdu = fits.PrimaryHDU(data, header=fits.Header(header or {}))
+    if not compress:
+        phdu.writeto(filename, overwrite=True)
+        return filename
+
+    filename = filename + '.bz2'
+    with bz2.BZ2File(filename, 'wb') as outfile:
+        phdu.writeto(outfile)
+    return filename
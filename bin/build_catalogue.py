@@ -4,15 +4,20 @@
 from __future__ import division, print_function, absolute_import
 import argparse
 
-from ngts_transmission.catalogue import build_catalogue
-from ngts_transmission.db import add_database_arguments
+from ngts_transmission.catalogue import (build_catalogue, default_filters,
+                                         DETECTORS)
+from ngts_transmission.db import (add_database_arguments,
+                                  add_insert_arguments, insert_settings)
 from ngts_transmission.logs import logger
+from ngts_transmission.storage import catalogue_store, add_storage_argument
 
 
 def main(args):
     if args.verbose:
         logger.setLevel('DEBUG')
     logger.debug(args)
+    catalogue_store.use(args.catalogue_storage)
+    insert_settings.chunk_size = args.insert_chunk_size
 
     build_catalogue(
         refimage=args.refimage,
@@ -26,7 +31,13 @@ def main(args):
         db_user=args.db_user,
         db_name=args.db_name,
         db_socket=args.db_socket,
-        fits_out=args.fits_out,)
+        fits_out=args.fits_out,
+        detector=args.detector,
+        source_filters=default_filters(
+            isolation_radius=args.isolation_radius,
+            edge_margin=args.edge_margin,
+            flux_lim_low=args.flux_low,
+            flux_lim_high=args.flux_high),)
 
 
 if __name__ == '__main__':
@@ -41,6 +52,8 @@ if __name__ == '__main__':
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('refimage')
     add_database_arguments(parser)
+    add_storage_argument(parser)
+    add_insert_arguments(parser)
     parser.add_argument('-n', '--npix',
                         required=False,
                         default=2,
@@ -67,5 +80,25 @@ if __name__ == '__main__':
                         default=3.,
                         type=float,
                         help='Aperture radius (pix)')
+    parser.add_argument('-e', '--edge-margin',
+                        required=False,
+                        default=512,
+                        type=int,
+                        help='Exclude sources this close to the edge (pix)')
+    parser.add_argument('--flux-low',
+                        required=False,
+                        default=1E3,
+                        type=float,
+                        help='Lower peak flux limit (ADU)')
+    parser.add_argument('--flux-high',
+                        required=False,
+                        default=45E3,
+                        type=float,
+                        help='Upper peak flux limit (ADU)')
+    parser.add_argument('-d', '--detector',
+                        required=False,
+                        default='imcore',
+                        choices=sorted(DETECTORS),
+                        help='Source detection backend')
     parser.add_argument('--fits-out', required=False)
     main(parser.parse_args())
@@ -6,7 +6,8 @@ import argparse
 
 from ngts_transmission.logs import logger
 from ngts_transmission.db import (connect_to_database_from_args, add_database_arguments,
-                                  database_schema, raw_create_table)
+                                  database_schema, database_indexes,
+                                  raw_create_table, create_indexes)
 
 
 def main(args):
@@ -15,6 +16,7 @@ def main(args):
     logger.debug(args)
 
     schema = database_schema()
+    indexes = database_indexes()
 
     tables = {}
     for table_name in schema:
@@ -23,14 +25,19 @@ def main(args):
 
     with connect_to_database_from_args(args) as cursor:
         for table_name, query in tables.items():
-            cursor.execute('drop table if exists {table_name}'.format(
-                table_name=table_name))
-            logger.debug('Executing query `%s`', query)
-            cursor.execute(query)
+            if not args.indexes_only:
+                cursor.execute('drop table if exists {table_name}'.format(
+                    table_name=table_name))
+                logger.debug('Executing query `%s`', query)
+                cursor.execute(query)
+
+            create_indexes(cursor, table_name, indexes)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('--indexes-only', action='store_true',
+                        help='Only add the indexes to existing tables')
     add_database_arguments(parser)
     main(parser.parse_args())
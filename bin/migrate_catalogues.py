@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+
+from ngts_transmission.logs import logger
+from ngts_transmission.db import (add_database_arguments, pool_from_args,
+                                  transaction)
+from ngts_transmission.storage import migrate_catalogue, unmigrated_catalogues
+
+
+def main(args):
+    if args.verbose:
+        logger.setLevel('DEBUG')
+    logger.debug(args)
+
+    db_pool = pool_from_args(args)
+    try:
+        if args.ref_image_ids:
+            ref_image_ids = args.ref_image_ids
+        else:
+            def find(connection):
+                with transaction(connection) as cursor:
+                    return unmigrated_catalogues(cursor)
+            ref_image_ids = db_pool.call(find, idempotent=True)
+        logger.info('%s catalogues to migrate', len(ref_image_ids))
+        if args.dry_run:
+            for ref_image_id in ref_image_ids:
+                print(ref_image_id)
+            return
+
+        nsources = 0
+        for i, ref_image_id in enumerate(ref_image_ids):
+            def migrate(connection):
+                with transaction(connection) as cursor:
+                    return migrate_catalogue(cursor, ref_image_id,
+                                             verify=not args.no_verify)
+            # Replacing the packed record makes each migration idempotent
+            nsources += db_pool.call(migrate, idempotent=True)
+            logger.info('Migrated catalogue %s (%s/%s)', ref_image_id, i + 1,
+                        len(ref_image_ids))
+    finally:
+        db_pool.close()
+    logger.info('Migrated %s catalogues with %s sources', len(ref_image_ids),
+                nsources)
+
+
+if __name__ == '__main__':
+    description = '''
+    Copy reference catalogues from one row per source in
+    transmission_sources to one packed record each in
+    transmission_catalogues, for --catalogue-storage blob. Catalogues
+    already migrated are skipped, so run it again to pick up catalogues
+    built since, and once more just before switching. The rows are kept.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('ref_image_ids', nargs='*', type=int,
+                        help='Catalogues to migrate (or replace), by default '
+                        'all those not yet migrated')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='List the catalogues to migrate and exit')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='Do not read back each record to compare with '
+                        'its rows')
+    add_database_arguments(parser)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    main(parser.parse_args())
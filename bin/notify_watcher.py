@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Wake a transmission watcher started with `--job-source socket`, e.g. after
+submitting a transparency job to the queue
+'''
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import sys
+
+from ngts_transmission.logs import logger
+from ngts_transmission.jobsource import notify, SOCKET_PATH
+
+
+def main(args):
+    if args.verbose:
+        logger.setLevel('DEBUG')
+    logger.debug(args)
+
+    if not notify(args.socket_path):
+        logger.warning('No watcher listening on %s', args.socket_path)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--socket-path',
+                        required=False,
+                        default=SOCKET_PATH,
+                        help='Socket the watcher is listening on')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+from socket import gethostname
+
+from ngts_transmission.logs import logger
+from ngts_transmission.catalogue import DETECTORS
+from ngts_transmission.db import add_database_arguments, pool_from_args
+from ngts_transmission.parallel import build_worker_pool
+from ngts_transmission.prebuild import (CataloguePrebuilder, PaladinHost,
+                                        is_das_node, paladin_running,
+                                        INTERVAL, RETRY_TIME, MAX_ATTEMPTS,
+                                        LOOKBACK)
+from ngts_transmission.storage import catalogue_store, add_storage_argument
+
+
+def main(args):
+    if args.verbose:
+        logger.setLevel('DEBUG')
+    logger.debug(args)
+    catalogue_store.use(args.catalogue_storage)
+
+    # Check before starting any worker processes
+    if is_das_node():
+        raise PaladinHost(gethostname())
+
+    pool = build_worker_pool(args.workers)
+    db_pool = pool_from_args(args)
+    try:
+        prebuilder = CataloguePrebuilder(db_pool, pool,
+                                         workers=args.workers,
+                                         detector=args.detector,
+                                         retry_time=args.retry_time,
+                                         max_attempts=args.max_attempts,
+                                         lookback=args.lookback)
+        if args.once:
+            if paladin_running():
+                logger.info('Paladin is running, not building catalogues')
+            else:
+                prebuilder.step()
+        else:
+            prebuilder.run(interval=args.interval)
+    finally:
+        pool.terminate()
+        db_pool.close()
+
+
+if __name__ == '__main__':
+    description = '''
+    Build the source catalogues of new autoguider reference images before
+    any transmission job needs them. Never runs on a das node, and pauses
+    while Paladin is running.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Catalogues to build at once')
+    parser.add_argument('-i', '--interval', type=float, default=INTERVAL,
+                        help='Seconds between checks for missing catalogues')
+    parser.add_argument('--retry-time', type=float, default=RETRY_TIME,
+                        help='Seconds before retrying a failed reference '
+                        'image')
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help='Failures after which a reference image is '
+                        'never tried again')
+    parser.add_argument('--lookback', type=int, default=LOOKBACK,
+                        help='Number of the newest reference images to '
+                        'check for missing catalogues')
+    parser.add_argument('-d', '--detector', default='imcore',
+                        choices=sorted(DETECTORS),
+                        help='Source detection backend')
+    parser.add_argument('--once', action='store_true',
+                        help='Build one round of catalogues and exit')
+    add_database_arguments(parser)
+    add_storage_argument(parser)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    main(parser.parse_args())
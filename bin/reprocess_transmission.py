@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division, print_function, absolute_import
+import argparse
+import datetime
+import multiprocessing
+
+from ngts_transmission.logs import logger
+from ngts_transmission.db import add_database_arguments, pool_from_args
+from ngts_transmission.backfill import (find_frames, reprocess, Checkpoint,
+                                        CHUNK_SIZE, DEFAULT_PATTERN)
+from ngts_transmission.parallel import build_worker_pool
+from ngts_transmission.storage import catalogue_store, add_storage_argument
+
+
+def parse_time(text):
+    for fmt in ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        'Invalid time {!r}, expected YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS'.format(
+            text))
+
+
+def main(args):
+    if args.verbose:
+        logger.setLevel('DEBUG')
+    logger.debug(args)
+    catalogue_store.use(args.catalogue_storage)
+
+    patterns = args.patterns
+    if not patterns and not args.file_lists:
+        patterns = [DEFAULT_PATTERN]
+
+    filenames = find_frames(patterns=patterns, file_lists=args.file_lists,
+                            start=args.start, end=args.end)
+    logger.info('Found %s frames', len(filenames))
+    if args.dry_run:
+        for filename in filenames:
+            print(filename)
+        return
+
+    checkpoint = Checkpoint(args.checkpoint)
+    pool = build_worker_pool(args.workers)
+    db_pool = pool_from_args(args)
+    try:
+        nprocessed = reprocess(db_pool, filenames, pool,
+                               checkpoint=checkpoint,
+                               chunk_size=args.chunk_size,
+                               sky_radius_inner=args.radius_inner,
+                               sky_radius_outer=args.radius_outer)
+    finally:
+        pool.terminate()
+        db_pool.close()
+    logger.info('Processed %s frames', nprocessed)
+
+
+if __name__ == '__main__':
+    description = '''
+    Measure the transmission of many frames in parallel, replacing any
+    existing results. Frames are given as glob patterns and/or file lists,
+    optionally limited to those taken between --start and --end; with
+    neither, every frame on disk taken in that range is used. Use
+    --checkpoint to be able to resume an interrupted run.
+    '''
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('patterns', nargs='*',
+                        help='Glob patterns of frames, quoted to stop the '
+                        'shell expanding them (default: {})'.format(
+                            DEFAULT_PATTERN))
+    parser.add_argument('-f', '--file-list', action='append', default=[],
+                        dest='file_lists',
+                        help='File listing frames one per line, "-" for '
+                        'stdin. May be given more than once')
+    parser.add_argument('--start', type=parse_time,
+                        help='Only frames taken at or after this time (UTC)')
+    parser.add_argument('--end', type=parse_time,
+                        help='Only frames taken before this time (UTC)')
+    parser.add_argument('-w', '--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('-n', '--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='Frames per transaction')
+    parser.add_argument('-k', '--checkpoint',
+                        help='File recording the frames processed, to skip '
+                        'them when run again')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='List the frames which would be processed')
+    parser.add_argument('--radius-inner', default=4., type=float,
+                        help='Inner sky annulus radius')
+    parser.add_argument('--radius-outer', default=8., type=float,
+                        help='Outer sky annulus radius')
+    add_database_arguments(parser)
+    add_storage_argument(parser)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    main(parser.parse_args())
@@ -8,12 +8,14 @@ from ngts_transmission.logs import logger
 from ngts_transmission.db import (add_database_arguments,
                                   connect_to_database_from_args)
 from ngts_transmission.transmission import TransmissionEntry
+from ngts_transmission.storage import catalogue_store, add_storage_argument
 
 
 def main(args):
     if args.verbose:
         logger.setLevel('DEBUG')
     logger.debug(args)
+    catalogue_store.use(args.catalogue_storage)
 
     with connect_to_database_from_args(args) as cursor:
         entry = TransmissionEntry.from_file(args.filename, cursor,
@@ -36,5 +38,6 @@ if __name__ == '__main__':
                         type=float,
                         help='Outer sky annulus radius')
     add_database_arguments(parser)
+    add_storage_argument(parser)
     parser.add_argument('-v', '--verbose', action='store_true')
     main(parser.parse_args())
@@ -0,0 +1 @@
+create table transmission_catalogue_failures (ref_image_id bigint primary key, attempts integer not null, retry_after datetime not null, permanent tinyint default 0, reason varchar(255));
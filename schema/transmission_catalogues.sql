@@ -0,0 +1 @@
+create table transmission_catalogues (ref_image_id bigint primary key, nsources integer not null, inc_prescan tinyint default 1, data longblob not null);
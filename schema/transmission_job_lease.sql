@@ -0,0 +1 @@
+create table transmission_job_lease (job_id integer primary key, owner varchar(255) not null, expires datetime not null);
@@ -0,0 +1,101 @@
+'''
+Adjust the watcher's batch size and poll interval to the load.
+
+After each poll the controller is told how many jobs were processed, how
+long they took and how many were queued, and chooses:
+
+* the batch size: as many jobs as can be measured within `target_latency`
+  seconds at the recent (exponentially smoothed) time per job, since the
+  results of a batch only become visible when it is committed
+* the poll interval: none while jobs remain queued after a poll which
+  found work, `min_interval` after any other poll which found work or
+  which found queued jobs it could not take, and growing by `backoff`
+  after each empty poll up to `max_interval`, so a quiet night costs few
+  queries
+
+The current decisions are logged, and exported as gauges with the other
+metrics.
+'''
+
+from ngts_transmission.logs import logger
+from ngts_transmission.metrics import metrics
+from ngts_transmission.scheduling import BATCH_SIZE
+
+MIN_BATCH = 5
+MAX_BATCH = 200
+MIN_INTERVAL = 0.5
+MAX_INTERVAL = 10.
+TARGET_LATENCY = 60.
+BACKOFF = 1.5
+
+
+def clamp(value, low, high):
+    return max(low, min(value, high))
+
+
+class AdaptiveController(object):
+
+    def __init__(self, min_batch=MIN_BATCH, max_batch=MAX_BATCH,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 target_latency=TARGET_LATENCY, backoff=BACKOFF,
+                 smoothing=0.3):
+        if min_batch > max_batch or min_interval > max_interval:
+            raise ValueError('Lower bounds must not exceed upper bounds')
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.smoothing = smoothing
+
+        self.batch_size = clamp(BATCH_SIZE, min_batch, max_batch)
+        self.interval = min_interval
+        # Smoothed seconds per job, None until a job has been measured
+        self.service_time = None
+
+    def update(self, njobs, elapsed, backlog):
+        '''
+        Record a poll which processed `njobs` jobs in `elapsed` seconds,
+        with `backlog` jobs queued when it started
+        '''
+        if njobs > 0:
+            per_job = elapsed / njobs
+            if self.service_time is None:
+                self.service_time = per_job
+            else:
+                self.service_time += self.smoothing * (
+                    per_job - self.service_time)
+
+        if self.service_time:
+            self.batch_size = int(clamp(
+                self.target_latency / self.service_time, self.min_batch,
+                self.max_batch))
+
+        remaining = backlog - njobs
+        if remaining > 0 and njobs > 0:
+            # Straight on to the next batch
+            self.interval = 0.
+        elif njobs > 0 or backlog > 0:
+            # Queued jobs which could not be taken (e.g. claimed by another
+            # watcher) must not cause a tight polling loop
+            self.interval = self.min_interval
+        else:
+            self.interval = clamp(
+                max(self.interval, self.min_interval) * self.backoff,
+                self.min_interval, self.max_interval)
+
+        logger.info('Batch size %s, poll interval %.1f s, %s s per job',
+                    self.batch_size, self.interval,
+                    'unknown' if self.service_time is None
+                    else '{:.3f}'.format(self.service_time))
+        for name, value in self.state().items():
+            if value is not None:
+                metrics.set_gauge(name, value)
+
+    def state(self):
+        return {
+            'batch_size': self.batch_size,
+            'poll_interval_seconds': self.interval,
+            'service_time_seconds': self.service_time,
+        }
@@ -0,0 +1,174 @@
+'''
+Aperture photometry for a fixed reference catalogue.
+
+The aperture and sky annulus geometry only depends on the reference
+catalogue, so the exact pixel overlap weights for every star are computed
+once and reused for every frame. Measuring a frame is then a single gather
+of the pixel stamps and a weighted sum.
+
+The weights come from the same exact overlap function photutils uses, and
+the sky is normalised by the analytic annulus area as in
+`transmission.photometry_local`, so results agree with the photutils
+implementation to within floating point rounding (better than 1E-10
+relative for stars with positive flux).
+'''
+
+import hashlib
+import numpy as np
+
+from ngts_transmission.logs import logger
+from ngts_transmission.cache import LRUCache
+
+
+def overlap_weights(dx, dy, radius, half_width):
+    '''
+    Exact overlap of a circle of `radius`, offset by (`dx`, `dy`) from the
+    central pixel centre, with a square stamp of `2 * half_width + 1` pixels
+    '''
+    from photutils.geometry import circular_overlap_grid
+    size = 2 * half_width + 1
+    return circular_overlap_grid(-half_width - 0.5 - dx,
+                                 half_width + 0.5 - dx,
+                                 -half_width - 0.5 - dy,
+                                 half_width + 0.5 - dy,
+                                 size, size, radius, 1, 1)
+
+
+class ApertureEngine(object):
+    '''
+    Precomputed aperture and annulus weights for stars at positions `x`,
+    `y` (pixel centres at integer coordinates, as photutils)
+    '''
+
+    def __init__(self, x, y, aperture_radius, sky_radius_inner=None,
+                 sky_radius_outer=None):
+        self.aperture_radius = aperture_radius
+        self.sky_radius_inner = sky_radius_inner
+        self.sky_radius_outer = sky_radius_outer
+        # Without sky radii the raw aperture sums are returned
+        self.subtract_sky = sky_radius_outer is not None
+        self.half_width = int(np.ceil(max(aperture_radius,
+                                          sky_radius_outer or 0))) + 1
+
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        self.ix = np.floor(x + 0.5).astype(int)
+        self.iy = np.floor(y + 0.5).astype(int)
+        dx, dy = x - self.ix, y - self.iy
+
+        # Rows of (aperture, annulus) weights per star, flattened stamps
+        npix = (2 * self.half_width + 1) ** 2
+        self.weights = np.zeros((x.size, npix, 2))
+        for i in range(x.size):
+            aperture = overlap_weights(dx[i], dy[i], aperture_radius,
+                                       self.half_width)
+            self.weights[i, :, 0] = aperture.ravel()
+            if self.subtract_sky:
+                annulus = (overlap_weights(dx[i], dy[i], sky_radius_outer,
+                                           self.half_width) -
+                           overlap_weights(dx[i], dy[i], sky_radius_inner,
+                                           self.half_width))
+                self.weights[i, :, 1] = annulus.ravel()
+
+        self.aperture_area = np.pi * aperture_radius ** 2
+        if self.subtract_sky:
+            self.annulus_area = np.pi * (sky_radius_outer ** 2 -
+                                         sky_radius_inner ** 2)
+        self._indices = {}
+
+    @property
+    def nbytes(self):
+        '''
+        Memory held by the weights and the stamp indices of each image shape
+        '''
+        return (self.weights.nbytes + self.ix.nbytes + self.iy.nbytes +
+                sum(array.nbytes for arrays in self._indices.values()
+                    for array in arrays))
+
+    def indices(self, shape):
+        '''
+        Flat pixel indices of each stamp in an image of `shape`, the mask of
+        pixels which fall inside the image, and which apertures lie entirely
+        off the image
+        '''
+        if shape not in self._indices:
+            ny, nx = shape
+            offsets = np.arange(-self.half_width, self.half_width + 1)
+            xs = (self.ix[:, None, None] + offsets[None, None, :])
+            ys = (self.iy[:, None, None] + offsets[None, :, None])
+            xs, ys = np.broadcast_arrays(xs, ys)
+            inside = (xs >= 0) & (xs < nx) & (ys >= 0) & (ys < ny)
+            flat = np.where(inside, ys * nx + xs, 0)
+            n = self.ix.size
+            inside = inside.reshape(n, -1)
+            off_image = np.einsum('ij,ij->i', inside.astype(float),
+                                  self.weights[:, :, 0]) == 0
+            self._indices[shape] = (flat.reshape(n, -1), inside, off_image)
+        return self._indices[shape]
+
+    def __call__(self, data):
+        '''
+        Flux of each star, sky subtracted if the annulus radii were given
+        '''
+        flat, inside, off_image = self.indices(data.shape)
+        # Gather before converting, so only the stamp pixels are copied
+        stamps = np.asarray(data).ravel()[flat].astype(float)
+        stamps[~inside] = 0.
+        sums = np.einsum('ij,ijk->ik', stamps, self.weights)
+        flux = sums[:, 0]
+        if self.subtract_sky:
+            bkg_mean = sums[:, 1] / self.annulus_area
+            flux = flux - bkg_mean * self.aperture_area
+
+        # As photutils, apertures entirely off the image have no flux
+        flux[off_image] = np.nan
+        return flux
+
+
+# Engines for recently seen reference catalogues, keyed by reference image,
+# star positions, image origin and aperture geometry. Each engine takes
+# about 9KB per star with the default sky annulus.
+ENGINE_CACHE_BYTES = 256 * 1024 ** 2
+aperture_engines = LRUCache(maxsize=32, maxbytes=ENGINE_CACHE_BYTES)
+
+
+def positions_digest(x, y):
+    '''
+    Identifies the star positions of a catalogue, so an engine is never
+    reused for a catalogue which has since been replaced
+    '''
+    digest = hashlib.sha1()
+    for array in (x, y):
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def invalidate_engines(ref_image_id, cache=aperture_engines):
+    '''
+    Free the engines of a reference catalogue which has been replaced
+    '''
+    cache.invalidate_matching(lambda key: key[0] == ref_image_id)
+
+
+def stamp_photometry(data, x, y, aperture_radius, sky_radius_inner,
+                     sky_radius_outer, key=None, cache=aperture_engines):
+    '''
+    Drop in replacement for `transmission.photometry_local`. If `key` is
+    given the precomputed weights are cached under it and the key must
+    identify the positions.
+    '''
+    engine = None
+    if key is not None and cache is not None:
+        key = key + (aperture_radius, sky_radius_inner, sky_radius_outer)
+        engine = cache.get(key)
+
+    if engine is not None:
+        return engine(data)
+
+    logger.debug('Computing aperture weights for %s stars', len(x))
+    engine = ApertureEngine(x, y, aperture_radius, sky_radius_inner,
+                            sky_radius_outer)
+    flux = engine(data)
+    if key is not None and cache is not None:
+        # Cached once measured, so its size includes the stamp indices
+        cache.put(key, engine)
+    return flux
@@ -0,0 +1,225 @@
+'''
+Reprocess many frames at once, e.g. whole nights after an outage or a
+change to the aperture parameters.
+
+Frames are chosen by glob, file list and the time in their file name, and
+processed in chunks. The worker pool reads the headers and measures the
+photometry, while this process does the database work: each missing
+reference catalogue is built once, catalogues are loaded once and kept in
+the reference catalogue cache, and the results of a chunk replace any
+existing rows of `transmission_log` in one bulk upsert.
+
+Once a chunk is committed its frames are appended to the checkpoint file,
+so a run started again with the same checkpoint skips them. Frames which
+fail are not recorded, and are retried by the next run.
+'''
+
+import glob
+import os
+import sys
+
+from ngts_transmission.logs import logger
+from ngts_transmission.utils import parse_image_name
+from ngts_transmission.db import transaction, chunked
+from ngts_transmission.cache import reference_catalogues
+from ngts_transmission.buildlock import build_lock
+from ngts_transmission.parallel import header_task, transmission_task
+from ngts_transmission.transmission import (Photometry, upload_entries,
+                                            query_for_ref_image_ids)
+from ngts_transmission.watching import (build_missing_catalogues,
+                                        RADIUS_INNER, RADIUS_OUTER)
+
+CHUNK_SIZE = 500
+DEFAULT_PATTERN = os.path.join('/', 'ngts', 'das*', 'action*_observeField',
+                               'IMAGE*.fits*')
+
+
+def frame_key(filename):
+    '''
+    Name of a frame whether or not it is compressed
+    '''
+    return filename[:-len('.bz2')] if filename.endswith('.bz2') else filename
+
+
+def image_time(filename):
+    '''
+    Time the frame was taken, from its file name, or None if the name does
+    not follow the usual pattern
+    '''
+    parsed = parse_image_name(filename)
+    return parsed[1] if parsed is not None else None
+
+
+def read_file_list(path):
+    '''
+    File names listed one per line in `path` ('-' for stdin), ignoring
+    blank lines and comments
+    '''
+    infile = sys.stdin if path == '-' else open(path)
+    try:
+        lines = [line.strip() for line in infile]
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def find_frames(patterns=(), file_lists=(), start=None, end=None):
+    '''
+    Frames matching any of the glob `patterns` or listed in `file_lists`,
+    taken from `start` (inclusive) to `end` (exclusive) if given. A frame
+    present both compressed and uncompressed is only returned once, as the
+    uncompressed file. The result is sorted, so frames of the same field and
+    camera are processed together.
+    '''
+    filenames = []
+    for pattern in patterns:
+        filenames.extend(glob.glob(pattern))
+    for path in file_lists:
+        filenames.extend(read_file_list(path))
+
+    frames = {}
+    for filename in sorted(filenames):
+        if start is not None or end is not None:
+            taken = image_time(filename)
+            if taken is None:
+                continue
+            if start is not None and taken < start:
+                continue
+            if end is not None and taken >= end:
+                continue
+        frames.setdefault(frame_key(filename), filename)
+    return [frames[key] for key in sorted(frames)]
+
+
+class Checkpoint(object):
+    '''
+    Record of the frames already processed, appended to `path` one per line.
+    Without a path nothing is saved.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.done = set()
+        if path is not None and os.path.exists(path):
+            with open(path) as infile:
+                self.done.update(line.strip() for line in infile
+                                 if line.strip())
+            logger.info('Resuming from %s, %s frames already processed',
+                        path, len(self.done))
+
+    def add(self, filenames):
+        keys = [frame_key(filename) for filename in filenames]
+        self.done.update(keys)
+        if self.path is None or not keys:
+            return
+
+        with open(self.path, 'a') as outfile:
+            outfile.write(''.join(key + '\n' for key in keys))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+    def __contains__(self, filename):
+        return frame_key(filename) in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+
+def reprocess_chunk(cursor, filenames, pool, sky_radius_inner=RADIUS_INNER,
+                    sky_radius_outer=RADIUS_OUTER):
+    '''
+    Measure the transmission of `filenames` and upsert the results. Returns
+    the frames which are finished with: those measured, and those skipped
+    because they were not autoguided.
+    '''
+    headers = [(filename, pool.apply_async(header_task, (filename,)))
+               for filename in filenames]
+
+    done, pending = [], []
+    for filename, result in headers:
+        try:
+            image_id, ref_image_id = result.get()
+        except Exception as e:
+            logger.exception('Cannot read header of %s: %s', filename, str(e))
+            continue
+        if ref_image_id is None:
+            logger.info('%s is not autoguided, skipping', filename)
+            done.append(filename)
+        else:
+            pending.append((filename, image_id, ref_image_id))
+
+    failed_ref_ids = build_missing_catalogues(
+        cursor, set(row[2] for row in pending), pool)
+    catalogue_ids = query_for_ref_image_ids(
+        [image_id for (_, image_id, _) in pending], cursor)
+
+    results = []
+    for filename, image_id, ref_image_id in pending:
+        if ref_image_id in failed_ref_ids:
+            continue
+        try:
+            ref_catalogue = Photometry.from_database(
+                cursor, catalogue_ids[image_id], cache=reference_catalogues)
+        except Exception as e:
+            logger.exception('Cannot load reference catalogue for %s: %s',
+                             filename, str(e))
+            continue
+        ref_arrays = (ref_catalogue.x, ref_catalogue.y, ref_catalogue.radius,
+                      ref_catalogue.flux)
+        results.append((filename, pool.apply_async(
+            transmission_task, (filename, image_id,
+                                ref_catalogue.ref_image_id, ref_arrays,
+                                sky_radius_inner, sky_radius_outer))))
+
+    entries = []
+    for filename, result in results:
+        try:
+            entries.append(result.get())
+        except Exception as e:
+            logger.exception('Exception occurred: %s', str(e))
+        else:
+            done.append(filename)
+
+    upload_entries(entries, cursor, chunk_size=max(len(entries), 1),
+                   upsert=True)
+    return done
+
+
+def reprocess(db_pool, filenames, pool, checkpoint=None,
+              chunk_size=CHUNK_SIZE, sky_radius_inner=RADIUS_INNER,
+              sky_radius_outer=RADIUS_OUTER):
+    '''
+    Reprocess `filenames` in chunks of `chunk_size`, each committed in its
+    own transaction, skipping those already in `checkpoint`. Returns the
+    number of frames processed. Results are upserted, so a chunk whose
+    connection is lost is processed again with a new connection from
+    `db_pool`.
+    '''
+    if checkpoint is None:
+        checkpoint = Checkpoint()
+
+    todo = [filename for filename in filenames if filename not in checkpoint]
+    logger.info('%s frames to process, %s already done', len(todo),
+                len(filenames) - len(todo))
+
+    nprocessed = 0
+    for chunk in chunked(todo, chunk_size):
+        def process(connection):
+            try:
+                with transaction(connection) as cursor:
+                    return reprocess_chunk(
+                        cursor, chunk, pool,
+                        sky_radius_inner=sky_radius_inner,
+                        sky_radius_outer=sky_radius_outer)
+            finally:
+                build_lock.release(connection)
+
+        done = db_pool.call(process, idempotent=True)
+        checkpoint.add(done)
+        nprocessed += len(done)
+        logger.info('Processed %s/%s frames, %s failed in this chunk',
+                    nprocessed, len(todo), len(chunk) - len(done))
+        logger.debug('Reference catalogue cache: %s',
+                     reference_catalogues.stats())
+    return nprocessed
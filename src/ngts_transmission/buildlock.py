@@ -0,0 +1,94 @@
+'''
+Single-flight reference catalogue builds.
+
+Without coordination, every job (or watcher, prebuilder or reprocessing
+run) which finds a catalogue missing builds it, and each copy adds another
+full set of rows to `transmission_sources`. Builds instead take a build
+lock, check again whether the catalogue exists, and only then build it.
+
+Between processes the lock is a MySQL named lock (`GET_LOCK`). A named lock
+belongs to the database session rather than the transaction, so it is kept
+until the transaction storing the catalogue has committed, and released
+with `release(connection)`; released any earlier, another process could
+take the lock before the new rows are visible to it. Older MySQL servers
+only allow one named lock per session, so one lock covers every catalogue:
+new fields are rare, and builds seldom overlap.
+
+Within a process a thread lock makes other threads wait for the build
+lock. A process which cannot get the lock within `timeout` seconds raises
+`CatalogueBuildInProgress`, and the job is deferred to the next poll.
+'''
+
+import threading
+
+from ngts_transmission.logs import logger
+
+LOCK_NAME = 'ngtransmission.catalogue_build'
+LOCK_TIMEOUT = 10
+
+
+class CatalogueBuildInProgress(Exception):
+
+    def __init__(self, timeout):
+        super(CatalogueBuildInProgress, self).__init__(
+            'Another process is building a reference catalogue, gave up '
+            'waiting after {} seconds'.format(timeout))
+
+
+class CatalogueBuildLock(object):
+
+    def __init__(self, name=LOCK_NAME, timeout=LOCK_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.local = threading.Lock()
+        self.state = threading.local()
+
+    @property
+    def held(self):
+        return getattr(self.state, 'held', False)
+
+    def acquire(self, cursor):
+        '''
+        Take the lock, unless this thread already holds it
+        '''
+        if self.held:
+            return
+
+        self.local.acquire()
+        try:
+            cursor.execute('select get_lock(%s, %s)',
+                           (self.name, self.timeout))
+            row = cursor.fetchone()
+        except Exception:
+            self.local.release()
+            raise
+
+        # get_lock returns 0 on timeout and NULL on error
+        if row is None or row[0] != 1:
+            self.local.release()
+            raise CatalogueBuildInProgress(self.timeout)
+        logger.debug('Acquired %s', self.name)
+        self.state.held = True
+
+    def release(self, connection):
+        '''
+        Release the lock if this thread holds it. Call once the transaction
+        which stored the catalogue has committed or rolled back.
+        '''
+        if not self.held:
+            return
+
+        try:
+            with connection as cursor:
+                cursor.execute('select release_lock(%s)', (self.name,))
+            logger.debug('Released %s', self.name)
+        except Exception:
+            # The server releases it when the session ends
+            logger.exception('Cannot release %s', self.name)
+        finally:
+            self.state.held = False
+            self.local.release()
+
+
+# Shared by every build in this process
+build_lock = CatalogueBuildLock()
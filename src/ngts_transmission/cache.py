@@ -0,0 +1,113 @@
+from collections import OrderedDict
+import numpy as np
+
+from ngts_transmission.logs import logger
+
+
+class LRUCache(object):
+    '''
+    Bounded mapping which evicts the least recently used entry, counting
+    hits, misses and evictions. With `maxbytes`, the total `nbytes` of the
+    values is bounded too, and a value larger than that is never stored.
+    '''
+
+    def __init__(self, maxsize=32, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        # Re-insert to mark as most recently used
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        size = getattr(value, 'nbytes', 0)
+        if self.maxbytes is not None and size > self.maxbytes:
+            logger.debug('Not caching %s byte entry %s in %s', size, key,
+                         self.__class__.__name__)
+            return
+
+        self._remove(key)
+        self._entries[key] = value
+        self._sizes[key] = size
+        self.nbytes += size
+        while len(self._entries) > self.maxsize or (
+                self.maxbytes is not None and self.nbytes > self.maxbytes):
+            evicted = next(iter(self._entries))
+            self._remove(evicted)
+            self.evictions += 1
+            logger.debug('Evicted %s from %s', evicted,
+                         self.__class__.__name__)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self.nbytes -= self._sizes.pop(key, 0)
+
+    def invalidate(self, key=None):
+        '''
+        Remove a single entry, or all of them if no key is given
+        '''
+        if key is None:
+            self._entries.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+        else:
+            self._remove(key)
+
+    def invalidate_matching(self, predicate):
+        '''
+        Remove every entry whose key satisfies `predicate`
+        '''
+        for key in [key for key in self._entries if predicate(key)]:
+            self._remove(key)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'nbytes': self.nbytes,
+            'maxbytes': self.maxbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ReferenceCatalogueCache(LRUCache):
+    '''
+    Reference catalogues keyed by `ref_image_id`. Each entry is a tuple of
+    read-only numpy arrays in the column order of `Photometry` (x, y,
+    radius, flux).
+    '''
+
+    def put(self, ref_image_id, arrays):
+        arrays = tuple(np.asarray(array) for array in arrays)
+        for array in arrays:
+            array.flags.writeable = False
+        super(ReferenceCatalogueCache, self).put(ref_image_id, arrays)
+
+
+# Shared by every job in this process
+reference_catalogues = ReferenceCatalogueCache()
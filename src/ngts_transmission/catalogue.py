@@ -1,14 +1,17 @@
 from __future__ import division, print_function, absolute_import
-from astropy.io import fits
 from collections import namedtuple
 import tempfile
 import subprocess as sp
 import numpy as np
-from scipy.spatial import KDTree
 
 from ngts_transmission.logs import logger
 from ngts_transmission.utils import open_fits
+from ngts_transmission.image import ImageFile, image_context
+from ngts_transmission.detection import native_source_detect
 from ngts_transmission.db import database_schema, connect_to_database
+from ngts_transmission.cache import reference_catalogues
+from ngts_transmission.aperture import invalidate_engines
+from ngts_transmission.storage import catalogue_store
 
 schema = database_schema()['transmission_sources']
 
@@ -16,11 +19,13 @@ TransmissionCatalogueEntry = namedtuple('TransmissionCatalogueEntry',
                                         [key for key in schema if key != 'id'])
 
 
-def image_has_prescan(fname):
-    return fits.getdata(fname).shape == (2048, 2088)
+def image_has_prescan(fname, image=None):
+    with image_context(fname, image) as image:
+        return image.shape == (2048, 2088)
 
 
-def source_detect(fname, n_pixels, threshold, fwhmfilt, aperture_radius):
+def source_detect(fname, n_pixels, threshold, fwhmfilt, aperture_radius,
+                  image=None):
     logger.info('Running source detect')
     logger.debug('n_pixels: %s, threshold: %s', n_pixels, threshold)
     with tempfile.NamedTemporaryFile(suffix='.fits') as tfile:
@@ -35,44 +40,121 @@ def source_detect(fname, n_pixels, threshold, fwhmfilt, aperture_radius):
             return infile[1].data
 
 
-def isolated_index(x, y, radius=6.):
-    logger.info('Filtering with an isolation radius: %s', radius)
-    tree = KDTree(np.vstack([x, y]).T)
-    index = np.zeros_like(x, dtype=bool)
-    for i in np.arange(x.size):
-        within = tree.query_ball_point((x[i], y[i]), radius)
-        # There should be only one star (the target) within `radius` pixels
-        if len(within) == 1:
-            index[i] = True
+# Source detection backends, selected by name
+DETECTORS = {
+    'imcore': source_detect,
+    'native': native_source_detect,
+}
+
+
+def isolated_index(x, y, radius=6., subset=None):
+    '''
+    Boolean index of the sources with no neighbour within `radius` pixels.
 
+    Neighbours are counted for all sources in one batched tree query. If
+    `subset` (a boolean index) is given then only those sources are tested,
+    but every source still counts as a potential neighbour.
+    '''
+    from scipy.spatial import cKDTree
+    logger.info('Filtering with an isolation radius: %s', radius)
+    x, y = np.asarray(x), np.asarray(y)
+    index = np.zeros(x.shape, dtype=bool)
+    if x.size == 0:
+        return index
+
+    candidates = (np.arange(x.size) if subset is None
+                  else np.flatnonzero(subset))
+    if candidates.size == 0:
+        return index
+
+    tree = cKDTree(np.column_stack([x, y]))
+    counts = tree.query_ball_point(
+        np.column_stack([x[candidates], y[candidates]]), radius,
+        return_length=True)
+    # There should be only one star (the target) within `radius` pixels
+    index[candidates] = counts == 1
     return index
 
 
-def filter_source_table(source_table, radius):
+class EdgeFilter(object):
+    '''
+    Include only stars in the centre of the detector, avoiding vignetting and
+    the need for flat fielding
+    '''
+
+    def __init__(self, edge_margin=512, overscan_width=20, image_size=2048):
+        self.edge_margin = edge_margin
+        self.overscan_width = overscan_width
+        self.image_size = image_size
+
+    def __call__(self, source_table, index):
+        x = source_table['X_coordinate']
+        y = source_table['Y_coordinate']
+        return (index &
+                (x > (self.overscan_width + self.edge_margin)) &
+                (x < (self.image_size - self.edge_margin)) &
+                (y > self.edge_margin) &
+                (y < (self.image_size - self.edge_margin)))
+
+
+class FluxFilter(object):
+    '''
+    Include only a specific flux range. Assume the stellar flux goes into
+    `psf_size` pixels so the value can be higher than 2**16-1
+    '''
+
+    def __init__(self, flux_lim_low=1E3, flux_lim_high=45E3, psf_size=2.):
+        self.flux_lim_low = flux_lim_low * psf_size
+        self.flux_lim_high = flux_lim_high * psf_size
+
+    def __call__(self, source_table, index):
+        flux = source_table['Aper_flux_3']
+        return (index &
+                (flux >= self.flux_lim_low) &
+                (flux <= self.flux_lim_high))
+
+
+class IsolationFilter(object):
+    '''
+    Include only isolated stars. Should be run last as only the sources
+    surviving the previous filters are tested.
+    '''
+
+    def __init__(self, radius=6.):
+        self.radius = radius
+
+    def __call__(self, source_table, index):
+        return index & isolated_index(source_table['X_coordinate'],
+                                      source_table['Y_coordinate'],
+                                      radius=self.radius,
+                                      subset=index)
+
+
+def default_filters(isolation_radius=6., edge_margin=512, flux_lim_low=1E3,
+                    flux_lim_high=45E3):
+    return [
+        EdgeFilter(edge_margin=edge_margin),
+        FluxFilter(flux_lim_low=flux_lim_low, flux_lim_high=flux_lim_high),
+        IsolationFilter(radius=isolation_radius),
+    ]
+
+
+def filter_source_table(source_table, radius=6., filters=None):
+    '''
+    Apply each filter in turn to the source table. A filter is a callable
+    taking the source table and the current boolean index, returning the
+    updated index.
+    '''
     logger.info('Filtering source list')
+    if filters is None:
+        filters = default_filters(isolation_radius=radius)
+
     # Build up an index
     index = np.ones(len(source_table), dtype=bool)
-
-    # Include only stars in the centre
-    edge_margin = 512
-    overscan_width = 20
-    image_size = 2048
-    index &= (source_table['X_coordinate'] > (overscan_width + edge_margin))
-    index &= (source_table['X_coordinate'] < (image_size - edge_margin))
-    index &= (source_table['Y_coordinate'] > edge_margin)
-    index &= (source_table['Y_coordinate'] < (image_size - edge_margin))
-
-    # Now only a specific flux range. Assume the stellar flux goes into
-    # `psf_size` pixels so the value can be higher than 2**16-1
-    psf_size = 2.
-    flux_lim_low, flux_lim_high = 1E3 * psf_size, 45E3 * psf_size
-    index &= (source_table['Aper_flux_3'] >= flux_lim_low)
-    index &= (source_table['Aper_flux_3'] <= flux_lim_high)
-
-    # Only include isolated stars
-    index &= isolated_index(source_table['X_coordinate'],
-                            source_table['Y_coordinate'],
-                            radius=radius)
+    for source_filter in filters:
+        index = source_filter(source_table, index)
+        logger.debug('%s: %s sources remaining',
+                     source_filter.__class__.__name__, index.sum())
 
     # Return the final catalogue
     return source_table[index]
@@ -117,20 +199,23 @@ image'''
 
 def extract_from_file(fname, n_pixels, threshold, fwhmfilt, isolation_radius,
                       aperture_radius,
-                      region_filename=None):
+                      region_filename=None, source_filters=None,
+                      detector='imcore'):
     logger.info('Extracting catalogue from %s', fname)
-    with open_fits(fname) as infile:
-        header = infile[0].header
-
-    ref_image_id = header['image_id']
-    source_table = source_detect(fname,
-                                 n_pixels=n_pixels,
-                                 threshold=threshold,
-                                 fwhmfilt=fwhmfilt,
-                                 aperture_radius=aperture_radius)
+    with ImageFile(fname) as image:
+        ref_image_id = image.header['image_id']
+        inc_prescan = image_has_prescan(fname, image=image)
+
+        source_table = DETECTORS[detector](fname,
+                                           n_pixels=n_pixels,
+                                           threshold=threshold,
+                                           fwhmfilt=fwhmfilt,
+                                           aperture_radius=aperture_radius,
+                                           image=image)
     logger.info('Found %s sources', len(source_table))
     filtered_source_table = filter_source_table(source_table,
-                                                radius=isolation_radius)
+                                                radius=isolation_radius,
+                                                filters=source_filters)
     logger.info('Keeping %s sources', len(filtered_source_table))
 
     if region_filename is not None:
@@ -139,7 +224,6 @@ def extract_from_file(fname, n_pixels, threshold, fwhmfilt, isolation_radius,
             rfile.add_regions(filtered_source_table, colour='green')
             rfile.add_regions(source_table, colour='red')
 
-    inc_prescan = image_has_prescan(fname)
     logger.debug('Image has prescan: %s', inc_prescan)
     for row in filtered_source_table:
         yield TransmissionCatalogueEntry(
@@ -151,22 +235,6 @@ def extract_from_file(fname, n_pixels, threshold, fwhmfilt, isolation_radius,
             flux_adu=float(row['Aper_flux_3']))
 
 
-def upload_info(extracted_data, cursor):
-
-    query = '''insert into transmission_sources ({fields})
-    values ({placeholders})'''
-
-    def format_query(query_str):
-        return ' '.join([line.strip() for line in query_str.split('\n')])
-
-    for row in extracted_data:
-        full_query = query.format(
-            fields=','.join(row._fields),
-            placeholders=','.join(['%s'] * len(row._fields)))
-        logger.debug('Inserting %s: %s', format_query(full_query), list(row))
-        cursor.execute(full_query, args=row)
-
-
 def column_type(data):
     '''
     Returns the fits name for a column type
@@ -183,6 +251,7 @@ def column_type(data):
 
 
 def render_fits_catalogue(data, fname):
+    from astropy.io import fits
     logger.info('Rendering fits file to %s', fname)
     columns_data = {
         field_name: np.array([getattr(row, field_name) for row in data])
@@ -203,29 +272,69 @@ def render_fits_catalogue(data, fname):
     hdulist.writeto(fname, clobber=True)
 
 
+def extract_catalogue(refimage, n_pixels=2, threshold=3, fwhmfilt=1.5,
+                      isolation_radius=6, aperture_radius=3,
+                      region_filename=None, source_filters=None,
+                      detector='imcore'):
+    '''
+    Source detect and filter the reference image, returning the catalogue
+    entries without touching the database
+    '''
+    return list(extract_from_file(
+        refimage,
+        region_filename=region_filename,
+        n_pixels=n_pixels,
+        threshold=threshold,
+        fwhmfilt=fwhmfilt,
+        isolation_radius=isolation_radius,
+        aperture_radius=aperture_radius,
+        source_filters=source_filters,
+        detector=detector))
+
+
+def store_catalogue(file_info, cursor):
+    '''
+    Replace the stored catalogue of each reference image in `file_info`, so
+    storing the same catalogue twice never duplicates its sources
+    '''
+    ref_image_ids = sorted(set(row.ref_image_id for row in file_info))
+    for ref_image_id in ref_image_ids:
+        catalogue_store.replace(cursor, ref_image_id, [
+            row for row in file_info if row.ref_image_id == ref_image_id])
+
+    # Any cached copy of this catalogue, or of its aperture weights, is now
+    # out of date
+    for ref_image_id in ref_image_ids:
+        reference_catalogues.invalidate(ref_image_id)
+        invalidate_engines(ref_image_id)
+
+
 def build_catalogue(refimage, cursor=None,
                     db_host=None, db_user=None, db_name=None, db_socket=None,
                     n_pixels=2, threshold=3, fwhmfilt=1.5,
                     isolation_radius=6, aperture_radius=3,
-                    region_filename=None, fits_out=None):
+                    region_filename=None, fits_out=None, source_filters=None,
+                    detector='imcore'):
 
-    file_info = list(extract_from_file(
+    file_info = extract_catalogue(
         refimage,
         region_filename=region_filename,
         n_pixels=n_pixels,
         threshold=threshold,
         fwhmfilt=fwhmfilt,
         isolation_radius=isolation_radius,
-        aperture_radius=aperture_radius))
+        aperture_radius=aperture_radius,
+        source_filters=source_filters,
+        detector=detector)
 
     if cursor:
-        upload_info(file_info, cursor)
+        store_catalogue(file_info, cursor)
     else:
         with connect_to_database(user=db_user,
                                 host=db_host,
                                 db=db_name,
                                 unix_socket=db_socket) as cursor:
-            upload_info(file_info, cursor)
+            store_catalogue(file_info, cursor)
 
     if fits_out is not None:
         render_fits_catalogue(file_info, fits_out)
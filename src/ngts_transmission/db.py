@@ -1,42 +1,403 @@
 from contextlib import contextmanager
+from functools import partial
+import itertools
 import pymysql
 import json
 import os
+import threading
+import time
 
 from ngts_transmission.logs import logger
+from ngts_transmission.metrics import metrics
+
+DEFAULT_SOCKET = '/var/lib/mysql/mysql.sock'
+
+# Connections per pool
+POOL_SIZE = 4
+
+# Seconds a connection may sit idle before it is pinged on checkout
+CHECK_INTERVAL = 30.
+
+# Retries of idempotent operations after losing the connection, and the
+# wait before the first, doubling each time
+RETRIES = 3
+RETRY_WAIT = 1.
+
+# Client errors meaning the connection is unusable: cannot connect, server
+# has gone away, lost connection during a query, lost connection during the
+# handshake
+CONNECTION_ERRORS = (2003, 2006, 2013, 2055)
+
+# Rows per multi-row insert statement
+INSERT_CHUNK_SIZE = 1000
+
+# Server error creating an index whose name is already taken
+DUPLICATE_KEY_NAME = 1061
+
+
+def connect_kwargs(user, host, db, unix_socket=None):
+    if host is not None:
+        return dict(user=user, host=host, db=db)
+    return dict(user=user, unix_socket=unix_socket or DEFAULT_SOCKET, db=db)
+
+
+def is_connection_error(error):
+    '''
+    True if `error` means the connection was lost, rather than a query
+    failing
+    '''
+    if isinstance(error, pymysql.err.InterfaceError):
+        return True
+    return (isinstance(error, pymysql.err.OperationalError) and
+            bool(error.args) and error.args[0] in CONNECTION_ERRORS)
+
+
+class PoolExhausted(Exception):
+
+    def __init__(self, max_size, timeout):
+        super(PoolExhausted, self).__init__(
+            'All {} database connections still in use after {} '
+            'seconds'.format(max_size, timeout))
+
+
+class ConnectionStats(object):
+    '''
+    Usage of one pooled connection
+    '''
+
+    def __init__(self, number):
+        self.number = number
+        self.created = time.time()
+        self.last_used = self.created
+        self.checked_out = None
+        self.checkouts = 0
+        self.seconds_in_use = 0.
+        self.errors = 0
+
+    def as_dict(self):
+        return {
+            'connection': self.number,
+            'age_seconds': time.time() - self.created,
+            'checkouts': self.checkouts,
+            'seconds_in_use': self.seconds_in_use,
+            'errors': self.errors,
+        }
+
+
+class ConnectionPool(object):
+    '''
+    Up to `max_size` connections made by `connect()`, shared by the threads
+    of a process.
+
+    A connection idle for more than `check_interval` seconds is pinged
+    before it is handed out, and replaced if the server has gone away. A
+    connection which fails with a connection error while in use is closed
+    rather than returned to the pool, so the next checkout reconnects.
+    `call` also retries idempotent operations on a new connection.
+
+    A connection is handed out whole, session and all, so a caller holding
+    session state (e.g. the catalogue build lock) must clear it before the
+    connection is returned.
+    '''
+
+    def __init__(self, connect, max_size=POOL_SIZE,
+                 check_interval=CHECK_INTERVAL, retries=RETRIES,
+                 retry_wait=RETRY_WAIT, timeout=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self.timeout = timeout
+        self.numbers = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+        # (connection, stats), most recently used last
+        self.idle = []
+        self.in_use = {}
+        # Connections open or being opened
+        self.size = 0
+
+    def check_process(self):
+        '''
+        Connections belong to the process which opened them: a forked
+        worker starts with an empty pool rather than sharing its parent's
+        sockets
+        '''
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def acquire(self, timeout=None):
+        '''
+        Check out a connection, waiting up to `timeout` seconds (by default
+        `self.timeout`, None to wait forever) for one to be returned if all
+        are in use
+        '''
+        self.check_process()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not self.idle and self.size >= self.max_size:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolExhausted(self.max_size, timeout)
+                self.condition.wait(remaining)
+            if self.idle:
+                connection, stats = self.idle.pop()
+            else:
+                connection, stats = None, None
+                self.size += 1
+
+        try:
+            if connection is not None and not self.healthy(connection, stats):
+                self.close_connection(connection)
+                connection = None
+                metrics.increment('db_reconnects')
+            if connection is None:
+                connection = self.connect()
+                stats = ConnectionStats(next(self.numbers))
+                logger.debug('Opened database connection %s', stats.number)
+                metrics.increment('db_connections_opened')
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+        stats.checkouts += 1
+        stats.checked_out = time.time()
+        with self.condition:
+            self.in_use[id(connection)] = (connection, stats)
+            metrics.set_gauge('db_connections_in_use', len(self.in_use))
+        return connection
+
+    def healthy(self, connection, stats):
+        if time.time() - stats.last_used < self.check_interval:
+            return True
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logger.warning('Database connection %s failed its health check: '
+                           '%s', stats.number, str(e))
+            return False
+
+    def release(self, connection, failed=False, discard=False):
+        '''
+        Return a connection to the pool. A connection which `failed` is
+        counted as an error; one to `discard` is closed.
+        '''
+        with self.condition:
+            connection, stats = self.in_use.pop(id(connection), (None, None))
+        if stats is None:
+            # Checked out by the parent of this process
+            return
+
+        now = time.time()
+        stats.seconds_in_use += now - stats.checked_out
+        stats.last_used = now
+        if failed:
+            stats.errors += 1
+
+        if discard:
+            logger.warning('Discarding database connection %s', stats.number)
+            self.close_connection(connection)
+        with self.condition:
+            if discard:
+                self.size -= 1
+            else:
+                self.idle.append((connection, stats))
+            metrics.set_gauge('db_connections_in_use', len(self.in_use))
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        '''
+        A connection for the duration of the block
+        '''
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except Exception as e:
+            self.release(connection, failed=True,
+                         discard=is_connection_error(e))
+            raise
+        self.release(connection)
+
+    def call(self, fn, idempotent=False):
+        '''
+        Return `fn(connection)` with a pooled connection. If `idempotent`
+        and the connection is lost, `fn` is called again with a new
+        connection, up to `retries` times.
+        '''
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            try:
+                with self.connection() as connection:
+                    return fn(connection)
+            except Exception as e:
+                if attempt + 1 >= attempts or not is_connection_error(e):
+                    raise
+                wait = self.retry_wait * 2 ** attempt
+                logger.warning('Lost database connection (%s), retrying in '
+                               '%.1f seconds', str(e), wait)
+                metrics.increment('db_retries')
+                time.sleep(wait)
+
+    def stats(self):
+        '''
+        Usage of each open connection
+        '''
+        with self.condition:
+            connections = ([stats for (_, stats) in self.idle] +
+                           [stats for (_, stats) in self.in_use.values()])
+        return [stats.as_dict() for stats in
+                sorted(connections, key=lambda stats: stats.number)]
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        '''
+        Close the idle connections
+        '''
+        self.check_process()
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        for connection, _ in idle:
+            self.close_connection(connection)
+
+
+# One pool per database, shared by everything in the process
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(kwargs, **options):
+    '''
+    The process's pool of connections made with `pymysql.connect(**kwargs)`.
+    `options` are passed to `ConnectionPool` if the pool is new.
+    '''
+    key = tuple(sorted(kwargs.items()))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(partial(pymysql.connect, **kwargs),
+                                        **options)
+        return pools[key]
+
+
+def pool_from_args(args, **options):
+    return get_pool(connect_kwargs(args.db_user, args.db_host, args.db_name,
+                                   args.db_socket), **options)
 
 
 @contextmanager
 def connect_to_database_from_args(args):
-    socket = args.db_socket if args.db_socket is not None else '/var/lib/mysql/mysql.sock'
     with connect_to_database(user=args.db_user,
                              host=args.db_host,
                              db=args.db_name,
-                             unix_socket=socket) as cursor:
+                             unix_socket=args.db_socket) as cursor:
         yield cursor
 
 
 @contextmanager
 def connect_to_database(user, host, db, unix_socket):
-    if host is not None:
-        with pymysql.connect(user=user, host=host, db=db) as cursor:
-            logger.debug('Connected to database')
-            yield cursor
-            logger.debug('Closing database connection')
-    else:
-        with pymysql.connect(user=user,
-                             unix_socket=unix_socket,
-                             db=db) as cursor:
-            logger.debug('Connected to database')
-            yield cursor
-            logger.debug('Closing database connection')
+    '''
+    A cursor from the shared pool, committing on success
+    '''
+    pool = get_pool(connect_kwargs(user, host, db, unix_socket))
+    with pool.connection() as connection, \
+            transaction(connection) as cursor:
+        yield cursor
 
 
 @contextmanager
-def transaction(connection):
-    with connection as cursor:
-        yield cursor
-        logger.debug('Committing')
+def transaction(connection, timings=None):
+    '''
+    Yield a cursor, committing on success. The time from the start of the
+    transaction to the end of the commit (or rollback) is how long any
+    locks taken were held; it is logged, and appended to `timings` if
+    given.
+    '''
+    start = time.time()
+    try:
+        with connection as cursor:
+            yield cursor
+            logger.debug('Committing')
+    finally:
+        held = time.time() - start
+        logger.debug('Transaction held for %.3f seconds', held)
+        if timings is not None:
+            timings.append(held)
+
+
+def chunked(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class InsertSettings(object):
+    '''
+    Rows per multi-row insert statement used by this process, set from the
+    --insert-chunk-size option of the scripts
+    '''
+
+    def __init__(self, chunk_size=INSERT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+
+insert_settings = InsertSettings()
+
+
+def bulk_insert(cursor, table_name, fields, rows, chunk_size=None,
+                upsert=False):
+    '''
+    Insert `rows` (sequences in the order of `fields`) using one multi-row
+    insert statement per `chunk_size` rows (by default
+    `insert_settings.chunk_size`). With `upsert`, a row whose primary key
+    already exists replaces the values of the existing row. Returns the
+    number of rows inserted.
+    '''
+    chunk_size = chunk_size or insert_settings.chunk_size
+    row_placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+    nrows = 0
+    for chunk in chunked(rows, chunk_size):
+        query = 'insert into {table_name} ({fields}) values {values}'.format(
+            table_name=table_name,
+            fields=', '.join(fields),
+            values=', '.join([row_placeholder] * len(chunk)))
+        if upsert:
+            query += ' on duplicate key update {}'.format(', '.join(
+                '{0} = values({0})'.format(field) for field in fields))
+        cursor.execute(query, [value for row in chunk for value in row])
+        nrows += len(chunk)
+    logger.debug('Inserted %s rows into %s', nrows, table_name)
+    return nrows
+
+
+def add_insert_arguments(parser):
+    parser.add_argument('--insert-chunk-size',
+                        required=False,
+                        default=INSERT_CHUNK_SIZE,
+                        type=int,
+                        help='Rows per insert statement when uploading '
+                        'catalogues and transmission results')
+    return parser
 
 
 def add_database_arguments(parser):
@@ -55,10 +416,24 @@ def add_database_arguments(parser):
     return parser
 
 
+# Package data files, read once per process
+package_data = {}
+
+
+def read_package_json(name):
+    '''
+    The parsed contents of the JSON file `name` shipped with the package.
+    The result is shared, so must not be modified.
+    '''
+    if name not in package_data:
+        path = os.path.join(os.path.dirname(__file__), name)
+        with open(path) as infile:
+            package_data[name] = json.load(infile)
+    return package_data[name]
+
+
 def database_schema():
-    path = os.path.join(os.path.dirname(__file__), 'columns.json')
-    with open(path) as infile:
-        return json.load(infile)
+    return read_package_json('columns.json')
 
 
 def raw_create_table(name, column_map):
@@ -69,3 +444,38 @@ def raw_create_table(name, column_map):
     return 'create table {table_name} ({column_text})'.format(
         table_name=name,
         column_text=column_text)
+
+
+def database_indexes():
+    return read_package_json('indexes.json')
+
+
+def raw_create_indexes(name, index_map):
+    return [
+        'create index {index_name} on {table_name} ({columns})'.format(
+            index_name=index_name,
+            table_name=name,
+            columns=', '.join(columns))
+        for (index_name, columns) in sorted(index_map.get(name, {}).items())
+    ]
+
+
+def create_indexes(cursor, name, index_map):
+    '''
+    Create the indexes of table `name`, skipping any which already exist,
+    so it is safe to run again. Returns the names of the indexes created.
+    '''
+    created = []
+    index_names = sorted(index_map.get(name, {}))
+    for index_name, query in zip(index_names,
+                                 raw_create_indexes(name, index_map)):
+        logger.debug('Executing query `%s`', query)
+        try:
+            cursor.execute(query)
+        except pymysql.err.MySQLError as e:
+            if not e.args or e.args[0] != DUPLICATE_KEY_NAME:
+                raise
+            logger.info('Index %s on %s already exists', index_name, name)
+        else:
+            created.append(index_name)
+    return created
@@ -0,0 +1,115 @@
+'''
+In process source detection, an alternative to running `imcore`.
+
+Follows the same steps as imcore: estimate a smooth background from
+sigma clipped medians on a coarse mesh, smooth the background subtracted
+image with a gaussian matched filter of FWHM `fwhmfilt`, keep connected
+groups of at least `n_pixels` pixels above `threshold` sigma, then measure
+intensity weighted centroids and aperture fluxes of radius
+`aperture_radius`.
+
+The returned table has the imcore columns used by `filter_source_table`,
+with coordinates in the same 1-indexed FITS pixel convention.
+'''
+
+import numpy as np
+
+from ngts_transmission.logs import logger
+from ngts_transmission.image import image_context
+from ngts_transmission.aperture import ApertureEngine
+
+FWHM_TO_SIGMA = 1. / (2. * np.sqrt(2. * np.log(2.)))
+
+
+def robust_sigma(data):
+    return 1.4826 * np.median(np.abs(data - np.median(data)))
+
+
+def clipped_median(data, nsigma=3., iterations=3):
+    data = data.ravel()
+    for _ in range(iterations):
+        median, sigma = np.median(data), robust_sigma(data)
+        keep = np.abs(data - median) < nsigma * sigma
+        if sigma == 0 or keep.all():
+            break
+        data = data[keep]
+    return np.median(data)
+
+
+def estimate_background(data, mesh_size=64):
+    '''
+    Smooth background map from sigma clipped medians of `mesh_size` boxes,
+    median filtered and interpolated back to the full image
+    '''
+    from scipy import ndimage
+    ny, nx = data.shape
+    gy, gx = max(ny // mesh_size, 1), max(nx // mesh_size, 1)
+    grid = np.empty((gy, gx))
+    ybounds = np.linspace(0, ny, gy + 1).astype(int)
+    xbounds = np.linspace(0, nx, gx + 1).astype(int)
+    for j in range(gy):
+        for i in range(gx):
+            grid[j, i] = clipped_median(
+                data[ybounds[j]:ybounds[j + 1], xbounds[i]:xbounds[i + 1]])
+
+    # Remove meshes dominated by bright stars
+    grid = ndimage.median_filter(grid, size=3, mode='nearest')
+
+    # Interpolate from the mesh centres to every pixel
+    ycentres = 0.5 * (ybounds[:-1] + ybounds[1:]) - 0.5
+    xcentres = 0.5 * (xbounds[:-1] + xbounds[1:]) - 0.5
+    yy = np.interp(np.arange(ny), ycentres, np.arange(gy))
+    xx = np.interp(np.arange(nx), xcentres, np.arange(gx))
+    coords = np.meshgrid(yy, xx, indexing='ij')
+    return ndimage.map_coordinates(grid, coords, order=1, mode='nearest')
+
+
+def detect_sources(data, n_pixels, threshold, fwhmfilt, aperture_radius,
+                   mesh_size=64):
+    from scipy import ndimage
+    data = np.asarray(data, dtype=float)
+    residual = data - estimate_background(data, mesh_size=mesh_size)
+
+    # As imcore, the threshold is in units of the unfiltered sky noise
+    smoothed = ndimage.gaussian_filter(residual, fwhmfilt * FWHM_TO_SIGMA)
+    detection_limit = threshold * robust_sigma(residual)
+    logger.debug('Detection limit: %s', detection_limit)
+
+    # Eight-connected groups of pixels above the limit
+    labels, nobjects = ndimage.label(smoothed > detection_limit,
+                                     structure=np.ones((3, 3)))
+    index = np.arange(1, nobjects + 1)
+    npix = ndimage.sum(np.ones_like(residual), labels, index)
+    index = index[npix >= n_pixels]
+    logger.debug('%s of %s objects have at least %s pixels', index.size,
+                 nobjects, n_pixels)
+
+    x, y = np.empty(0), np.empty(0)
+    if index.size:
+        weights = np.clip(residual, 0, None)
+        centroids = np.array(ndimage.center_of_mass(weights, labels, index))
+        finite = np.all(np.isfinite(centroids), axis=1)
+        y, x = centroids[finite, 0], centroids[finite, 1]
+
+    table = np.zeros(x.size, dtype=[('X_coordinate', np.float64),
+                                    ('Y_coordinate', np.float64),
+                                    ('Aper_flux_3', np.float64)])
+    if not x.size:
+        return table
+
+    table['Aper_flux_3'] = ApertureEngine(x, y, aperture_radius)(residual)
+
+    # imcore reports FITS (1-indexed) pixel coordinates
+    table['X_coordinate'] = x + 1
+    table['Y_coordinate'] = y + 1
+    return table[np.isfinite(table['Aper_flux_3'])]
+
+
+def native_source_detect(fname, n_pixels, threshold, fwhmfilt,
+                         aperture_radius, image=None):
+    logger.info('Running native source detect')
+    logger.debug('n_pixels: %s, threshold: %s', n_pixels, threshold)
+    with image_context(fname, image) as image:
+        return detect_sources(image.data, n_pixels=n_pixels,
+                              threshold=threshold, fwhmfilt=fwhmfilt,
+                              aperture_radius=aperture_radius)
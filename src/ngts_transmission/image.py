@@ -0,0 +1,272 @@
+from contextlib import contextmanager
+import bz2
+import io
+import os
+import numpy as np
+
+from ngts_transmission.logs import logger
+from ngts_transmission.cache import LRUCache
+from ngts_transmission.metrics import metrics
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+END_CARD = b'END' + b' ' * 5
+
+BITPIX_DTYPES = {
+    8: np.dtype('u1'),
+    16: np.dtype('>i2'),
+    32: np.dtype('>i4'),
+    64: np.dtype('>i8'),
+    -32: np.dtype('>f4'),
+    -64: np.dtype('>f8'),
+}
+
+# Primary headers keyed by path, modification time and size
+header_cache = LRUCache(maxsize=256)
+
+
+def read_header_bytes(fileobj):
+    '''
+    Read whole FITS blocks from `fileobj` up to and including the one holding
+    the END card of the first header, and no further
+    '''
+    blocks = []
+    while True:
+        block = fileobj.read(BLOCK_SIZE)
+        if len(block) < BLOCK_SIZE:
+            raise IOError('File ends before the end of the primary header')
+        blocks.append(block)
+        for offset in range(0, BLOCK_SIZE, CARD_SIZE):
+            if block[offset:offset + len(END_CARD)] == END_CARD:
+                return b''.join(blocks)
+
+
+def skip_bytes(fileobj, nbytes, chunk_size=64 * 1024):
+    '''
+    Read past `nbytes` of a stream which cannot seek cheaply, reusing one
+    small buffer
+    '''
+    buf = memoryview(bytearray(chunk_size))
+    while nbytes > 0:
+        nread = fileobj.readinto(buf[:min(nbytes, chunk_size)])
+        if not nread:
+            raise IOError('Unexpected end of file')
+        nbytes -= nread
+
+
+def read_rows(fileobj, header, y0, y1):
+    '''
+    Read the raw (unscaled, big endian) rows [y0, y1) of the primary image
+    from a stream positioned just after the primary header, reading nothing
+    past the last row
+    '''
+    dtype = BITPIX_DTYPES[header['BITPIX']]
+    ncols = header['NAXIS1']
+    row_bytes = ncols * dtype.itemsize
+
+    skip_bytes(fileobj, y0 * row_bytes)
+    raw = fileobj.read((y1 - y0) * row_bytes)
+    if len(raw) < (y1 - y0) * row_bytes:
+        raise IOError('Unexpected end of file')
+    return np.frombuffer(raw, dtype=dtype).reshape(y1 - y0, ncols)
+
+
+def map_pixels(filename, header, header_size):
+    '''
+    Memory map the raw (unscaled, big endian) primary image of an
+    uncompressed file
+    '''
+    dtype = BITPIX_DTYPES[header['BITPIX']]
+    shape = tuple(header['NAXIS{}'.format(axis)]
+                  for axis in range(header['NAXIS'], 0, -1))
+    return np.memmap(filename, dtype=dtype, mode='r', offset=header_size,
+                     shape=shape)
+
+
+def scale_pixels(raw, header):
+    '''
+    Apply the BSCALE and BZERO scaling to raw pixels, returning a new native
+    endian array
+    '''
+    native = raw.dtype.newbyteorder('=')
+    bscale, bzero = header.get('BSCALE', 1), header.get('BZERO', 0)
+    if bscale == 1 and bzero == 0:
+        return raw.astype(native)
+    if (bscale == 1 and native.kind == 'i' and
+            bzero == 2 ** (8 * native.itemsize - 1)):
+        # Unsigned integer convention, as astropy reads it. Adding the zero
+        # point is the same as flipping the sign bit, without upcasting
+        unsigned = np.dtype('u{}'.format(native.itemsize))
+        as_unsigned = raw.view(raw.dtype.str.replace('i', 'u'))
+        return as_unsigned.astype(unsigned) ^ unsigned.type(bzero)
+    return raw.astype(np.float64) * bscale + bzero
+
+
+def read_header_with_size(filename, cache=header_cache):
+    '''
+    Returns the primary header and the number of bytes read to get it, which
+    is zero if it came from the cache
+    '''
+    from astropy.io import fits
+    key = None
+    if cache is not None:
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+        header = cache.get(key)
+        if header is not None:
+            return header, 0
+
+    opener = bz2.BZ2File if '.bz2' in filename else io.open
+    with opener(filename, 'rb') as infile:
+        raw = read_header_bytes(infile)
+    header = fits.Header.fromstring(raw.decode('ascii'))
+
+    if cache is not None:
+        cache.put(key, header)
+    return header, len(raw)
+
+
+def read_header(filename, cache=header_cache):
+    '''
+    Read the primary header only. For a compressed file just enough of the
+    stream is decompressed to reach the END card. Cached headers are shared,
+    so treat the result as read only.
+    '''
+    header, _ = read_header_with_size(filename, cache=cache)
+    return header
+
+
+class ImageFile(object):
+    '''
+    A FITS image, possibly bz2 compressed, which is opened at most once.
+
+    The primary header and data are cached on first access, so the same
+    object can be handed to each step of a job instead of the filename. The
+    header is read on its own until the data is needed, so cheap checks do
+    not pay for decompressing the whole file. `bytes_decompressed` counts
+    the uncompressed bytes read from a compressed file.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.bytes_decompressed = 0
+        self._hdulist = None
+        self._header = None
+        self._data = None
+        self._sections = {}
+
+    @property
+    def compressed(self):
+        return '.bz2' in self.filename
+
+    @property
+    def hdulist(self):
+        from astropy.io import fits
+        if self._hdulist is None:
+            if self.compressed:
+                with metrics.timer('decompress'), \
+                        bz2.BZ2File(self.filename) as infile:
+                    raw = infile.read()
+                self.bytes_decompressed += len(raw)
+                logger.debug('Decompressed %s bytes from %s', len(raw),
+                             self.filename)
+                self._hdulist = fits.open(io.BytesIO(raw))
+            else:
+                self._hdulist = fits.open(self.filename)
+        return self._hdulist
+
+    @property
+    def header(self):
+        if self._header is None:
+            if self._hdulist is not None:
+                self._header = self._hdulist[0].header
+            else:
+                self._header, nbytes = read_header_with_size(self.filename)
+                if self.compressed:
+                    self.bytes_decompressed += nbytes
+        return self._header
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.hdulist[0].data
+        return self._data
+
+    def section(self, y0, y1, x0, x1):
+        '''
+        Read only the pixels [y0:y1, x0:x1] of the primary image.
+
+        Uncompressed files are memory mapped so only the pages holding the
+        requested rows are read. Compressed files cannot seek, so the stream
+        is decompressed up to the last requested row and no further. The
+        section is kept until the image is closed, so it can be read ahead
+        of time.
+        '''
+        from astropy.io import fits
+        if self._data is not None or self._hdulist is not None:
+            return self.data[y0:y1, x0:x1]
+
+        key = (y0, y1, x0, x1)
+        if key in self._sections:
+            return self._sections[key]
+
+        with metrics.timer('decompress'):
+            opener = bz2.BZ2File if self.compressed else io.open
+            with opener(self.filename, 'rb') as infile:
+                raw_header = read_header_bytes(infile)
+                header = fits.Header.fromstring(raw_header.decode('ascii'))
+                if self.compressed:
+                    raw = read_rows(infile, header, y0, y1)[:, x0:x1]
+                    self.bytes_decompressed += infile.tell()
+
+            if not self.compressed:
+                raw = map_pixels(self.filename, header,
+                                 len(raw_header))[y0:y1, x0:x1]
+
+            section = self._sections[key] = scale_pixels(raw, header)
+
+        if self._header is None:
+            self._header = header
+        return section
+
+    @property
+    def shape(self):
+        '''
+        Shape of the primary image, from the header alone
+        '''
+        header = self.header
+        return tuple(header['NAXIS{}'.format(axis)]
+                     for axis in range(header['NAXIS'], 0, -1))
+
+    def close(self):
+        if self._hdulist is not None:
+            self._hdulist.close()
+            self._hdulist = None
+        self._header = None
+        self._data = None
+        self._sections = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        return '<ImageFile {self.filename}>'.format(self=self)
+
+    def __repr__(self):
+        return str(self)
+
+
+@contextmanager
+def image_context(filename, image=None):
+    '''
+    Use the already open `image` if given, otherwise open `filename` for the
+    duration of the context
+    '''
+    if image is not None:
+        yield image
+    else:
+        with ImageFile(filename) as image:
+            yield image
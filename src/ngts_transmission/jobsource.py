@@ -0,0 +1,220 @@
+'''
+Sources of wakeups for the watcher loop.
+
+The watcher asks its job source to `wait` between polls of the job queue.
+`wait` returns early when there is reason to believe new jobs have been
+submitted, or after `interval` seconds otherwise, so the database is still
+polled as a fallback if a notification is missed.
+
+* `PollingSource`: sleep for a fixed interval (the original behaviour)
+* `SocketSource`: wake when a datagram arrives on a unix socket, see
+  `notify`
+* `DirectorySource`: wake when the contents of any watched directory, or
+  of its most recent subdirectories, change
+'''
+
+import errno
+import os
+import select
+import socket
+from stat import S_ISDIR
+import time
+
+from ngts_transmission.logs import logger
+
+SLEEP_TIME = 2  # Seconds
+FALLBACK_TIME = 30  # Seconds
+SOCKET_PATH = os.path.join('/', 'tmp', 'ngtransmission.sock')
+# Directories watched within each path given to DirectorySource
+SUBDIRECTORIES = 5
+
+
+class PollingSource(object):
+
+    def __init__(self, interval=SLEEP_TIME):
+        self.interval = interval
+
+    def wait(self):
+        '''
+        Block until the job queue should be polled again. Returns True if
+        woken by a notification, False if the interval elapsed.
+        '''
+        logger.debug('Sleeping for %s seconds', self.interval)
+        time.sleep(self.interval)
+        return False
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SocketSource(PollingSource):
+    '''
+    Wake as soon as a datagram arrives on the unix socket at `path`.
+    Several notifications sent while a batch is running cause a single
+    wakeup.
+    '''
+
+    def __init__(self, path=SOCKET_PATH, interval=FALLBACK_TIME):
+        super(SocketSource, self).__init__(interval)
+        self.path = path
+        remove_stale_socket(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.sock.setblocking(False)
+        logger.info('Listening for job notifications on %s', path)
+
+    def wait(self):
+        readable, _, _ = select.select([self.sock], [], [], self.interval)
+        if not readable:
+            logger.debug('No notification within %s seconds', self.interval)
+            return False
+        self.drain()
+        return True
+
+    def drain(self):
+        count = 0
+        while True:
+            try:
+                self.sock.recv(1024)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            count += 1
+        logger.debug('Received %s notifications', count)
+        return count
+
+    def close(self):
+        self.sock.close()
+        remove_stale_socket(self.path)
+
+
+class DirectorySource(PollingSource):
+    '''
+    Wake when a file is created, removed or renamed in any of `paths`, or in
+    one of the `subdirectories` most recently modified directories within
+    each of them. Frames are written to a new directory for each action
+    (e.g. /ngts/das01/action106267_observeField), so the watched paths are
+    the parents of those directories.
+
+    Each directory's modification time is checked every `scan_interval`
+    seconds, which is a local `stat` call rather than a database query.
+    The subdirectories of a path are only listed again when it changes.
+    '''
+
+    def __init__(self, paths, interval=FALLBACK_TIME, scan_interval=0.1,
+                 subdirectories=SUBDIRECTORIES):
+        super(DirectorySource, self).__init__(interval)
+        self.paths = list(paths)
+        self.scan_interval = scan_interval
+        self.subdirectories = subdirectories
+        self.watched = {}
+        self.state = self.snapshot()
+        logger.info('Watching %s for new files', ', '.join(self.paths))
+
+    def snapshot(self):
+        state = {}
+        for path in self.paths:
+            state[path] = directory_state(path)
+            if path not in self.watched or state[path] != self.state[path]:
+                self.watched[path] = recent_subdirectories(
+                    path, self.subdirectories)
+            for subdirectory in self.watched[path]:
+                state[subdirectory] = directory_state(subdirectory)
+        return state
+
+    def wait(self):
+        deadline = time.time() + self.interval
+        while True:
+            state = self.snapshot()
+            if state != self.state:
+                changed = [path for path in sorted(state)
+                           if state[path] != self.state.get(path)]
+                logger.debug('Change detected in %s', ', '.join(changed))
+                self.state = state
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.debug('No changes within %s seconds', self.interval)
+                return False
+            time.sleep(min(self.scan_interval, remaining))
+
+
+def directory_state(path):
+    '''
+    The inode and modification time of `path`, or None if it is missing
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime)
+
+
+def recent_subdirectories(path, count):
+    '''
+    The `count` most recently modified directories in `path`
+    '''
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+
+    found = []
+    for name in names:
+        subdirectory = os.path.join(path, name)
+        try:
+            stat = os.stat(subdirectory)
+        except OSError:
+            continue
+        if S_ISDIR(stat.st_mode):
+            found.append((stat.st_mtime, subdirectory))
+    found.sort(reverse=True)
+    return [subdirectory for (_, subdirectory) in found[:count]]
+
+
+def remove_stale_socket(path):
+    try:
+        os.unlink(path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def notify(path=SOCKET_PATH):
+    '''
+    Wake a watcher listening on `path`. Returns False if no watcher is
+    listening, so submitting a job never fails because of a notification.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(b'job', path)
+    except socket.error as err:
+        logger.debug('Cannot notify watcher at %s: %s', path, err)
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def build_job_source(name, interval=None, socket_path=SOCKET_PATH,
+                     watch_paths=None):
+    '''
+    Build the job source `name`, one of "poll", "socket" or "directory"
+    '''
+    if name == 'poll':
+        return PollingSource(interval or SLEEP_TIME)
+    elif name == 'socket':
+        return SocketSource(socket_path, interval or FALLBACK_TIME)
+    elif name == 'directory':
+        if not watch_paths:
+            raise ValueError('No directories given to watch')
+        return DirectorySource(watch_paths, interval or FALLBACK_TIME)
+    raise ValueError('Unknown job source {name}'.format(name=name))
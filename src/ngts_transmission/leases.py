@@ -0,0 +1,150 @@
+'''
+Job leases, so that several watchers (e.g. one per aux node) can share the
+job queue without processing the same job twice.
+
+`job_queue` belongs to the scheduler, so claims are recorded in our own
+`transmission_job_lease` table, keyed on `job_id`. A watcher owns a job
+while it holds an unexpired lease on it:
+
+* claim: insert a lease for each candidate job, keeping any existing row,
+  and take over rows whose lease has expired. The primary key makes the
+  insert atomic, so exactly one watcher ends up owning each job.
+* renew: before each commit group, extend the leases this watcher still
+  owns, and skip the jobs whose lease another watcher has taken over.
+* confirm: before a group is committed, renew its leases again. If any was
+  lost while the group was processed the group is rolled back, so its
+  results are never stored twice.
+* release: once the job has been removed from the queue, drop the lease.
+* expiry: a watcher which dies, or fails a job, stops holding its leases
+  after `duration` seconds, after which any watcher may reclaim the job.
+
+The lease duration must be longer than it takes to process a commit group.
+'''
+
+import os
+import socket
+
+from ngts_transmission.logs import logger
+
+LEASE_TIME = 120  # Seconds
+
+RECLAIM_QUERY = '''
+update transmission_job_lease
+set owner = %s, expires = now() + interval %s second
+where job_id in ({placeholders}) and expires <= now()
+'''
+
+CLAIM_QUERY = '''
+insert into transmission_job_lease (job_id, owner, expires)
+values {values}
+on duplicate key update job_id = job_id
+'''
+
+# Only the owner matches, so a lease reclaimed by another watcher is not
+# taken back
+RENEW_QUERY = '''
+update transmission_job_lease
+set expires = now() + interval %s second
+where job_id in ({placeholders}) and owner = %s
+'''
+
+OWNED_QUERY = '''
+select job_id from transmission_job_lease
+where job_id in ({placeholders}) and owner = %s and expires > now()
+'''
+
+# Leases for jobs which are no longer in the queue, i.e. the job has been
+# completed by this watcher or removed by the scheduler
+RELEASE_QUERY = '''
+delete transmission_job_lease from transmission_job_lease
+left join job_queue using (job_id)
+where transmission_job_lease.owner = %s and job_queue.job_id is null
+'''
+
+
+class LeaseLost(Exception):
+
+    def __init__(self, job_ids):
+        super(LeaseLost, self).__init__(
+            'Lost the leases on jobs {}'.format(
+                ', '.join(map(str, sorted(job_ids)))))
+        self.job_ids = job_ids
+
+
+def default_owner():
+    return '{host}:{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+
+
+class JobLeases(object):
+
+    def __init__(self, owner=None, duration=LEASE_TIME):
+        self.owner = owner if owner is not None else default_owner()
+        self.duration = duration
+
+    def claim(self, cursor, job_ids):
+        '''
+        Try to claim each of `job_ids`, returning the set of ids now owned
+        by this watcher. Must be committed before the jobs are processed,
+        so other watchers can see the claims.
+        '''
+        # Lock rows in a consistent order to avoid deadlocks between watchers
+        job_ids = sorted(job_ids)
+        if not job_ids:
+            return set()
+
+        placeholders = ', '.join(['%s'] * len(job_ids))
+        cursor.execute(RECLAIM_QUERY.format(placeholders=placeholders),
+                       [self.owner, self.duration] + job_ids)
+        if cursor.rowcount:
+            logger.info('Reclaimed %s expired leases', cursor.rowcount)
+
+        values = ', '.join(['(%s, %s, now() + interval %s second)'] *
+                           len(job_ids))
+        cursor.execute(CLAIM_QUERY.format(values=values),
+                       [value for job_id in job_ids
+                        for value in (job_id, self.owner, self.duration)])
+
+        cursor.execute(OWNED_QUERY.format(placeholders=placeholders),
+                       job_ids + [self.owner])
+        claimed = set(row[0] for row in cursor.fetchall())
+        logger.info('%s claimed %s of %s jobs', self.owner, len(claimed),
+                    len(job_ids))
+        return claimed
+
+    def renew(self, cursor, job_ids):
+        '''
+        Extend the leases this watcher still owns on `job_ids`, returning the
+        set of ids it owns
+        '''
+        job_ids = sorted(job_ids)
+        if not job_ids:
+            return set()
+
+        placeholders = ', '.join(['%s'] * len(job_ids))
+        cursor.execute(RENEW_QUERY.format(placeholders=placeholders),
+                       [self.duration] + job_ids + [self.owner])
+        cursor.execute(OWNED_QUERY.format(placeholders=placeholders),
+                       job_ids + [self.owner])
+        owned = set(row[0] for row in cursor.fetchall())
+        logger.debug('%s renewed %s of %s leases', self.owner, len(owned),
+                     len(job_ids))
+        return owned
+
+    def confirm(self, cursor, job_ids):
+        '''
+        Renew the leases on `job_ids` within the current transaction,
+        raising `LeaseLost` if any is no longer owned
+        '''
+        lost = set(job_ids) - self.renew(cursor, job_ids)
+        if lost:
+            raise LeaseLost(lost)
+
+    def release(self, cursor):
+        '''
+        Drop the leases on jobs which have left the queue
+        '''
+        cursor.execute(RELEASE_QUERY, (self.owner,))
+        logger.debug('Released %s leases', cursor.rowcount)
+
+    def __str__(self):
+        return '<JobLeases {self.owner}>'.format(self=self)
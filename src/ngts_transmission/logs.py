@@ -1,6 +1,27 @@
+'''
+The package logger, writing to a rotating file and the terminal.
+
+By default records are formatted and written by the thread which logs them.
+`configure_logging` can instead put records on a queue, to be formatted and
+written by a background thread, set the level of each subsystem (the module
+a message comes from, e.g. 'db' or 'watching'), and sample per-row debug
+messages logged with `debug_sampled`. Forked worker processes have no
+listener thread, so they log synchronously (see `reset_after_fork`).
+'''
+
+import atexit
 import logging
 from logging.handlers import RotatingFileHandler
 from socket import gethostname
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # Python 2 has no queue handlers, so logging stays synchronous
+    QueueHandler = QueueListener = None
 
 if 'aux' in gethostname():
     log_filename = '/usr/local/cron/logs/transmission.log'
@@ -10,13 +31,18 @@ else:
 # Maximum file size: 10MB
 maxBytes = 10 * 1024 * 1024
 
+# Records waiting to be written before new ones are dropped, 0 for no limit
+QUEUE_SIZE = 10000
+
 logger = logging.getLogger('ngtransmission')
 logger.setLevel(logging.DEBUG)
 
+# The file is opened by the first record written to it
 fh = RotatingFileHandler(log_filename,
                          mode='a',
                          maxBytes=maxBytes,
-                         backupCount=5)
+                         backupCount=5,
+                         delay=True)
 fh.setLevel(logging.DEBUG)
 
 ch = logging.StreamHandler()
@@ -28,3 +54,209 @@ ch.setFormatter(formatter)
 
 logger.addHandler(fh)
 logger.addHandler(ch)
+
+
+def level_number(level):
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(level.upper())
+    if not isinstance(number, int):
+        raise ValueError('Unknown log level {!r}'.format(level))
+    return number
+
+
+class SubsystemFilter(logging.Filter):
+    '''
+    Drop records below the level set for the module they come from, or
+    below `default` for modules without a level of their own
+    '''
+
+    def __init__(self, default=logging.DEBUG, levels=None):
+        super(SubsystemFilter, self).__init__()
+        self.default = default
+        self.levels = dict(levels or {})
+
+    def filter(self, record):
+        return record.levelno >= self.levels.get(record.module, self.default)
+
+
+class LogSampler(object):
+    '''
+    Let through the first of every `every` calls for each key, so per-row
+    messages are affordable at debug level. 1 lets every call through, 0
+    none.
+    '''
+
+    def __init__(self, every=1):
+        self.every = every
+        self.counts = {}
+
+    def __call__(self, key):
+        if self.every <= 0:
+            return False
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        return count % self.every == 0
+
+
+if QueueHandler is not None:
+
+    class DeferredQueueHandler(QueueHandler):
+        '''
+        Queue records unformatted, so the listener thread does the
+        formatting. When the queue is full, records below WARNING are
+        dropped and counted (as the `log_records_dropped` metric) rather
+        than blocking the caller. Warnings and errors are instead written by
+        the caller to `handlers`, ahead of any records still queued.
+        '''
+
+        def __init__(self, log_queue, handlers=()):
+            super(DeferredQueueHandler, self).__init__(log_queue)
+            self.handlers = list(handlers)
+            self.dropped = 0
+
+        def prepare(self, record):
+            if record.exc_info:
+                # The traceback may not outlive the caller's frame
+                return super(DeferredQueueHandler, self).prepare(record)
+            return record
+
+        def enqueue(self, record):
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                if record.levelno >= logging.WARNING:
+                    self.write(record)
+                    return
+                self.dropped += 1
+                # Imported here since the metrics module logs with this one
+                from ngts_transmission.metrics import metrics
+                metrics.increment('log_records_dropped')
+
+        def write(self, record):
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    class DrainingQueueListener(QueueListener):
+        '''
+        Wait for room to stop the listener, rather than failing when the
+        queue is full
+        '''
+
+        def enqueue_sentinel(self):
+            self.queue.put(self._sentinel)
+
+
+class LoggingState(object):
+
+    def __init__(self):
+        self.handlers = [fh, ch]
+        self.queue_handler = None
+        self.listener = None
+
+    def start_async(self, queue_size):
+        log_queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = DeferredQueueHandler(log_queue,
+                                                  self.handlers)
+        self.listener = DrainingQueueListener(log_queue, *self.handlers,
+                                              respect_handler_level=True)
+        for handler in self.handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(self.queue_handler)
+        self.listener.start()
+
+    def stop_async(self):
+        '''
+        Write any queued records, and go back to logging synchronously
+        '''
+        if self.listener is None:
+            return
+        self.listener.stop()
+        logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            logger.addHandler(handler)
+        if self.queue_handler.dropped:
+            logger.warning('Dropped %s log records while the queue was full',
+                           self.queue_handler.dropped)
+        self.listener, self.queue_handler = None, None
+
+    def reset_after_fork(self):
+        '''
+        Log synchronously in a forked worker process. The queue inherited
+        from the parent has no listener in this process, and the records
+        already on it are written by the parent.
+        '''
+        if self.queue_handler is None:
+            return
+        logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            logger.addHandler(handler)
+        self.listener, self.queue_handler = None, None
+
+
+subsystem_filter = SubsystemFilter()
+logger.addFilter(subsystem_filter)
+sample = LogSampler()
+logging_state = LoggingState()
+atexit.register(logging_state.stop_async)
+
+
+def configure_logging(level='DEBUG', subsystem_levels=None,
+                      asynchronous=False, sample_every=1,
+                      queue_size=QUEUE_SIZE, handlers=None):
+    '''
+    Set the default `level`, and the level of each subsystem in the mapping
+    `subsystem_levels`. If `asynchronous`, records are written by a
+    background thread. `sample_every` sets how many per-row debug messages
+    are logged (see `LogSampler`). `handlers` replaces the file and terminal
+    handlers.
+    '''
+    logging_state.stop_async()
+    if handlers is not None:
+        for handler in logging_state.handlers:
+            logger.removeHandler(handler)
+        logging_state.handlers = list(handlers)
+        for handler in logging_state.handlers:
+            logger.addHandler(handler)
+
+    levels = dict((name, level_number(value)) for (name, value)
+                  in (subsystem_levels or {}).items())
+    subsystem_filter.default = level_number(level)
+    subsystem_filter.levels = levels
+    logger.setLevel(min([subsystem_filter.default] + list(levels.values())))
+
+    sample.every = sample_every
+    sample.counts.clear()
+
+    if asynchronous:
+        if QueueHandler is None:
+            logger.warning('Asynchronous logging needs Python 3, logging '
+                           'synchronously')
+        else:
+            logging_state.start_async(queue_size)
+
+
+def parse_log_levels(values):
+    '''
+    The default level and the subsystem levels from `LEVEL` and
+    `subsystem=LEVEL` strings
+    '''
+    level, subsystem_levels = 'DEBUG', {}
+    for value in values or []:
+        if '=' in value:
+            name, subsystem_level = value.split('=', 1)
+            subsystem_levels[name] = level_number(subsystem_level)
+        else:
+            level = value
+    level_number(level)
+    return level, subsystem_levels
+
+
+def debug_sampled(key, message, *args):
+    '''
+    Log a per-row debug message, subject to sampling. Cheap when debug
+    logging is disabled.
+    '''
+    if logger.isEnabledFor(logging.DEBUG) and sample(key):
+        logger.debug(message, *args)
@@ -0,0 +1,187 @@
+'''
+Timing metrics for each stage of a job, exported to a file for monitoring.
+
+Durations are recorded with `metrics.timer(stage)`, or `metrics.observe`
+for other distributions, and summarised with the count, sum and the 50th,
+95th and 99th percentiles over the most recent `window` samples. Gauges
+hold the latest value of a quantity such as the backlog size, and counters
+only ever increase.
+
+`metrics.write(path)` atomically replaces `path` with a JSON document if
+the name ends in `.json`, or the Prometheus text exposition format
+otherwise (e.g. for the node exporter's textfile collector).
+'''
+
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import tempfile
+import threading
+import time
+
+from ngts_transmission.logs import logger
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+
+    def __init__(self, window=10000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantiles(self, quantiles=QUANTILES):
+        if not self.samples:
+            return dict((q, float('nan')) for q in quantiles)
+        import numpy as np
+        values = np.percentile(np.array(self.samples),
+                               [100. * q for q in quantiles])
+        return dict(zip(quantiles, map(float, values)))
+
+    def summary(self):
+        quantiles = self.quantiles()
+        summary = {'count': self.count, 'sum': self.total}
+        for q in QUANTILES:
+            summary['p{:g}'.format(100 * q)] = quantiles[q]
+        return summary
+
+
+def metric_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def format_labels(labels, **extra):
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, value) for (key, value) in labels))
+
+
+class Metrics(object):
+
+    def __init__(self, prefix='ngtransmission', window=10000):
+        self.prefix = prefix
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.gauges = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(window=self.window)
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, stage):
+        '''
+        Record the duration of the block as `stage_seconds{stage=...}`,
+        whether or not it raises
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.time() - start, stage=stage)
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[metric_key(name, labels)] = value
+
+    def increment(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'updated': time.time(),
+                'started': self.started,
+                'histograms': [
+                    dict(name=name, labels=dict(labels),
+                         **histogram.summary())
+                    for ((name, labels), histogram)
+                    in sorted(self.histograms.items())],
+                'gauges': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for ((name, labels), value)
+                    in sorted(self.gauges.items())],
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for ((name, labels), value)
+                    in sorted(self.counters.items())],
+            }
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            gauges = sorted(self.gauges.items())
+            counters = sorted(self.counters.items())
+
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                lines.append('# TYPE {} {}'.format(name, kind))
+                declared.add(name)
+
+        for (name, labels), histogram in histograms:
+            name = '{}_{}'.format(self.prefix, name)
+            declare(name, 'summary')
+            for q, value in sorted(histogram.quantiles().items()):
+                lines.append('{}{} {!r}'.format(
+                    name, format_labels(labels, quantile=q), value))
+            lines.append('{}_sum{} {!r}'.format(
+                name, format_labels(labels), histogram.total))
+            lines.append('{}_count{} {}'.format(
+                name, format_labels(labels), histogram.count))
+
+        for kind, values in [('gauge', gauges), ('counter', counters)]:
+            for (name, labels), value in values:
+                name = '{}_{}'.format(self.prefix, name)
+                declare(name, kind)
+                lines.append('{}{} {!r}'.format(
+                    name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''
+        Replace `path` with the current metrics, so readers never see a
+        partly written file
+        '''
+        if path.endswith('.json'):
+            text = json.dumps(self.snapshot(), indent=2, sort_keys=True)
+        else:
+            text = self.render_prometheus()
+
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.metrics')
+        try:
+            with os.fdopen(fd, 'w') as outfile:
+                outfile.write(text)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        logger.debug('Wrote metrics to %s', path)
+
+
+metrics = Metrics()
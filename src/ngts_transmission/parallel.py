@@ -0,0 +1,51 @@
+'''
+Work run inside the watcher's worker processes.
+
+These functions only touch files and plain arrays: the parent process does
+every database read and write, and sends the workers what they need.
+'''
+
+from multiprocessing import Pool
+
+from ngts_transmission.logs import logger, logging_state
+from ngts_transmission.catalogue import extract_catalogue
+from ngts_transmission.image import ImageFile, read_header
+from ngts_transmission.transmission import (
+    Photometry, TransmissionEntry, extract_photometry_results_from_catalogue)
+
+
+def init_worker():
+    logging_state.reset_after_fork()
+
+
+def build_worker_pool(workers):
+    logger.info('Starting %s worker processes', workers)
+    return Pool(processes=workers, initializer=init_worker)
+
+
+def header_task(filename):
+    '''
+    The image id of a frame, and its autoguider reference image id or None
+    if it was not autoguided
+    '''
+    header = read_header(filename)
+    return header['image_id'], header.get('agrefimg')
+
+
+def catalogue_task(ref_image_filename, detector='imcore'):
+    logger.info('Building reference catalogue from %s', ref_image_filename)
+    return extract_catalogue(ref_image_filename, detector=detector)
+
+
+def transmission_task(filename, image_id, ref_image_id, ref_arrays,
+                      sky_radius_inner, sky_radius_outer):
+    logger.info('Extracting transmission from %s', filename)
+    ref_catalogue = Photometry(*ref_arrays, ref_image_id=ref_image_id)
+    with ImageFile(filename) as image:
+        photometry_results = extract_photometry_results_from_catalogue(
+            filename, ref_catalogue, sky_radius_inner, sky_radius_outer,
+            image=image)
+    logger.info('Decompressed %s bytes from %s', image.bytes_decompressed,
+                filename)
+    photometry_results['image_id'] = image_id
+    return TransmissionEntry(**photometry_results)
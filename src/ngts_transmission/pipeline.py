@@ -0,0 +1,168 @@
+'''
+Threaded stages connected by bounded queues, so the watcher can read and
+decompress the next frame while measuring the current one.
+
+A `Stage` runs its function on each item of its inbox in a background
+thread, and puts `(item, result, error)` on its outbox. Work done on the
+calling thread (e.g. anything touching the database connection, which
+must not be shared between threads) is timed with a plain `StageStats`.
+
+Each stage records how long it was busy, its utilisation (busy time over
+the lifetime of the stage) and the depth of its inbox each time it takes an
+item. The stage with the highest utilisation is the bottleneck; a stage
+whose inbox is always full is waiting on the stage after it.
+'''
+
+from contextlib import contextmanager
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ngts_transmission.logs import logger
+
+STOP = object()
+
+
+class StageStats(object):
+
+    def __init__(self, name, threads=1):
+        self.name = name
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.
+        self.depth_total = 0
+        self.depth_max = 0
+        self.started = time.time()
+        self.stopped = None
+
+    def record_depth(self, depth):
+        with self.lock:
+            self.depth_total += depth
+            self.depth_max = max(self.depth_max, depth)
+
+    @contextmanager
+    def timed(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.busy += time.time() - start
+                self.items += 1
+
+    def finish(self):
+        if self.stopped is None:
+            self.stopped = time.time()
+
+    def stats(self):
+        elapsed = (self.stopped or time.time()) - self.started
+        capacity = elapsed * self.threads
+        return {
+            'name': self.name,
+            'threads': self.threads,
+            'items': self.items,
+            'busy': self.busy,
+            'utilisation': self.busy / capacity if capacity > 0 else 0.,
+            'mean_depth': (float(self.depth_total) / self.items
+                           if self.items else 0.),
+            'max_depth': self.depth_max,
+        }
+
+
+class Stage(StageStats):
+    '''
+    Apply `fn` to each item put on the stage in `threads` background
+    threads. At most `maxsize` items wait in the inbox (0 for no limit), so a
+    slow stage blocks the one feeding it rather than letting work pile up in
+    memory. With more than one thread, results may be put on the outbox out
+    of order. If `downstream` is given, each successful result is put on
+    that stage instead, and only failures go to the outbox.
+    '''
+
+    def __init__(self, name, fn, outbox, maxsize=0, threads=1,
+                 downstream=None):
+        super(Stage, self).__init__(name, threads=threads)
+        self.fn = fn
+        self.downstream = downstream
+        self.inbox = queue.Queue(maxsize=maxsize)
+        self.outbox = outbox
+        self.cancelled = threading.Event()
+        self.workers = [
+            threading.Thread(target=self.run,
+                             name='{}-{}'.format(name, i))
+            for i in range(threads)]
+        for worker in self.workers:
+            worker.daemon = True
+
+    def start(self):
+        self.started = time.time()
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def put(self, item):
+        self.inbox.put(item)
+
+    def stop(self):
+        '''
+        Finish the items already queued, then exit
+        '''
+        for _ in self.workers:
+            self.inbox.put(STOP)
+
+    def cancel(self):
+        '''
+        Skip any items still queued
+        '''
+        self.cancelled.set()
+        self.stop()
+
+    def is_alive(self):
+        return any(worker.is_alive() for worker in self.workers)
+
+    def join(self):
+        for worker in self.workers:
+            worker.join()
+        self.finish()
+
+    def run(self):
+        while True:
+            depth = self.inbox.qsize()
+            item = self.inbox.get()
+            if item is STOP:
+                break
+            if self.cancelled.is_set():
+                continue
+
+            self.record_depth(depth)
+            result, error = None, None
+            with self.timed():
+                try:
+                    result = self.fn(item)
+                except Exception as e:
+                    error = e
+            if error is None and self.downstream is not None:
+                self.downstream.put(result)
+            else:
+                self.outbox.put((item, result, error))
+
+
+def log_stage_stats(stages):
+    '''
+    Log the statistics of each stage, and return them
+    '''
+    stats = [stage.stats() for stage in stages]
+    for stage_stats in stats:
+        logger.info('Stage %(name)s: %(items)d items, busy %(busy).3f s, '
+                    'utilisation %(utilisation).0f%%, queue depth mean '
+                    '%(mean_depth).1f max %(max_depth)d',
+                    dict(stage_stats,
+                         utilisation=100. * stage_stats['utilisation']))
+    if stats:
+        bottleneck = max(stats, key=lambda s: s['utilisation'])
+        logger.info('Busiest stage: %s', bottleneck['name'])
+    return stats
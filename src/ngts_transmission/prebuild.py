@@ -0,0 +1,253 @@
+'''
+Build missing reference catalogues before the jobs which need them.
+
+When a new field starts, the first job waits while the catalogue of its
+autoguider reference image is built. The prebuilder polls the newest
+`lookback` rows of `autoguider_refimage` for reference images with no
+stored catalogue, newest first, and builds their catalogues in a pool
+of worker processes, at most one per worker at a time, so the watcher finds
+them already in place. Older reference images are left to the watcher.
+
+Failures are recorded in `transmission_catalogue_failures`, so they survive
+a restart. A failed reference image is tried again after `retry_time`
+seconds, up to `max_attempts` times, except one with no sources (after
+filtering), which is never tried again.
+
+Source extraction is CPU heavy, so the prebuilder refuses to start on a das
+node, and pauses whenever a Paladin process is running on the machine.
+'''
+
+import os
+import time
+from socket import gethostname
+
+from ngts_transmission.logs import logger
+from ngts_transmission.db import transaction, is_connection_error
+from ngts_transmission.catalogue import store_catalogue
+from ngts_transmission.parallel import catalogue_task
+from ngts_transmission.metrics import metrics
+from ngts_transmission.storage import catalogue_store
+from ngts_transmission.buildlock import build_lock, CatalogueBuildInProgress
+from ngts_transmission.watching import AG_REFIMAGE_PATH, ref_catalogue_exists
+
+# Seconds between checks for missing catalogues
+INTERVAL = 60
+
+# Seconds to wait before trying a failed reference image again
+RETRY_TIME = 3600
+
+# Failures after which a reference image is given up on
+MAX_ATTEMPTS = 3
+
+# Newest reference images considered
+LOOKBACK = 200
+
+# Formatted with the table of the catalogue storage
+MISSING_CATALOGUE_QUERY = '''
+select a.ref_image_id, a.filename
+from (
+    select ref_image_id, filename from autoguider_refimage
+    order by ref_image_id desc
+    limit %s
+) as a
+left join {table} as s on s.ref_image_id = a.ref_image_id
+left join transmission_catalogue_failures as f
+    on f.ref_image_id = a.ref_image_id
+where s.ref_image_id is null
+and (f.ref_image_id is null or (f.permanent = 0 and f.retry_after <= now()))
+order by a.ref_image_id desc
+limit %s
+'''
+
+# `attempts` is updated first, so `permanent` sees the new count
+RECORD_FAILURE_QUERY = '''
+insert into transmission_catalogue_failures
+    (ref_image_id, attempts, retry_after, permanent, reason)
+values (%s, 1, now() + interval %s second, %s, %s)
+on duplicate key update
+    attempts = attempts + 1,
+    retry_after = values(retry_after),
+    permanent = values(permanent) or attempts >= %s,
+    reason = values(reason)
+'''
+
+
+class EmptyCatalogue(ValueError):
+
+    def __init__(self, ref_image_id):
+        super(EmptyCatalogue, self).__init__(
+            'No sources found in reference image {}'.format(ref_image_id))
+
+
+class PaladinHost(Exception):
+
+    def __init__(self, hostname):
+        super(PaladinHost, self).__init__(
+            'Not building catalogues on das node {}'.format(hostname))
+
+
+def is_das_node(hostname=None):
+    hostname = hostname if hostname is not None else gethostname()
+    return 'das' in hostname
+
+
+def paladin_running(proc_root='/proc'):
+    '''
+    True if any process on this machine has "paladin" in its command line
+    '''
+    try:
+        pids = [pid for pid in os.listdir(proc_root) if pid.isdigit()]
+    except OSError:
+        return False
+
+    for pid in pids:
+        try:
+            with open(os.path.join(proc_root, pid, 'cmdline'), 'rb') as infile:
+                cmdline = infile.read()
+        except (IOError, OSError):
+            # The process has exited
+            continue
+        if b'paladin' in cmdline.lower():
+            return True
+    return False
+
+
+class CataloguePrebuilder(object):
+    '''
+    Build missing catalogues in `pool`, `workers` at a time, storing them
+    with connections from `db_pool` in this process
+    '''
+
+    def __init__(self, db_pool, pool, workers=1, detector='imcore',
+                 retry_time=RETRY_TIME, max_attempts=MAX_ATTEMPTS,
+                 lookback=LOOKBACK):
+        self.db_pool = db_pool
+        self.pool = pool
+        self.workers = workers
+        self.detector = detector
+        self.retry_time = retry_time
+        self.max_attempts = max_attempts
+        self.lookback = lookback
+        # Reference image id -> time after which to try it again, in case
+        # the failure could not be recorded
+        self.failed = {}
+
+    def missing_catalogues(self, cursor):
+        '''
+        Up to `workers` recent reference images without a catalogue,
+        skipping those which failed recently or permanently
+        '''
+        now = time.time()
+        self.failed = dict((ref_image_id, retry_after) for
+                           (ref_image_id, retry_after) in self.failed.items()
+                           if retry_after > now)
+        query = MISSING_CATALOGUE_QUERY.format(table=catalogue_store.table)
+        cursor.execute(query, (self.lookback,
+                               self.workers + len(self.failed)))
+        missing = [(ref_image_id, os.path.join(AG_REFIMAGE_PATH, filename))
+                   for (ref_image_id, filename) in cursor.fetchall()
+                   if ref_image_id not in self.failed]
+        return missing[:self.workers]
+
+    def step(self):
+        '''
+        Build the next missing catalogues. Returns the number stored.
+        '''
+        def find_missing(connection):
+            with transaction(connection) as cursor:
+                return self.missing_catalogues(cursor)
+
+        missing = self.db_pool.call(find_missing, idempotent=True)
+        if not missing:
+            logger.debug('No reference catalogues missing')
+            return 0
+
+        builds = [(ref_image_id, self.pool.apply_async(
+            catalogue_task, (filename,), {'detector': self.detector}))
+            for (ref_image_id, filename) in missing]
+
+        nstored = 0
+        for ref_image_id, result in builds:
+            try:
+                if self.store(ref_image_id, result.get()):
+                    nstored += 1
+            except CatalogueBuildInProgress as e:
+                logger.info('Not storing catalogue for %s: %s', ref_image_id,
+                            str(e))
+            except Exception as e:
+                if is_connection_error(e):
+                    # Not the reference image's fault, so try it next step
+                    logger.exception('Lost database connection storing '
+                                     'catalogue for %s', ref_image_id)
+                    continue
+                logger.exception('Cannot build catalogue for %s: %s',
+                                 ref_image_id, str(e))
+                self.failed[ref_image_id] = time.time() + self.retry_time
+                self.record_failure(ref_image_id, e)
+        return nstored
+
+    def record_failure(self, ref_image_id, error):
+        '''
+        Store the failure, so it is not retried before `retry_time` even
+        after a restart
+        '''
+        permanent = isinstance(error, EmptyCatalogue)
+
+        def record(connection):
+            with transaction(connection) as cursor:
+                cursor.execute(RECORD_FAILURE_QUERY, (
+                    ref_image_id, self.retry_time, permanent,
+                    str(error)[:255], self.max_attempts))
+
+        try:
+            self.db_pool.call(record, idempotent=True)
+        except Exception:
+            # Still skipped by this process until `retry_time` has passed
+            logger.exception('Cannot record failure of %s', ref_image_id)
+        metrics.increment('catalogue_prebuild_failures')
+
+    def store(self, ref_image_id, catalogue):
+        '''
+        Store `catalogue` unless a job built it while it was being
+        extracted, holding the build lock until it is committed. Returns
+        whether it was stored.
+        '''
+        if not catalogue:
+            raise EmptyCatalogue(ref_image_id)
+
+        with self.db_pool.connection() as connection:
+            try:
+                with transaction(connection) as cursor:
+                    build_lock.acquire(cursor)
+                    if ref_catalogue_exists(cursor, ref_image_id,
+                                            locking=True):
+                        logger.info('Catalogue for %s built elsewhere',
+                                    ref_image_id)
+                        return False
+                    store_catalogue(catalogue, cursor)
+            finally:
+                build_lock.release(connection)
+        logger.info('Prebuilt catalogue for %s with %s sources', ref_image_id,
+                    len(catalogue))
+        metrics.increment('catalogues_prebuilt')
+        return True
+
+    def run(self, interval=INTERVAL):
+        if is_das_node():
+            raise PaladinHost(gethostname())
+
+        logger.info('Starting catalogue prebuilder with %s workers',
+                    self.workers)
+        while True:
+            if paladin_running():
+                logger.info('Paladin is running, pausing catalogue builds')
+            else:
+                try:
+                    if self.step() > 0:
+                        # More may be waiting
+                        continue
+                except Exception as e:
+                    if not is_connection_error(e):
+                        raise
+                    logger.exception('Cannot reach the database')
+            time.sleep(interval)
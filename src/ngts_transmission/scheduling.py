@@ -0,0 +1,154 @@
+'''
+Policies choosing which of the queued jobs the watcher processes next.
+
+By default the watcher takes the newest jobs in the queue. When it falls
+behind, old jobs pile up and each still costs a full decompression, while
+for operations the latest transmission of each camera matters most.
+`CameraPriorityPolicy` looks at a wider window of the queue and puts the
+newest frame of every camera first. Once the backlog exceeds a threshold it
+can also shed load from the older frames:
+
+* 'defer': process only frames newer than those queued when shedding
+  started (the newest frame of each camera, then every frame taken since),
+  leaving the older frames queued until the backlog clears (or the jobs
+  expire)
+* 'subsample': keep the newest older frame of each camera in every
+  `spacing` second interval, and remove the rest from the queue without
+  measuring them
+
+Removed frames can be measured later with `bin/reprocess_transmission.py`.
+'''
+
+import calendar
+from collections import OrderedDict
+
+from ngts_transmission.utils import parse_image_name
+
+# Jobs processed per poll
+BATCH_SIZE = 20
+
+# Queued jobs considered per poll
+WINDOW = 200
+
+BACKLOG_THRESHOLD = 100
+SPACING = 60.
+SHED_MODES = ['none', 'defer', 'subsample']
+
+
+class Schedule(object):
+    '''
+    Jobs `selected` to process now, `deferred` to a later poll, and `shed`
+    from the queue
+    '''
+
+    def __init__(self, selected, deferred=(), shed=()):
+        self.selected = list(selected)
+        self.deferred = list(deferred)
+        self.shed = list(shed)
+
+    def __str__(self):
+        return '<Schedule {} selected, {} deferred, {} shed>'.format(
+            len(self.selected), len(self.deferred), len(self.shed))
+
+
+def frame_info(job):
+    '''
+    The camera of a job's frame, and when it was taken (Unix time). A frame
+    whose name cannot be parsed is a camera of its own, and never shed.
+    '''
+    parsed = parse_image_name(job.filename)
+    if parsed is None:
+        return job.filename, None
+    camera_id, taken = parsed
+    return camera_id, calendar.timegm(taken.utctimetuple())
+
+
+class CameraPriorityPolicy(object):
+
+    def __init__(self, batch_size=BATCH_SIZE, window=WINDOW,
+                 backlog_threshold=BACKLOG_THRESHOLD, shed='none',
+                 spacing=SPACING):
+        if shed not in SHED_MODES:
+            raise ValueError('Unknown shed mode {!r}, expected one of '
+                             '{}'.format(shed, ', '.join(SHED_MODES)))
+        self.batch_size = batch_size
+        self.window = window
+        self.backlog_threshold = backlog_threshold
+        self.shed = shed
+        self.spacing = spacing
+        # While deferring, the time of each camera's newest frame when
+        # shedding started. Older frames are held back.
+        self.fronts = {}
+
+    def shedding(self, backlog):
+        return self.shed != 'none' and backlog > self.backlog_threshold
+
+    def schedule(self, jobs, backlog, batch_size=None):
+        '''
+        Choose up to `batch_size` (by default `self.batch_size`) of `jobs`,
+        ordered newest first, given `backlog` jobs in the queue
+        '''
+        batch_size = batch_size or self.batch_size
+        by_camera = OrderedDict()
+        for job in jobs:
+            camera_id, taken = frame_info(job)
+            by_camera.setdefault(camera_id, []).append((job, taken))
+
+        shedding = self.shedding(backlog)
+        if not shedding:
+            self.fronts.clear()
+        elif self.shed == 'defer':
+            self.hold_back(by_camera)
+
+        newest = [frames[0][0] for frames in by_camera.values() if frames]
+        order = dict((id(job), i) for (i, job) in enumerate(jobs))
+        older, shed = [], []
+        if not shedding or self.shed == 'defer':
+            older = [job for frames in by_camera.values()
+                     for (job, _) in frames[1:]]
+        elif self.shed == 'subsample':
+            for frames in by_camera.values():
+                kept = set([self.interval(frames[0][1])])
+                for job, taken in frames[1:]:
+                    interval = self.interval(taken)
+                    if interval is None or interval not in kept:
+                        older.append(job)
+                        kept.add(interval)
+                    else:
+                        shed.append(job)
+        older.sort(key=lambda job: order[id(job)])
+
+        candidates = newest + older
+        scheduled = set(id(job) for job in candidates + shed)
+        deferred = [job for job in jobs if id(job) not in scheduled]
+        return Schedule(candidates[:batch_size],
+                        deferred=candidates[batch_size:] + deferred,
+                        shed=shed)
+
+    def hold_back(self, by_camera):
+        '''
+        Keep only the frames of each camera taken no earlier than its
+        newest frame when shedding started
+        '''
+        for camera_id, frames in by_camera.items():
+            times = [taken for (_, taken) in frames if taken is not None]
+            if camera_id not in self.fronts and times:
+                self.fronts[camera_id] = max(times)
+            front = self.fronts.get(camera_id)
+            if front is not None:
+                frames[:] = [(job, taken) for (job, taken) in frames
+                             if taken is None or taken >= front]
+
+    def interval(self, taken):
+        return None if taken is None else int(taken // self.spacing)
+
+
+def build_schedule_policy(name, **kwargs):
+    '''
+    None for the default of taking the newest jobs
+    '''
+    if name == 'newest':
+        return None
+    elif name == 'camera':
+        return CameraPriorityPolicy(**kwargs)
+    raise ValueError('Unknown scheduling policy {!r}'.format(name))
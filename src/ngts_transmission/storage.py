@@ -0,0 +1,223 @@
+'''
+Storage backends for reference catalogues.
+
+* 'rows' stores one row per source in `transmission_sources`. Loading a
+  catalogue of n sources fetches n tuples, which are transposed into arrays
+  in Python.
+* 'blob' stores each catalogue as a single row of `transmission_catalogues`
+  keyed by `ref_image_id`. The `data` column holds a packed record: a 16
+  byte header (magic, format version, number of columns, number of
+  sources) followed by the x, y, aperture radius and flux columns, each as
+  contiguous little endian doubles. Loading is one fetch, and the arrays
+  are read-only views of the fetched bytes rather than copies. A catalogue
+  of n sources takes 32n bytes, so 50000 sources need a
+  `max_allowed_packet` of at least 2MB.
+
+The backend used by a process is chosen with `catalogue_store.use(name)`,
+from the --catalogue-storage option of the scripts.
+`bin/migrate_catalogues.py` copies existing catalogues from rows to packed
+records, so run it before switching to 'blob'.
+'''
+
+import struct
+import numpy as np
+
+from ngts_transmission.logs import logger
+from ngts_transmission.db import bulk_insert
+
+MAGIC = b'NGTC'
+FORMAT_VERSION = 1
+
+# Magic, version, number of columns, number of sources, reserved
+HEADER = struct.Struct('<4sHHII')
+
+# In the order of the `Photometry` arrays
+COLUMNS = ('x_coordinate', 'y_coordinate', 'aperture_radius', 'flux_adu')
+DTYPE = np.dtype('<f8')
+
+STORAGES = ['rows', 'blob']
+
+
+def pack_catalogue(arrays):
+    '''
+    The packed record of the catalogue columns `arrays`, in the order of
+    `COLUMNS`
+    '''
+    data = np.ascontiguousarray(np.vstack(arrays), dtype=DTYPE)
+    if data.shape[0] != len(COLUMNS):
+        raise ValueError('Expected {} columns, got {}'.format(
+            len(COLUMNS), data.shape[0]))
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, data.shape[0], data.shape[1],
+                         0)
+    return header + data.tobytes()
+
+
+def unpack_catalogue(blob):
+    '''
+    The columns of a packed record, as read-only views of `blob`
+    '''
+    if len(blob) < HEADER.size:
+        raise ValueError('Catalogue record too short')
+    magic, version, ncolumns, nsources, _ = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a version {} catalogue record'.format(
+            FORMAT_VERSION))
+    expected = HEADER.size + ncolumns * nsources * DTYPE.itemsize
+    if len(blob) != expected:
+        raise ValueError('Catalogue record is {} bytes, expected {}'.format(
+            len(blob), expected))
+    data = np.frombuffer(blob, dtype=DTYPE, count=ncolumns * nsources,
+                         offset=HEADER.size).reshape(ncolumns, nsources)
+    return list(data)
+
+
+class RowStorage(object):
+    '''
+    One row per source in `transmission_sources`
+    '''
+
+    name = 'rows'
+    table = 'transmission_sources'
+
+    def load(self, cursor, ref_image_id):
+        cursor.execute('''select x_coordinate, y_coordinate, aperture_radius,
+            flux_adu from transmission_sources
+            where ref_image_id = %s''', (ref_image_id,))
+        return list(map(np.array, zip(*cursor.fetchall())))
+
+    def replace(self, cursor, ref_image_id, entries):
+        cursor.execute(
+            'delete from transmission_sources where ref_image_id = %s',
+            (ref_image_id,))
+        bulk_insert(cursor, 'transmission_sources', entries[0]._fields,
+                    entries)
+
+
+class BlobStorage(object):
+    '''
+    One packed record per catalogue in `transmission_catalogues`
+    '''
+
+    name = 'blob'
+    table = 'transmission_catalogues'
+
+    def load(self, cursor, ref_image_id):
+        cursor.execute('''select data from transmission_catalogues
+            where ref_image_id = %s''', (ref_image_id,))
+        row = cursor.fetchone()
+        return [] if row is None else unpack_catalogue(row[0])
+
+    def replace(self, cursor, ref_image_id, entries):
+        arrays = [[getattr(entry, column) for entry in entries]
+                  for column in COLUMNS]
+        self.store_arrays(cursor, ref_image_id, arrays,
+                          inc_prescan=entries[0].inc_prescan)
+
+    def store_arrays(self, cursor, ref_image_id, arrays, inc_prescan=1):
+        blob = pack_catalogue(arrays)
+        cursor.execute(
+            'delete from transmission_catalogues where ref_image_id = %s',
+            (ref_image_id,))
+        cursor.execute('''insert into transmission_catalogues
+            (ref_image_id, nsources, inc_prescan, data)
+            values (%s, %s, %s, %s)''',
+                       (ref_image_id, len(arrays[0]), inc_prescan, blob))
+        logger.debug('Stored %s byte catalogue for %s', len(blob),
+                     ref_image_id)
+
+
+UNMIGRATED_QUERY = '''
+select distinct s.ref_image_id
+from transmission_sources as s
+left join transmission_catalogues as c on c.ref_image_id = s.ref_image_id
+where c.ref_image_id is null
+order by s.ref_image_id
+'''
+
+MIGRATION_SOURCES_QUERY = '''
+select x_coordinate, y_coordinate, aperture_radius, flux_adu, inc_prescan
+from transmission_sources
+where ref_image_id = %s
+order by id
+'''
+
+
+def unmigrated_catalogues(cursor):
+    '''
+    Reference images with rows in `transmission_sources` but no packed
+    record
+    '''
+    cursor.execute(UNMIGRATED_QUERY)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def migrate_catalogue(cursor, ref_image_id, verify=True):
+    '''
+    Store the row based catalogue of `ref_image_id` as a packed record,
+    replacing any existing record. The rows are kept. With `verify`, the
+    record is read back and compared with the rows. Returns the number of
+    sources.
+    '''
+    cursor.execute(MIGRATION_SOURCES_QUERY, (ref_image_id,))
+    rows = cursor.fetchall()
+    if not rows:
+        raise ValueError('No sources stored for {}'.format(ref_image_id))
+
+    columns = list(zip(*rows))
+    arrays = [np.array(column, dtype=DTYPE) for column in columns[:4]]
+    blobs = BlobStorage()
+    blobs.store_arrays(cursor, ref_image_id, arrays,
+                       inc_prescan=columns[4][0])
+    if verify:
+        stored = blobs.load(cursor, ref_image_id)
+        if not all(np.array_equal(a, b) for (a, b) in zip(arrays, stored)):
+            raise ValueError('Packed catalogue for {} does not match its '
+                             'rows'.format(ref_image_id))
+    return len(rows)
+
+
+class CatalogueStore(object):
+    '''
+    The storage backend used by this process
+    '''
+
+    def __init__(self, name='rows'):
+        self.backends = dict((backend.name, backend) for backend
+                             in [RowStorage(), BlobStorage()])
+        self.use(name)
+
+    def use(self, name):
+        if name not in self.backends:
+            raise ValueError('Unknown catalogue storage {!r}, expected one '
+                             'of {}'.format(name, ', '.join(STORAGES)))
+        self.backend = self.backends[name]
+
+    @property
+    def table(self):
+        return self.backend.table
+
+    def load(self, cursor, ref_image_id):
+        '''
+        The x, y, aperture radius and flux arrays of a catalogue, or an
+        empty list if it is not stored
+        '''
+        return self.backend.load(cursor, ref_image_id)
+
+    def replace(self, cursor, ref_image_id, entries):
+        '''
+        Store the `TransmissionCatalogueEntry` rows `entries` as the whole
+        catalogue of `ref_image_id`
+        '''
+        self.backend.replace(cursor, ref_image_id, entries)
+
+
+catalogue_store = CatalogueStore()
+
+
+def add_storage_argument(parser):
+    parser.add_argument('--catalogue-storage',
+                        required=False,
+                        default='rows',
+                        choices=STORAGES,
+                        help='How reference catalogues are stored')
+    return parser
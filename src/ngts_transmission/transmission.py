@@ -1,16 +1,27 @@
 from collections import namedtuple
-import photutils as ph
-from astropy.io import fits
 import numpy as np
 
-from ngts_transmission.logs import logger
-from ngts_transmission.utils import open_fits
-from ngts_transmission.db import database_schema
+from ngts_transmission.logs import logger, debug_sampled
+from ngts_transmission.image import image_context
+from ngts_transmission.db import database_schema, bulk_insert
+from ngts_transmission.cache import reference_catalogues
+from ngts_transmission.storage import catalogue_store
+from ngts_transmission.aperture import stamp_photometry, positions_digest
+from ngts_transmission.metrics import metrics
 
 schema = database_schema()['transmission_log']
 TransmissionEntryBase = namedtuple('TransmissionEntryBase', schema.keys())
 
 
+def photutils_aperture():
+    # photutils takes about a second to import
+    try:
+        from photutils import aperture
+    except ImportError:
+        import photutils as aperture
+    return aperture
+
+
 def mad(data, median=None):
     median = median if median is not None else np.median(data)
     return np.median(np.abs(data - median))
@@ -29,63 +40,145 @@ def standard_error(flux):
     return std_from_mad(mad(flux)) / np.sqrt(flux.size)
 
 
+def aperture_area(aperture):
+    # `area` became a property in photutils 0.7
+    area = aperture.area
+    return area() if callable(area) else area
+
+
 def photometry_local(data, x, y, aperture_radius, sky_radius_inner,
                      sky_radius_outer):
     logger.debug('Sky annulus radii: %s -> %s', sky_radius_inner,
                  sky_radius_outer)
-    apertures = ph.CircularAperture((x, y), r=aperture_radius)
-    annulus_apertures = ph.CircularAnnulus((x, y),
+    ph = photutils_aperture()
+    positions = np.column_stack([x, y])
+    apertures = ph.CircularAperture(positions, r=aperture_radius)
+    annulus_apertures = ph.CircularAnnulus(positions,
                                            r_in=sky_radius_inner,
                                            r_out=sky_radius_outer)
     rawflux_table = ph.aperture_photometry(data, apertures)
     bkgflux_table = ph.aperture_photometry(data, annulus_apertures)
-    bkg_mean = bkgflux_table['aperture_sum'] / annulus_apertures.area()
-    bkg_sum = bkg_mean * apertures.area()
+    bkg_mean = bkgflux_table['aperture_sum'] / aperture_area(annulus_apertures)
+    bkg_sum = bkg_mean * aperture_area(apertures)
     final_sum = rawflux_table['aperture_sum'] - bkg_sum
     return np.array(final_sum)
 
 
+def cutout_bounds(x, y, radius, shape):
+    '''
+    Pixel bounds `(y0, y1, x0, x1)` of the region holding every aperture of
+    `radius` around the positions, clipped to an image of `shape`
+    '''
+    margin = int(np.ceil(radius)) + 1
+    ny, nx = shape
+    x0 = max(int(np.floor(np.min(x))) - margin, 0)
+    x1 = min(int(np.ceil(np.max(x))) + margin + 1, nx)
+    y0 = max(int(np.floor(np.min(y))) - margin, 0)
+    y1 = min(int(np.ceil(np.max(y))) + margin + 1, ny)
+    return y0, y1, x0, x1
+
+
+def catalogue_bounds(ref_catalogue, sky_radius_outer, shape):
+    '''
+    Pixel bounds of the region needed to measure every star of
+    `ref_catalogue`, including its sky annulus
+    '''
+    return cutout_bounds(ref_catalogue.x, ref_catalogue.y,
+                         max(sky_radius_outer, ref_catalogue.radius[0]),
+                         shape)
+
+
 def query_for_ref_image_id(image_id, cursor):
     query = '''select ref_image_id from ngts_ops.autoguider_refimage
     join ngts_ops.raw_image_list using (field, camera_id)
     where image_id = %s'''
 
-    cursor.execute(query, (image_id,))
-    return cursor.fetchone()[0]
+    with metrics.timer('catalogue_lookup'):
+        cursor.execute(query, (image_id,))
+        return cursor.fetchone()[0]
+
+
+def query_for_ref_image_ids(image_ids, cursor):
+    '''
+    Map each of `image_ids` to its reference image id in one query. Images
+    without a reference image are missing from the result.
+    '''
+    image_ids = list(image_ids)
+    if not image_ids:
+        return {}
+
+    query = '''select image_id, ref_image_id from ngts_ops.autoguider_refimage
+    join ngts_ops.raw_image_list using (field, camera_id)
+    where image_id in ({placeholder})'''.format(
+        placeholder=', '.join(['%s'] * len(image_ids)))
+
+    with metrics.timer('catalogue_lookup'):
+        cursor.execute(query, image_ids)
+        return dict(cursor.fetchall())
 
 
 class Photometry(object):
 
-    def __init__(self, x, y, radius, flux):
+    def __init__(self, x, y, radius, flux, ref_image_id=None):
         self.x = x
         self.y = y
         self.radius = radius
         self.flux = flux
-
-        self.__truediv__ = self.__div__
+        self.ref_image_id = ref_image_id
 
     @classmethod
-    def from_database(cls, cursor, ref_image_id):
-        query = '''select x_coordinate, y_coordinate, aperture_radius, flux_adu
-            from transmission_sources
-            where ref_image_id = %s'''
-
-        cursor.execute(query, (ref_image_id,))
-        rows = cursor.fetchall()
-        arrays = list(map(np.array, zip(*rows)))
-        return cls(*arrays)
+    def from_database(cls, cursor, ref_image_id, cache=None):
+        if cache is not None:
+            arrays = cache.get(ref_image_id)
+            if arrays is not None:
+                logger.debug('Reference catalogue %s loaded from cache',
+                             ref_image_id)
+                return cls(*arrays, ref_image_id=ref_image_id)
+
+        with metrics.timer('catalogue_lookup'):
+            arrays = catalogue_store.load(cursor, ref_image_id)
+        if cache is not None and arrays:
+            cache.put(ref_image_id, arrays)
+        return cls(*arrays, ref_image_id=ref_image_id)
 
     @classmethod
     def extract_from_file(cls, filename, ref_catalogue, sky_radius_inner,
-                          sky_radius_outer):
-        with open_fits(filename) as infile:
-            image_data = infile[0].data
-
-        source_flux = photometry_local(
-            image_data, ref_catalogue.x, ref_catalogue.y,
-            ref_catalogue.radius[0], sky_radius_inner, sky_radius_outer)
+                          sky_radius_outer, image=None, cutout=True,
+                          engine='stamps'):
+        '''
+        Measure the flux of each catalogue star. With `cutout` only the
+        region of the image containing the apertures is read. `engine` is
+        either 'stamps' (see `ngts_transmission.aperture`) or 'photutils'.
+        '''
+        with image_context(filename, image) as image:
+            if cutout:
+                y0, y1, x0, x1 = catalogue_bounds(
+                    ref_catalogue, sky_radius_outer, image.shape)
+                logger.debug('Reading image section [%s:%s, %s:%s]',
+                             y0, y1, x0, x1)
+                image_data = image.section(y0, y1, x0, x1)
+            else:
+                y0, x0 = 0, 0
+                image_data = image.data
+
+            with metrics.timer('photometry'):
+                if engine == 'photutils':
+                    source_flux = photometry_local(
+                        image_data, ref_catalogue.x - x0,
+                        ref_catalogue.y - y0, ref_catalogue.radius[0],
+                        sky_radius_inner, sky_radius_outer)
+                else:
+                    key = (None if ref_catalogue.ref_image_id is None
+                           else (ref_catalogue.ref_image_id,
+                                 positions_digest(ref_catalogue.x,
+                                                  ref_catalogue.y),
+                                 x0, y0))
+                    source_flux = stamp_photometry(
+                        image_data, ref_catalogue.x - x0,
+                        ref_catalogue.y - y0, ref_catalogue.radius[0],
+                        sky_radius_inner, sky_radius_outer, key=key)
         return cls(ref_catalogue.x, ref_catalogue.y, ref_catalogue.radius,
-                   source_flux)
+                   source_flux, ref_image_id=ref_catalogue.ref_image_id)
 
     def flag(self):
         return 0.
@@ -95,13 +188,28 @@ class Photometry(object):
             np.isclose(self.x, other.x) & np.isclose(self.y, other.y))
 
         return self.__class__(
-            self.x, self.y, self.radius, self.flux / other.flux)
+            self.x, self.y, self.radius, self.flux / other.flux,
+            ref_image_id=self.ref_image_id)
+
+    # Python 3 looks up operators on the class, not the instance
+    __truediv__ = __div__
 
 def extract_photometry_results_from_ref_id(filename, ref_image_id, cursor,
-                                           sky_radius_inner, sky_radius_outer):
-    ref_catalogue = Photometry.from_database(cursor, ref_image_id)
+                                           sky_radius_inner, sky_radius_outer,
+                                           cache=reference_catalogues,
+                                           image=None):
+    ref_catalogue = Photometry.from_database(cursor, ref_image_id, cache=cache)
+    return extract_photometry_results_from_catalogue(
+        filename, ref_catalogue, sky_radius_inner, sky_radius_outer,
+        image=image)
+
+
+def extract_photometry_results_from_catalogue(filename, ref_catalogue,
+                                              sky_radius_inner,
+                                              sky_radius_outer, image=None):
     source_flux = Photometry.extract_from_file(
-        filename, ref_catalogue, sky_radius_inner, sky_radius_outer)
+        filename, ref_catalogue, sky_radius_inner, sky_radius_outer,
+        image=image)
     flux_ratio = source_flux / ref_catalogue
 
     return {
@@ -117,24 +225,26 @@ def extract_photometry_results_from_ref_id(filename, ref_image_id, cursor,
     }
 
 def extract_photometry_results(filename, cursor, image_id, sky_radius_inner,
-                               sky_radius_outer):
+                               sky_radius_outer, image=None):
     '''placeholder for Max's code'''
     ref_image_id = query_for_ref_image_id(image_id, cursor)
     return extract_photometry_results_from_ref_id(
-        filename, ref_image_id, cursor, sky_radius_inner, sky_radius_outer)
+        filename, ref_image_id, cursor, sky_radius_inner, sky_radius_outer,
+        image=image)
 
 
 class TransmissionEntry(TransmissionEntryBase):
 
     @classmethod
-    def from_file(cls, filename, cursor, sky_radius_inner, sky_radius_outer):
+    def from_file(cls, filename, cursor, sky_radius_inner, sky_radius_outer,
+                  image=None):
         logger.info('Extracting transmission from %s', filename)
-        with open_fits(filename) as infile:
-            header = infile[0].header
-            image_id = header['image_id']
+        with image_context(filename, image) as image:
+            image_id = image.header['image_id']
 
-        photometry_results = extract_photometry_results(
-            filename, cursor, image_id, sky_radius_inner, sky_radius_outer)
+            photometry_results = extract_photometry_results(
+                filename, cursor, image_id, sky_radius_inner,
+                sky_radius_outer, image=image)
         photometry_results['image_id'] = image_id
 
         return cls(**photometry_results)
@@ -146,6 +256,19 @@ class TransmissionEntry(TransmissionEntryBase):
         values ({placeholder})'''.format(
             keys=', '.join(keys),
             placeholder=', '.join(['%s'] * len(keys)))
-        logger.debug('Executing query: `%s` : [%s]', query,
-                     ', '.join(map(str, values)))
+        debug_sampled('upload_to_database', 'Executing query: `%s` : %s',
+                      query, values)
         cursor.execute(query, values)
+
+
+def upload_entries(entries, cursor, chunk_size=None, upsert=False):
+    '''
+    Upload many transmission entries with batched inserts. With `upsert`,
+    entries replace any already uploaded for the same image.
+    '''
+    entries = list(entries)
+    if not entries:
+        return
+
+    bulk_insert(cursor, 'transmission_log', TransmissionEntry._fields,
+                entries, chunk_size=chunk_size, upsert=upsert)
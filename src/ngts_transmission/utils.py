@@ -1,13 +1,19 @@
 from contextlib import contextmanager
 import bz2
-from astropy.io import fits
+import datetime
+import os
+import re
 import time
 
 from ngts_transmission.logs import logger
 
+# e.g. IMAGE80520150920234004.fits: camera 805, taken 2015-09-20 23:40:04
+IMAGE_NAME = re.compile(r'IMAGE(\d{3})(\d{14})\.fits')
+
 
 @contextmanager
 def open_fits(fname):
+    from astropy.io import fits
     if '.bz2' in fname:
         with bz2.BZ2File(fname) as uncompressed:
             with fits.open(uncompressed) as infile:
@@ -26,3 +32,16 @@ def time_context(message=None):
         logger.debug('Time taken: %s seconds', end - start)
     else:
         logger.debug(message, end - start)
+
+
+def parse_image_name(filename):
+    '''
+    The camera id, and the time the frame was taken, from the file name of
+    a frame. Returns None if the name does not follow the usual pattern.
+    '''
+    match = IMAGE_NAME.search(os.path.basename(filename))
+    if match is None:
+        return None
+    camera_id, taken = match.groups()
+    return (int(camera_id),
+            datetime.datetime.strptime(taken, '%Y%m%d%H%M%S'))
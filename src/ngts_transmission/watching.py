@@ -9,36 +9,90 @@
     * extract the sources
 '''
 
-import pymysql
+import argparse
 import os
-from astropy.io import fits
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import time
-import Pyro4
 
-from ngts_transmission.logs import logger
+from ngts_transmission.logs import (logger, configure_logging,
+                                    parse_log_levels)
 from ngts_transmission.utils import open_fits, time_context
-from ngts_transmission.transmission import TransmissionEntry
-from ngts_transmission.catalogue import build_catalogue
-from ngts_transmission.db import transaction
-
-# Limit the query to only 20 objects per 60 seconds
+from ngts_transmission.image import ImageFile, read_header
+from ngts_transmission.transmission import (
+    TransmissionEntry, Photometry, query_for_ref_image_id, upload_entries,
+    extract_photometry_results_from_catalogue, catalogue_bounds)
+from ngts_transmission.catalogue import build_catalogue, store_catalogue
+from ngts_transmission.db import (transaction, chunked, get_pool,
+                                  is_connection_error, insert_settings,
+                                  add_insert_arguments)
+from ngts_transmission.cache import reference_catalogues
+from ngts_transmission.storage import catalogue_store, add_storage_argument
+from ngts_transmission.parallel import (build_worker_pool, catalogue_task,
+                                        transmission_task)
+from ngts_transmission.jobsource import (PollingSource, build_job_source,
+                                         SOCKET_PATH)
+from ngts_transmission.leases import JobLeases, LeaseLost
+from ngts_transmission.pipeline import Stage, StageStats, log_stage_stats
+from ngts_transmission.metrics import metrics
+from ngts_transmission.adaptive import (AdaptiveController, MIN_BATCH,
+                                        MAX_BATCH, MIN_INTERVAL, MAX_INTERVAL,
+                                        TARGET_LATENCY)
+from ngts_transmission.buildlock import build_lock, CatalogueBuildInProgress
+from ngts_transmission.scheduling import (BATCH_SIZE, SHED_MODES,
+                                          BACKLOG_THRESHOLD, SPACING, WINDOW,
+                                          build_schedule_policy)
+
+# Limit the query to `BATCH_SIZE` objects per poll by default. The adaptive
+# controller changes the batch size, and a scheduling policy may look at a
+# wider window
 SEP = '|'
-JOB_QUERY = '''
+JOB_QUERY_TEMPLATE = '''
 select
-    job_id, group_concat(concat_ws('=', arg_key, arg_value) separator '{sep}') as args
+    job_id, group_concat(concat_ws('=', arg_key, arg_value) separator '{sep}') as args,
+    unix_timestamp(submitted) as submitted
 from job_queue left join job_args using (job_id)
 where expires > now()
 and job_type = 'transparency'
+{condition}
 group by job_id
 order by submitted desc
-limit 20
-'''.format(sep=SEP)
+limit %s
+'''
+JOB_QUERY = JOB_QUERY_TEMPLATE.format(sep=SEP, condition='')
+
+# Skip jobs currently leased by any watcher
+UNLEASED_CONDITION = '''
+and job_id not in (
+    select job_id from transmission_job_lease where expires > now())
+'''
+LEASED_JOB_QUERY = JOB_QUERY_TEMPLATE.format(sep=SEP,
+                                             condition=UNLEASED_CONDITION)
+
+BACKLOG_QUERY_TEMPLATE = '''
+select count(*) from job_queue
+where expires > now()
+and job_type = 'transparency'
+{condition}
+'''
+BACKLOG_QUERY = BACKLOG_QUERY_TEMPLATE.format(condition='')
+
+# Jobs another watcher could still claim, excluding those under lease
+UNLEASED_BACKLOG_QUERY = BACKLOG_QUERY_TEMPLATE.format(
+    condition=UNLEASED_CONDITION)
 
+# Point lookup in the table of the catalogue storage, served by the
+# `ref_image_id` index on transmission_sources, or the primary key of
+# transmission_catalogues
 REFCAT_QUERY = '''
-select distinct ref_image_id
-from transmission_sources
+select 1 from {table} where ref_image_id = %s limit 1
 '''
 
+# Reads the latest committed rows, rather than the transaction's snapshot
+REFCAT_LOCKING_QUERY = REFCAT_QUERY + 'lock in share mode\n'
+
 REFFILENAME_QUERY = '''
 select filename from autoguider_refimage where ref_image_id = %s
 '''
@@ -48,7 +102,9 @@ AG_REFIMAGE_PATH = os.path.join('/', 'ngts', 'autoguider_ref')
 RADIUS_INNER = 4.
 RADIUS_OUTER = 8.
 
-SLEEP_TIME = 2  # Seconds
+# Reference catalogues are never removed, so once a reference id has been
+# seen in the database it is remembered for the lifetime of the process
+known_ref_ids = set()
 
 
 class NoAutoguider(Exception):
@@ -59,41 +115,63 @@ class NoAutoguider(Exception):
 
 class Job(object):
 
-    def __init__(self, job_id, filename):
+    def __init__(self, job_id, filename, submitted=None):
         self.job_id = job_id
         self.filename = filename
+        # Unix time the job was queued
+        self.submitted = submitted
+        self.bytes_decompressed = 0
 
     @classmethod
     def from_row(cls, row):
-        job_id, args = row
+        job_id, args = row[:2]
+        submitted = row[2] if len(row) > 2 else None
         args = args.split(SEP)
         mapping = dict([arg.split('=') for arg in args])
-        return cls(job_id=job_id, filename=mapping['file'])
+        return cls(job_id=job_id, filename=mapping['file'],
+                   submitted=None if submitted is None else float(submitted))
 
     def update(self, cursor):
+        t = self.measure(cursor)
+        if t is not None:
+            t.upload_to_database(cursor)
+
+    def measure(self, cursor):
+        '''
+        Build the reference catalogue if required and measure the
+        transmission, without uploading the result. Returns None if the
+        image was not autoguided.
+
+        The image is opened once and shared by every step.
+        '''
+        with ImageFile(self.real_filename) as image:
+            try:
+                entry = self.measure_image(cursor, image)
+            finally:
+                self.bytes_decompressed = image.bytes_decompressed
+                logger.info('Decompressed %s bytes for %s',
+                            self.bytes_decompressed, self)
+        return entry
+
+    def measure_image(self, cursor, image):
         try:
-            ref_image_id = get_refcat_id(self.real_filename)
+            ref_image_id = get_refcat_id(image.filename, header=image.header)
         except NoAutoguider:
             # Return early but ensure the job is removed from the database by
             # not propogating the exception
-            return
+            return None
 
-        if not ref_catalogue_exists(cursor, ref_image_id):
-            logger.info('Reference catalogue missing, creating')
-            ref_image_filename = ref_image_path(ref_image_id, cursor)
-            build_catalogue(ref_image_filename, cursor)
-        else:
-            logger.info('Reference catalogue exists')
-
-        t = TransmissionEntry.from_file(self.real_filename, cursor,
-                                        sky_radius_inner=RADIUS_INNER,
-                                        sky_radius_outer=RADIUS_OUTER)
-        t.upload_to_database(cursor)
+        ensure_ref_catalogue(cursor, ref_image_id)
+        return TransmissionEntry.from_file(image.filename, cursor,
+                                           sky_radius_inner=RADIUS_INNER,
+                                           sky_radius_outer=RADIUS_OUTER,
+                                           image=image)
 
     def remove_from_database(self, cursor):
-        logger.info('Removing {self} from the database'.format(self=self))
-        cursor.execute('delete from job_queue where job_id = %s',
-                       (self.job_id,))
+        logger.info('Removing %s from the database', self)
+        with metrics.timer('job_delete'):
+            cursor.execute('delete from job_queue where job_id = %s',
+                           (self.job_id,))
 
     @property
     def real_filename(self):
@@ -102,9 +180,10 @@ class Job(object):
         '''
         trial_names = [self.filename, '{filename}.bz2'.format(
             filename=self.filename)]
-        for filename in trial_names:
-            if os.path.isfile(filename):
-                return filename
+        with metrics.timer('file_resolve'):
+            for filename in trial_names:
+                if os.path.isfile(filename):
+                    return filename
         raise OSError('Cannot find any of the files: {files}'.format(
             files=', '.join(trial_names)))
 
@@ -118,26 +197,110 @@ class Job(object):
         return str(self)
 
 
-def fetch_transmission_jobs(cursor):
-    logger.info('Fetching transmission jobs')
-    cursor.execute(JOB_QUERY)
-    # Prefetch the jobs to allow the cursor to perform another query
-    jobs = cursor.fetchall()
-    return [Job.from_row(row) for row in jobs]
-
+def fetch_transmission_jobs(cursor, leases=None, policy=None, backlog=0,
+                            batch_size=None):
+    '''
+    Fetch up to `batch_size` (by default `BATCH_SIZE`) pending jobs. If
+    `leases` is given, only jobs not leased by another watcher are fetched,
+    and only those this watcher manages to claim are returned.
 
-def ref_catalogue_exists(cursor, ref_id):
-    logger.info('Checking if ref image {ref_id} exists'.format(ref_id=ref_id))
-    cursor.execute(REFCAT_QUERY)
-    ref_ids = set([row[0] for row in cursor])
-    return ref_id in ref_ids
+    With a scheduling `policy` (see `ngts_transmission.scheduling`), the
+    policy chooses which jobs of a wider window to process given the
+    `backlog`. Jobs it sheds are removed from the queue unmeasured.
+    '''
+    logger.info('Fetching transmission jobs')
+    batch_size = batch_size or BATCH_SIZE
+    limit = batch_size if policy is None else max(policy.window, batch_size)
+    with metrics.timer('job_fetch'):
+        cursor.execute(JOB_QUERY if leases is None else LEASED_JOB_QUERY,
+                       (limit,))
+        # Prefetch the jobs to allow the cursor to perform another query
+        jobs = [Job.from_row(row) for row in cursor.fetchall()]
+        shed = []
+        if policy is not None:
+            schedule = policy.schedule(jobs, backlog, batch_size=batch_size)
+            jobs, shed = schedule.selected, schedule.shed
+
+        if leases is not None:
+            # Shed jobs are claimed too, so no other watcher is measuring
+            # them when they are removed
+            claimed = leases.claim(cursor,
+                                   [job.job_id for job in jobs + shed])
+            jobs = [job for job in jobs if job.job_id in claimed]
+            shed = [job for job in shed if job.job_id in claimed]
+
+    if policy is not None:
+        for job in shed:
+            job.remove_from_database(cursor)
+        logger.info('Scheduled %s jobs, deferred %s, shed %s', len(jobs),
+                    len(schedule.deferred), len(shed))
+        metrics.set_gauge('jobs_deferred', len(schedule.deferred))
+        metrics.increment('jobs_shed', len(shed))
+    return jobs
+
+
+def count_pending_jobs(cursor, leases=None):
+    '''
+    The number of queued jobs. With `leases`, jobs leased by any watcher
+    are not counted, since this watcher cannot fetch them.
+    '''
+    cursor.execute(BACKLOG_QUERY if leases is None else UNLEASED_BACKLOG_QUERY)
+    backlog, = cursor.fetchone()
+    return backlog
+
+
+def ref_catalogue_exists(cursor, ref_id, known_ref_ids=None, locking=False):
+    '''
+    With `locking`, see catalogues committed by other processes since this
+    transaction started
+    '''
+    if known_ref_ids is not None and ref_id in known_ref_ids:
+        logger.debug('Ref image %s already known', ref_id)
+        return True
+
+    logger.info('Checking if ref image %s exists', ref_id)
+    with metrics.timer('catalogue_lookup'):
+        query = REFCAT_LOCKING_QUERY if locking else REFCAT_QUERY
+        cursor.execute(query.format(table=catalogue_store.table), (ref_id,))
+        exists = any(True for _ in cursor)
+    if exists and known_ref_ids is not None:
+        known_ref_ids.add(ref_id)
+    return exists
+
+
+def claim_catalogue_build(cursor, ref_image_id):
+    '''
+    Take the build lock if the catalogue is missing, returning whether it
+    still needs building. Raises `CatalogueBuildInProgress` if another
+    process holds the lock for too long.
+    '''
+    if ref_catalogue_exists(cursor, ref_image_id,
+                            known_ref_ids=known_ref_ids):
+        return False
+
+    build_lock.acquire(cursor)
+    if ref_catalogue_exists(cursor, ref_image_id,
+                            known_ref_ids=known_ref_ids, locking=True):
+        logger.info('Reference catalogue %s built by another process',
+                    ref_image_id)
+        return False
+    return True
+
+
+def ensure_ref_catalogue(cursor, ref_image_id):
+    if claim_catalogue_build(cursor, ref_image_id):
+        logger.info('Reference catalogue missing, creating')
+        with metrics.timer('catalogue_build'):
+            ref_image_filename = ref_image_path(ref_image_id, cursor)
+            build_catalogue(ref_image_filename, cursor)
+    else:
+        logger.info('Reference catalogue exists')
 
 
-def get_refcat_id(filename):
-    logger.debug('Extracting reference image id from {filename}'.format(
-        filename=filename))
-    with open_fits(filename) as infile:
-        header = infile[0].header
+def get_refcat_id(filename, header=None):
+    logger.debug('Extracting reference image id from %s', filename)
+    if header is None:
+        header = read_header(filename)
 
     try:
         return header['agrefimg']
@@ -156,30 +319,366 @@ def ref_image_path(ref_image_id, cursor):
     return os.path.join(AG_REFIMAGE_PATH, row[0])
 
 
-def watcher_loop_step(connection):
+def upload_results(cursor, completed):
+    '''
+    Upload the transmission entries of the completed `(job, entry)` pairs
+    with batched inserts (see `db.insert_settings`), and remove the jobs
+    from the queue. Jobs without an entry (not autoguided) are removed
+    without an upload. If a batch insert fails each entry is retried on its
+    own, so one bad entry only fails its own job.
+    '''
+    entries = [entry for (_, entry) in completed if entry is not None]
+    try:
+        with metrics.timer('upload'):
+            upload_entries(entries, cursor)
+        uploaded = completed
+    except Exception as e:
+        logger.exception('Batch upload failed, uploading individually: %s',
+                         str(e))
+        uploaded = []
+        for transmission_job, entry in completed:
+            try:
+                # Entries from chunks inserted before the failure are
+                # replaced rather than duplicated
+                if entry is not None:
+                    upload_entries([entry], cursor, upsert=True)
+            except Exception as e:
+                logger.exception('Exception occurred: %s', str(e))
+            else:
+                uploaded.append((transmission_job, entry))
+
+    now = time.time()
+    for transmission_job, _ in uploaded:
+        transmission_job.remove_from_database(cursor)
+        metrics.increment('jobs_completed')
+        if transmission_job.submitted is not None:
+            metrics.observe('queue_latency_seconds',
+                            now - transmission_job.submitted)
+
+
+def process_jobs(cursor, jobs):
+    njobs = len(jobs)
+    completed = []
+    for i, transmission_job in enumerate(jobs):
+        logger.info('Job %d/%d', i + 1, njobs)
+        try:
+            entry = transmission_job.measure(cursor)
+        except CatalogueBuildInProgress as e:
+            logger.info('Deferring %s: %s', transmission_job, str(e))
+        except Exception as e:
+            logger.exception('Exception occurred: %s', str(e))
+        else:
+            completed.append((transmission_job, entry))
+
+    upload_results(cursor, completed)
+
+
+def build_missing_catalogues(cursor, ref_image_ids, pool):
+    '''
+    Build each missing reference catalogue once, extracting the sources in
+    the worker pool. Returns the reference image ids whose catalogue could
+    not be built.
+    '''
+    builds, failed_ref_ids = {}, set()
+    for ref_image_id in ref_image_ids:
+        try:
+            if not claim_catalogue_build(cursor, ref_image_id):
+                continue
+            logger.info('Reference catalogue %s missing, creating',
+                        ref_image_id)
+            ref_image_filename = ref_image_path(ref_image_id, cursor)
+        except CatalogueBuildInProgress as e:
+            logger.info('Deferring jobs of %s: %s', ref_image_id, str(e))
+            failed_ref_ids.add(ref_image_id)
+        except Exception as e:
+            logger.exception('Exception occurred: %s', str(e))
+            failed_ref_ids.add(ref_image_id)
+        else:
+            builds[ref_image_id] = pool.apply_async(catalogue_task,
+                                                    (ref_image_filename,))
+
+    for ref_image_id, result in builds.items():
+        try:
+            with metrics.timer('catalogue_build'):
+                store_catalogue(result.get(), cursor)
+        except Exception as e:
+            logger.exception('Exception occurred: %s', str(e))
+            failed_ref_ids.add(ref_image_id)
+    return failed_ref_ids
+
+
+def process_jobs_in_pool(cursor, jobs, pool):
+    '''
+    Equivalent to `process_jobs`, but decompression, source detection and
+    photometry run in the worker pool. Database reads and writes stay in
+    this process, and as before a job is only removed once its transmission
+    entry has been uploaded.
+    '''
+    njobs = len(jobs)
+
+    # Read the reference image id from each header
+    pending, completed = [], []
+    for i, transmission_job in enumerate(jobs):
+        logger.info('Job %d/%d', i + 1, njobs)
+        try:
+            filename = transmission_job.real_filename
+            header = read_header(filename)
+            ref_image_id = get_refcat_id(filename, header=header)
+        except NoAutoguider:
+            completed.append((transmission_job, None))
+        except Exception as e:
+            logger.exception('Exception occurred: %s', str(e))
+        else:
+            pending.append((transmission_job, filename, header['image_id'],
+                            ref_image_id))
+
+    failed_ref_ids = build_missing_catalogues(
+        cursor, set(row[3] for row in pending), pool)
+
+    # Measure the transmission
+    results = []
+    for transmission_job, filename, image_id, ref_image_id in pending:
+        if ref_image_id in failed_ref_ids:
+            continue
+        try:
+            ref_catalogue = Photometry.from_database(
+                cursor, query_for_ref_image_id(image_id, cursor),
+                cache=reference_catalogues)
+        except Exception as e:
+            logger.exception('Exception occurred: %s', str(e))
+            continue
+        ref_arrays = (ref_catalogue.x, ref_catalogue.y, ref_catalogue.radius,
+                      ref_catalogue.flux)
+        results.append((transmission_job, pool.apply_async(
+            transmission_task, (filename, image_id,
+                                ref_catalogue.ref_image_id, ref_arrays,
+                                RADIUS_INNER, RADIUS_OUTER))))
+
+    for transmission_job, result in results:
+        try:
+            completed.append((transmission_job, result.get()))
+        except Exception as e:
+            logger.exception('Exception occurred: %s', str(e))
+
+    upload_results(cursor, completed)
+
+
+def prepare_image(cursor, image):
+    '''
+    Database work for one image: make sure the reference catalogue exists,
+    and load it. Only the header of the image is read.
+    '''
+    ref_image_id = get_refcat_id(image.filename, header=image.header)
+    ensure_ref_catalogue(cursor, ref_image_id)
+    return Photometry.from_database(
+        cursor, query_for_ref_image_id(image.header['image_id'], cursor),
+        cache=reference_catalogues)
+
+
+def prefetch_image(item):
+    '''
+    Pipeline stage: read, and decompress if needed, the region of the image
+    which the photometry will use
+    '''
+    _, image, ref_catalogue = item
+    try:
+        image.section(*catalogue_bounds(ref_catalogue, RADIUS_OUTER,
+                                        image.shape))
+    except Exception:
+        image.close()
+        raise
+    return item
+
+
+def measure_transmission(item):
+    '''
+    Pipeline stage: measure the transmission of an image against its
+    reference catalogue
+    '''
+    _, image, ref_catalogue = item
+    with image:
+        results = extract_photometry_results_from_catalogue(
+            image.filename, ref_catalogue, RADIUS_INNER, RADIUS_OUTER,
+            image=image)
+        results['image_id'] = image.header['image_id']
+    return TransmissionEntry(**results)
+
+
+def process_jobs_pipelined(cursor, jobs, depth=2, prefetch_threads=1):
+    '''
+    Equivalent to `process_jobs`, but pipelined: this thread reads each
+    header and does the database work, `prefetch_threads` background
+    threads read and decompress the pixels, and another thread measures the
+    photometry. At most `depth` images wait before each background stage,
+    so the file I/O for the next jobs overlaps the photometry of the
+    current one. Returns the statistics of each stage.
+    '''
+    njobs = len(jobs)
+    measured = queue.Queue()
+    photometry = Stage('photometry', measure_transmission, measured,
+                       maxsize=depth).start()
+    prefetch = Stage('prefetch', prefetch_image, measured, maxsize=depth,
+                     threads=prefetch_threads, downstream=photometry).start()
+    prepare, upload = StageStats('prepare'), StageStats('upload')
+
+    completed, nsent = [], 0
+    try:
+        for i, transmission_job in enumerate(jobs):
+            logger.info('Job %d/%d', i + 1, njobs)
+            with prepare.timed():
+                try:
+                    image = ImageFile(transmission_job.real_filename)
+                    ref_catalogue = prepare_image(cursor, image)
+                except NoAutoguider:
+                    completed.append((transmission_job, None))
+                    continue
+                except CatalogueBuildInProgress as e:
+                    logger.info('Deferring %s: %s', transmission_job, str(e))
+                    continue
+                except Exception as e:
+                    logger.exception('Exception occurred: %s', str(e))
+                    continue
+
+            # Blocks while `depth` images are waiting to be read
+            prefetch.put((transmission_job, image, ref_catalogue))
+            nsent += 1
+    except Exception:
+        prefetch.cancel()
+        raise
+    finally:
+        prepare.finish()
+        prefetch.stop()
+        prefetch.join()
+        photometry.stop()
+        photometry.join()
+
+    for _ in range(nsent):
+        (transmission_job, _, _), entry, error = measured.get()
+        if error is not None:
+            logger.error('Exception occurred measuring %s: %s',
+                         transmission_job, error)
+        else:
+            completed.append((transmission_job, entry))
+
+    with upload.timed():
+        upload_results(cursor, completed)
+    upload.finish()
+    return log_stage_stats([prepare, prefetch, photometry, upload])
+
+
+def commit_in_groups(connection, jobs, process, commit_every=0,
+                     timings=None, leases=None):
+    '''
+    Call `process(cursor, group)` for consecutive groups of `commit_every`
+    jobs (all of the jobs if 0), each in its own transaction. A job is only
+    removed from the queue in the same transaction as its result, so once a
+    group is committed its results are visible and its jobs are gone, and
+    if a group is rolled back its jobs stay queued to be retried. A group
+    which raises stops the remaining groups. Returns the number of groups
+    committed.
+
+    With `leases`, the leases on each group are renewed before it is
+    processed, skipping any jobs already lost to another watcher, and
+    confirmed before it is committed. A group which lost a lease while it
+    was processed is rolled back, and the remaining groups continue.
+    '''
+    group_size = commit_every if commit_every > 0 else max(len(jobs), 1)
+    ngroups = 0
+    for group in chunked(jobs, group_size):
+        if leases is not None:
+            group = renew_leases(connection, leases, group)
+            if not group:
+                continue
+        try:
+            with transaction(connection, timings=timings) as cursor:
+                process(cursor, group)
+                if leases is not None:
+                    leases.confirm(cursor, [job.job_id for job in group])
+                    leases.release(cursor)
+        except LeaseLost as e:
+            known_ref_ids.clear()
+            logger.warning('Rolled back %s jobs: %s', len(group), str(e))
+            metrics.increment('leases_lost', len(e.job_ids))
+            continue
+        except Exception:
+            # Catalogues seen in the rolled back transaction may not exist
+            known_ref_ids.clear()
+            raise
+        finally:
+            # Any catalogue built by the group is now committed, or gone
+            build_lock.release(connection)
+        ngroups += 1
+        if timings is not None:
+            logger.info('Committed %s jobs, transaction held for %.3f s',
+                        len(group), timings[-1])
+    return ngroups
+
+
+def renew_leases(connection, leases, jobs):
+    '''
+    Extend the leases on `jobs` in a transaction of their own, so other
+    watchers see them at once, returning the jobs still owned
+    '''
+    with transaction(connection) as cursor:
+        owned = leases.renew(cursor, [job.job_id for job in jobs])
+    lost = [job for job in jobs if job.job_id not in owned]
+    if lost:
+        logger.warning('Skipping %s jobs whose leases have been taken over',
+                       len(lost))
+        metrics.increment('leases_lost', len(lost))
+    return [job for job in jobs if job.job_id in owned]
+
+
+def watcher_loop_step(connection, pool=None, leases=None, pipeline_depth=0,
+                      prefetch_threads=1, commit_every=0, policy=None,
+                      batch_size=None):
+    '''
+    Fetch and process one batch of jobs. Returns the number of jobs fetched,
+    and the number queued before fetching.
+    '''
     # Starts transaction for job_queue table, short lived so Paladin should not
-    # have a write lock
+    # have a write lock. Committing it publishes any claims to other watchers
     with transaction(connection) as cursor:
-        transmission_jobs = fetch_transmission_jobs(cursor)
+        backlog = count_pending_jobs(cursor, leases=leases)
+        transmission_jobs = fetch_transmission_jobs(
+            cursor, leases=leases, policy=policy, backlog=backlog,
+            batch_size=batch_size)
 
     njobs = len(transmission_jobs)
-    logger.info('Found %s jobs', njobs)
+    logger.info('Found %s jobs, %s pending', njobs, backlog)
+    metrics.set_gauge('backlog', backlog)
+
+    def process(cursor, jobs):
+        if pool is not None:
+            process_jobs_in_pool(cursor, jobs, pool)
+        elif pipeline_depth > 0:
+            process_jobs_pipelined(cursor, jobs, depth=pipeline_depth,
+                                   prefetch_threads=prefetch_threads)
+        else:
+            process_jobs(cursor, jobs)
 
-    # Separate transaction for updating transmission database
-    with transaction(connection) as cursor:
-        for i, transmission_job in enumerate(transmission_jobs):
-            logger.info('Job %d/%d', i + 1, njobs)
-            try:
-                transmission_job.update(cursor)
-            except Exception as e:
-                logger.exception('Exception occurred: %s', str(e))
-            else:
-                transmission_job.remove_from_database(cursor)
+    # Separate transactions for updating transmission database
+    commit_in_groups(connection, transmission_jobs, process,
+                     commit_every=commit_every, timings=[], leases=leases)
 
+    logger.debug('Reference catalogue cache: %s', reference_catalogues.stats())
+    return njobs, backlog
+
+
+def watcher(db_pool, pool=None, job_source=None, leases=None,
+            pipeline_depth=0, prefetch_threads=1, commit_every=0,
+            metrics_file=None, policy=None, controller=None):
+    '''
+    Process jobs until stopped, with a connection from `db_pool` for each
+    batch. If the connection is lost the batch is left to the next poll,
+    which reconnects.
+    '''
+    if job_source is None:
+        job_source = PollingSource()
 
-def watcher(connection):
     logger.info('Starting watcher')
     logger.debug('Connecting to central hub')
+    import Pyro4
     hub = Pyro4.Proxy('PYRONAME:central.hub')
     try:
         hub.startThread('Transparency')
@@ -195,14 +694,235 @@ def watcher(connection):
             logger.exception('Failure communicating with hub process')
             raise
 
-        with time_context():
-            watcher_loop_step(connection)
-
-        logger.debug('Sleeping for %s seconds', SLEEP_TIME)
-        time.sleep(SLEEP_TIME)
-
-
-def main():
-    logger.setLevel('DEBUG')
-    connection = pymysql.connect(host='ngts-par-ds', user='ops', db='ngts_ops')
-    watcher(connection)
+        start = time.time()
+        batch_size = controller.batch_size if controller else BATCH_SIZE
+        try:
+            with time_context(), metrics.timer('loop_step'), \
+                    db_pool.connection() as connection:
+                njobs, backlog = watcher_loop_step(
+                    connection, pool=pool, leases=leases,
+                    pipeline_depth=pipeline_depth,
+                    prefetch_threads=prefetch_threads,
+                    commit_every=commit_every, policy=policy,
+                    batch_size=batch_size)
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            logger.exception('Lost database connection, retrying at the '
+                             'next poll')
+            metrics.increment('db_connection_lost')
+            njobs, backlog = 0, 0
+        logger.debug('Database connections: %s', db_pool.stats())
+
+        if controller is not None:
+            controller.update(njobs, time.time() - start, backlog)
+            job_source.interval = controller.interval
+
+        if metrics_file is not None:
+            try:
+                metrics.write(metrics_file)
+            except Exception:
+                logger.exception('Cannot write metrics to %s', metrics_file)
+
+        # A full batch, or jobs left behind, means there is more to do now.
+        # Queued jobs none of which could be taken must not cause a tight
+        # polling loop
+        if njobs > 0 and (njobs >= batch_size or backlog > njobs):
+            logger.debug('More jobs queued, polling again')
+        elif job_source.wait():
+            logger.info('Woken by job notification')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Watch the job queue for transmission jobs',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-w', '--workers',
+                        required=False,
+                        default=0,
+                        type=int,
+                        help='Number of worker processes, 0 to run jobs '
+                        'serially in the watcher process')
+    parser.add_argument('-p', '--pipeline-depth',
+                        required=False,
+                        default=0,
+                        type=int,
+                        help='Read the next images in a background thread '
+                        'while measuring the current one, holding at most '
+                        'this many images between stages. 0 to disable. '
+                        'Ignored if --workers is given')
+    parser.add_argument('--prefetch-threads',
+                        required=False,
+                        default=1,
+                        type=int,
+                        help='Threads reading and decompressing images when '
+                        'pipelined')
+    parser.add_argument('-c', '--commit-every',
+                        required=False,
+                        default=0,
+                        type=int,
+                        help='Commit the results, and remove the jobs from '
+                        'the queue, after every N jobs. 0 to commit once '
+                        'per batch')
+    parser.add_argument('-l', '--lease-time',
+                        required=False,
+                        default=0,
+                        type=float,
+                        help='Claim jobs with leases lasting this many '
+                        'seconds, so several watchers can share the queue. '
+                        '0 to process every job in the queue')
+    parser.add_argument('--owner',
+                        required=False,
+                        help='Name recorded against claimed jobs '
+                        '(default: hostname:pid)')
+    parser.add_argument('-m', '--metrics-file',
+                        required=False,
+                        help='File to refresh with timing metrics after each '
+                        'poll; JSON if the name ends in .json, otherwise '
+                        'Prometheus text format')
+    parser.add_argument('--schedule',
+                        required=False,
+                        default='newest',
+                        choices=['newest', 'camera'],
+                        help='Take the newest jobs, or the newest frame of '
+                        'each camera first')
+    parser.add_argument('--shed',
+                        required=False,
+                        default='none',
+                        choices=SHED_MODES,
+                        help='When the backlog is too large, defer the older '
+                        'frames of each camera, or subsample them and remove '
+                        'the rest from the queue. Needs --schedule camera')
+    parser.add_argument('--backlog-threshold',
+                        required=False,
+                        default=BACKLOG_THRESHOLD,
+                        type=int,
+                        help='Queued jobs above which load is shed')
+    parser.add_argument('--subsample-spacing',
+                        required=False,
+                        default=SPACING,
+                        type=float,
+                        help='Keep one older frame per camera in each '
+                        'interval of this many seconds when subsampling')
+    parser.add_argument('--window',
+                        required=False,
+                        default=WINDOW,
+                        type=int,
+                        help='Queued jobs considered by the scheduler per '
+                        'poll')
+    parser.add_argument('-a', '--adaptive',
+                        action='store_true',
+                        help='Adjust the batch size and poll interval to the '
+                        'backlog and the time taken per job')
+    parser.add_argument('--min-batch',
+                        required=False,
+                        default=MIN_BATCH,
+                        type=int,
+                        help='Smallest adaptive batch size')
+    parser.add_argument('--max-batch',
+                        required=False,
+                        default=MAX_BATCH,
+                        type=int,
+                        help='Largest adaptive batch size')
+    parser.add_argument('--min-interval',
+                        required=False,
+                        default=MIN_INTERVAL,
+                        type=float,
+                        help='Shortest adaptive poll interval (s), used '
+                        'after finding jobs')
+    parser.add_argument('--max-interval',
+                        required=False,
+                        type=float,
+                        help='Longest adaptive poll interval (s), reached '
+                        'after successive empty polls (default: {} s, or '
+                        'the --interval if longer)'.format(MAX_INTERVAL))
+    parser.add_argument('--target-latency',
+                        required=False,
+                        default=TARGET_LATENCY,
+                        type=float,
+                        help='Seconds of work to take per adaptive batch')
+    parser.add_argument('-s', '--job-source',
+                        required=False,
+                        default='poll',
+                        choices=['poll', 'socket', 'directory'],
+                        help='How to wait for new jobs between polls of the '
+                        'job queue')
+    parser.add_argument('-i', '--interval',
+                        required=False,
+                        type=float,
+                        help='Seconds between polls of the job queue, or '
+                        'between fallback polls if waiting for '
+                        'notifications (default: 2 when polling, 30 '
+                        'otherwise)')
+    parser.add_argument('--socket-path',
+                        required=False,
+                        default=SOCKET_PATH,
+                        help='Unix socket to listen on for job notifications')
+    parser.add_argument('--watch-dir',
+                        required=False,
+                        action='append',
+                        dest='watch_dirs',
+                        help='Directory to watch for new files, along with '
+                        'its most recent subdirectories (e.g. /ngts/das01), '
+                        'may be given more than once')
+    add_storage_argument(parser)
+    add_insert_arguments(parser)
+    parser.add_argument('--async-logging',
+                        action='store_true',
+                        help='Format and write log messages on a background '
+                        'thread')
+    parser.add_argument('--log-level',
+                        required=False,
+                        action='append',
+                        dest='log_levels',
+                        help='LEVEL for every subsystem, or subsystem=LEVEL '
+                        'for one module (e.g. db=INFO), may be given more '
+                        'than once (default: DEBUG)')
+    parser.add_argument('--log-sample',
+                        required=False,
+                        default=1,
+                        type=int,
+                        help='Log one in this many per-row debug messages, '
+                        '0 for none')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    level, subsystem_levels = parse_log_levels(args.log_levels)
+    configure_logging(level=level, subsystem_levels=subsystem_levels,
+                      asynchronous=args.async_logging,
+                      sample_every=args.log_sample)
+    catalogue_store.use(args.catalogue_storage)
+    insert_settings.chunk_size = args.insert_chunk_size
+    job_source = build_job_source(args.job_source, interval=args.interval,
+                                  socket_path=args.socket_path,
+                                  watch_paths=args.watch_dirs)
+    leases = (JobLeases(owner=args.owner, duration=args.lease_time)
+              if args.lease_time > 0 else None)
+    policy = build_schedule_policy(args.schedule, window=args.window,
+                                   backlog_threshold=args.backlog_threshold,
+                                   shed=args.shed,
+                                   spacing=args.subsample_spacing)
+    controller = None
+    if args.adaptive:
+        controller = AdaptiveController(
+            min_batch=args.min_batch, max_batch=args.max_batch,
+            min_interval=args.min_interval,
+            max_interval=(args.max_interval if args.max_interval is not None
+                          else max(MAX_INTERVAL, job_source.interval)),
+            target_latency=args.target_latency)
+    pool = build_worker_pool(args.workers) if args.workers > 0 else None
+    db_pool = get_pool(dict(host='ngts-par-ds', user='ops', db='ngts_ops'))
+    try:
+        watcher(db_pool, pool=pool, job_source=job_source, leases=leases,
+                pipeline_depth=args.pipeline_depth,
+                prefetch_threads=args.prefetch_threads,
+                commit_every=args.commit_every,
+                metrics_file=args.metrics_file, policy=policy,
+                controller=controller)
+    finally:
+        job_source.close()
+        db_pool.close()
+        if pool is not None:
+            pool.terminate()
@@ -0,0 +1,65 @@
+import pytest
+
+from ngts_transmission.adaptive import AdaptiveController
+from ngts_transmission.scheduling import CameraPriorityPolicy
+from ngts_transmission.watching import Job
+
+
+@pytest.fixture
+def controller():
+    return AdaptiveController(min_batch=5, max_batch=100, min_interval=1.,
+                              max_interval=8., target_latency=60.,
+                              backoff=2., smoothing=0.5)
+
+
+def test_batch_sized_to_target_latency(controller):
+    controller.update(njobs=20, elapsed=20., backlog=20)
+    assert controller.service_time == 1.
+    assert controller.batch_size == 60
+
+
+def test_service_time_smoothed(controller):
+    controller.update(njobs=10, elapsed=10., backlog=10)
+    controller.update(njobs=10, elapsed=30., backlog=10)
+    assert controller.service_time == 2.
+    assert controller.batch_size == 30
+
+
+def test_batch_size_bounded(controller):
+    controller.update(njobs=10, elapsed=0.1, backlog=10)
+    assert controller.batch_size == 100
+    controller.update(njobs=1, elapsed=1000., backlog=1)
+    assert controller.batch_size == 5
+
+
+def test_no_wait_while_backlog_remains(controller):
+    controller.update(njobs=20, elapsed=20., backlog=50)
+    assert controller.interval == 0.
+    controller.update(njobs=30, elapsed=30., backlog=30)
+    assert controller.interval == 1.
+
+
+def test_interval_backs_off_when_idle(controller):
+    intervals = []
+    for _ in range(5):
+        controller.update(njobs=0, elapsed=0.01, backlog=0)
+        intervals.append(controller.interval)
+    assert intervals == [2., 4., 8., 8., 8.]
+    assert controller.batch_size == 20
+
+
+def test_invalid_bounds():
+    with pytest.raises(ValueError):
+        AdaptiveController(min_batch=10, max_batch=5)
+
+
+def test_policy_batch_size_override():
+    jobs = [Job(i, 'IMAGE{}.fits'.format(i)) for i in range(10)]
+    schedule = CameraPriorityPolicy().schedule(jobs, backlog=10,
+                                               batch_size=3)
+    assert len(schedule.selected) == 3
+
+
+def test_no_tight_loop_when_nothing_taken(controller):
+    controller.update(njobs=0, elapsed=0.01, backlog=50)
+    assert controller.interval == 1.
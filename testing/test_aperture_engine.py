@@ -0,0 +1,98 @@
+import mock
+import numpy as np
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission.aperture import (ApertureEngine, stamp_photometry,
+                                        aperture_engines, positions_digest)
+from ngts_transmission.cache import LRUCache
+from ngts_transmission.catalogue import (TransmissionCatalogueEntry,
+                                         store_catalogue)
+from ngts_transmission.transmission import photometry_local
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(42)
+    image = rng.normal(1000., 10., (200, 220))
+    yy, xx = np.mgrid[:200, :220]
+    for x, y in rng.uniform(10, 190, (30, 2)):
+        image += 1E4 * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / 4.)
+    return image
+
+
+@pytest.fixture
+def positions():
+    rng = np.random.RandomState(1)
+    # Include stars whose annulus falls off the edge of the image
+    return rng.uniform(-2, 222, 100), rng.uniform(-2, 202, 100)
+
+
+def test_matches_photutils(data, positions):
+    x, y = positions
+    expected = photometry_local(data, x, y, 3., 4., 8.)
+    result = ApertureEngine(x, y, 3., 4., 8.)(data)
+    assert np.allclose(result, expected, rtol=1E-10, atol=1E-8,
+                       equal_nan=True)
+
+
+def test_aperture_off_image_has_no_flux(data):
+    result = ApertureEngine([300.], [100.], 3., 4., 8.)(data)
+    assert np.isnan(result[0])
+
+
+def test_engine_cached_by_key(data, positions):
+    x, y = positions
+    cache = LRUCache()
+    first = stamp_photometry(data, x, y, 3., 4., 8., key=(10101,),
+                             cache=cache)
+    second = stamp_photometry(data * 2, x, y, 3., 4., 8., key=(10101,),
+                              cache=cache)
+    assert cache.stats()['hits'] == 1
+    assert np.allclose(second, 2 * first, equal_nan=True)
+
+
+def test_different_geometry_not_shared(data, positions):
+    x, y = positions
+    cache = LRUCache()
+    stamp_photometry(data, x, y, 3., 4., 8., key=(10101,), cache=cache)
+    stamp_photometry(data, x, y, 2., 4., 8., key=(10101,), cache=cache)
+    assert len(cache) == 2
+
+
+def test_cache_bounded_by_bytes(data, positions):
+    x, y = positions
+    engine = ApertureEngine(x, y, 3., 4., 8.)
+    engine(data)
+    cache = LRUCache(maxbytes=int(2.5 * engine.nbytes))
+    for key in range(3):
+        stamp_photometry(data, x, y, 3., 4., 8., key=(key,), cache=cache)
+    assert len(cache) == 2
+    assert cache.stats()['evictions'] == 1
+    assert cache.nbytes == 2 * engine.nbytes
+
+
+def test_engine_too_large_not_cached(data, positions):
+    x, y = positions
+    cache = LRUCache(maxbytes=1024)
+    stamp_photometry(data, x, y, 3., 4., 8., key=(10101,), cache=cache)
+    assert len(cache) == 0
+
+
+def test_engines_invalidated_when_catalogue_replaced(data, positions):
+    x, y = positions
+    stamp_photometry(data, x, y, 3., 4., 8., key=(10101, 'a'))
+    stamp_photometry(data, x, y, 3., 4., 8., key=(20202, 'b'))
+    store_catalogue([TransmissionCatalogueEntry(
+        ref_image_id=10101, x_coordinate=1., y_coordinate=2.,
+        inc_prescan=1, flux_adu=1E4, aperture_radius=3.)],
+        mock.MagicMock(name='cursor', spec=Cursor))
+    keys = [key[:2] for key in aperture_engines._entries]
+    aperture_engines.invalidate()
+    assert keys == [(20202, 'b')]
+
+
+def test_replaced_positions_change_key(positions):
+    x, y = positions
+    assert positions_digest(x, y) == positions_digest(x.copy(), y.copy())
+    assert positions_digest(x, y) != positions_digest(x + 0.1, y)
@@ -0,0 +1,167 @@
+import datetime
+import mock
+import numpy as np
+import pytest
+import pymysql
+from pymysql.cursors import Cursor
+
+from ngts_transmission import backfill
+from ngts_transmission.db import ConnectionPool
+from ngts_transmission.backfill import (Checkpoint, find_frames, image_time,
+                                        reprocess)
+from ngts_transmission.transmission import Photometry, TransmissionEntry
+
+
+class SynchronousResult(object):
+
+    def __init__(self, fn, args):
+        self.fn, self.args = fn, args
+
+    def get(self):
+        return self.fn(*self.args)
+
+
+class SynchronousPool(object):
+
+    def apply_async(self, fn, args):
+        return SynchronousResult(fn, args)
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.cursor = mock.MagicMock(name='cursor', spec=Cursor)
+        self.commits = 0
+
+    def __enter__(self):
+        return self.cursor
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.commits += 1
+
+
+def entry(image_id):
+    return TransmissionEntry(
+        image_id=image_id, image_mean_flux=1E4, mean_flux_ratio=1.,
+        median_flux_ratio=1., flux_ratio_err=0.01, flux_ratio_lq=0.9,
+        flux_ratio_uq=1.1, flux_ratio_stdev=0.1, flag=0)
+
+
+@pytest.fixture
+def frames(tmpdir):
+    names = ['IMAGE80120150920233952.fits', 'IMAGE80120150920234004.fits.bz2',
+             'IMAGE80120150921120000.fits', 'IMAGE80120150921120000.fits.bz2']
+    for name in names:
+        tmpdir.join(name).write('')
+    return tmpdir
+
+
+@pytest.fixture
+def patched():
+    headers = {
+        'IMAGE0.fits': (0, 10101),
+        'IMAGE1.fits': (1, None),
+        'IMAGE2.fits': (2, 10101),
+    }
+
+    def transmission_task(filename, image_id, *args):
+        if filename == 'IMAGE2.fits':
+            raise IOError('Corrupt file')
+        return entry(image_id)
+
+    catalogue = Photometry(*[np.ones(2)] * 4, ref_image_id=10101)
+    with mock.patch.object(backfill, 'header_task',
+                           side_effect=headers.get), \
+            mock.patch.object(backfill, 'build_missing_catalogues',
+                              return_value=set()), \
+            mock.patch.object(backfill, 'query_for_ref_image_ids',
+                              return_value={0: 10101, 2: 10101}), \
+            mock.patch.object(backfill.Photometry, 'from_database',
+                              return_value=catalogue), \
+            mock.patch.object(backfill, 'transmission_task',
+                              side_effect=transmission_task) as task, \
+            mock.patch.object(backfill, 'upload_entries') as upload_entries:
+        yield mock.Mock(transmission_task=task,
+                        upload_entries=upload_entries)
+
+
+def test_image_time():
+    assert image_time('/ngts/das03/action106267_observeField/'
+                      'IMAGE80520150920234004.fits.bz2') == \
+        datetime.datetime(2015, 9, 20, 23, 40, 4)
+    assert image_time('REF.fits') is None
+
+
+def test_compressed_copies_found_once(frames):
+    found = find_frames(patterns=[str(frames.join('IMAGE*'))])
+    assert [f.split('/')[-1] for f in found] == [
+        'IMAGE80120150920233952.fits', 'IMAGE80120150920234004.fits.bz2',
+        'IMAGE80120150921120000.fits']
+
+
+def test_frames_filtered_by_time(frames):
+    found = find_frames(patterns=[str(frames.join('IMAGE*'))],
+                        start=datetime.datetime(2015, 9, 20, 23, 40),
+                        end=datetime.datetime(2015, 9, 21, 12))
+    assert [f.split('/')[-1] for f in found] == [
+        'IMAGE80120150920234004.fits.bz2']
+
+
+def test_frames_from_file_list(tmpdir):
+    file_list = tmpdir.join('frames.txt')
+    file_list.write('# night 20150920\nb.fits\n\na.fits\n')
+    assert find_frames(file_lists=[str(file_list)]) == ['a.fits', 'b.fits']
+
+
+def test_checkpoint_round_trip(tmpdir):
+    path = str(tmpdir.join('checkpoint'))
+    Checkpoint(path).add(['a.fits.bz2', 'b.fits'])
+    checkpoint = Checkpoint(path)
+    assert 'a.fits' in checkpoint
+    assert 'b.fits.bz2' in checkpoint
+    assert 'c.fits' not in checkpoint
+
+
+def test_results_upserted_per_chunk(patched):
+    connection = FakeConnection()
+    filenames = ['IMAGE0.fits', 'IMAGE1.fits', 'IMAGE2.fits']
+    assert reprocess(ConnectionPool(lambda: connection), filenames,
+                     SynchronousPool(),
+                     chunk_size=2) == 2
+    assert connection.commits == 2
+
+    uploads = patched.upload_entries.call_args_list
+    assert [[e.image_id for e in call[0][0]] for call in uploads] == [[0], []]
+    assert all(call[1]['upsert'] for call in uploads)
+
+
+def test_failed_frames_retried_on_resume(patched, tmpdir):
+    path = str(tmpdir.join('checkpoint'))
+    filenames = ['IMAGE0.fits', 'IMAGE1.fits', 'IMAGE2.fits']
+    reprocess(ConnectionPool(FakeConnection), filenames, SynchronousPool(),
+              checkpoint=Checkpoint(path))
+    assert tmpdir.join('checkpoint').read().split() == ['IMAGE1.fits',
+                                                        'IMAGE0.fits']
+
+    patched.transmission_task.reset_mock()
+    reprocess(ConnectionPool(FakeConnection), filenames, SynchronousPool(),
+              checkpoint=Checkpoint(path))
+    assert [call[0][0] for call in
+            patched.transmission_task.call_args_list] == ['IMAGE2.fits']
+
+
+def test_chunk_retried_after_lost_connection(patched):
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    filenames = ['IMAGE0.fits', 'IMAGE1.fits']
+    patched.upload_entries.side_effect = [
+        pymysql.err.OperationalError(2013, 'Lost connection'), None]
+    assert reprocess(ConnectionPool(connect, retry_wait=0), filenames,
+                     SynchronousPool()) == 2
+    assert patched.upload_entries.call_count == 2
+    assert len(connections) == 2
@@ -0,0 +1,90 @@
+from collections import namedtuple
+import mock
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission import watching
+from ngts_transmission.buildlock import (CatalogueBuildLock,
+                                         CatalogueBuildInProgress)
+from ngts_transmission.catalogue import store_catalogue
+from ngts_transmission.watching import claim_catalogue_build, commit_in_groups
+
+
+class FakeConnection(object):
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self.cursor
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.fixture
+def cursor():
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+    cursor.fetchone.return_value = (1,)
+    return cursor
+
+
+def queries(cursor):
+    return [call[0][0] for call in cursor.execute.call_args_list]
+
+
+def test_lock_held_until_released(cursor):
+    lock = CatalogueBuildLock()
+    lock.acquire(cursor)
+    lock.acquire(cursor)
+    assert queries(cursor) == ['select get_lock(%s, %s)']
+    assert lock.held
+
+    lock.release(FakeConnection(cursor))
+    assert queries(cursor)[-1] == 'select release_lock(%s)'
+    assert not lock.held
+
+
+def test_lock_timeout_defers(cursor):
+    lock = CatalogueBuildLock()
+    cursor.fetchone.return_value = (0,)
+    with pytest.raises(CatalogueBuildInProgress):
+        lock.acquire(cursor)
+    assert not lock.held
+
+    # The thread lock was given back, so the next attempt is not blocked
+    cursor.fetchone.return_value = (1,)
+    lock.acquire(cursor)
+    assert lock.held
+
+
+def test_catalogue_rechecked_after_lock(cursor):
+    lock = CatalogueBuildLock()
+    exists = mock.Mock(side_effect=[False, True])
+    with mock.patch.object(watching, 'build_lock', lock), \
+            mock.patch.object(watching, 'ref_catalogue_exists', exists):
+        assert not claim_catalogue_build(cursor, 10101)
+    assert lock.held
+    assert exists.call_args[1]['locking']
+
+
+def test_lock_released_after_commit(cursor):
+    lock = CatalogueBuildLock()
+
+    def process(cursor, jobs):
+        lock.acquire(cursor)
+        raise RuntimeError('Lost connection')
+
+    with mock.patch.object(watching, 'build_lock', lock):
+        with pytest.raises(RuntimeError):
+            commit_in_groups(FakeConnection(cursor), [1], process)
+    assert not lock.held
+
+
+def test_stored_catalogue_replaces_existing(cursor):
+    Row = namedtuple('Row', ['ref_image_id', 'flux_adu'])
+    rows = [Row(10101, 1E4), Row(10101, 2E4)]
+    store_catalogue(rows, cursor)
+    assert queries(cursor)[0] == \
+        'delete from transmission_sources where ref_image_id = %s'
+    assert queries(cursor)[1].startswith('insert into transmission_sources')
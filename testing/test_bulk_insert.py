@@ -0,0 +1,61 @@
+import mock
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission.db import bulk_insert, insert_settings
+from ngts_transmission.watching import Job, upload_results
+from ngts_transmission.transmission import TransmissionEntry
+
+
+@pytest.fixture
+def cursor():
+    return mock.MagicMock(name='cursor', spec=Cursor)
+
+
+@pytest.fixture
+def chunk_size():
+    yield insert_settings
+    insert_settings.chunk_size = 1000
+
+
+def test_rows_are_chunked(cursor):
+    rows = [(i, i * 2) for i in range(5)]
+    assert bulk_insert(cursor, 'test', ['a', 'b'], rows, chunk_size=2) == 5
+
+    queries = [call[0][0] for call in cursor.execute.call_args_list]
+    assert queries == [
+        'insert into test (a, b) values (%s, %s), (%s, %s)',
+        'insert into test (a, b) values (%s, %s), (%s, %s)',
+        'insert into test (a, b) values (%s, %s)',
+    ]
+    args = [call[0][1] for call in cursor.execute.call_args_list]
+    assert args == [[0, 0, 1, 2], [2, 4, 3, 6], [4, 8]]
+
+
+def test_no_rows(cursor):
+    assert bulk_insert(cursor, 'test', ['a'], []) == 0
+    assert not cursor.execute.called
+
+
+def test_upsert_replaces_existing_rows(cursor):
+    bulk_insert(cursor, 'test', ['a', 'b'], [(1, 2)], upsert=True)
+    query = cursor.execute.call_args[0][0]
+    assert query == ('insert into test (a, b) values (%s, %s) '
+                     'on duplicate key update a = values(a), b = values(b)')
+
+
+def test_configured_chunk_size(cursor, chunk_size):
+    chunk_size.chunk_size = 2
+    assert bulk_insert(cursor, 'test', ['a'], [(i,) for i in range(5)]) == 5
+    assert cursor.execute.call_count == 3
+
+
+def test_results_uploaded_in_chunks(cursor, chunk_size):
+    chunk_size.chunk_size = 2
+    entry = TransmissionEntry(**{key: 1 for key in TransmissionEntry._fields})
+    completed = [(Job(i, 'IMAGE{}.fits'.format(i)),
+                  entry._replace(image_id=i)) for i in range(3)]
+    upload_results(cursor, completed)
+    inserts = [call[0][0] for call in cursor.execute.call_args_list
+               if 'insert into transmission_log' in call[0][0]]
+    assert len(inserts) == 2
@@ -0,0 +1,114 @@
+import mock
+import numpy as np
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission.catalogue import (TransmissionCatalogueEntry,
+                                         store_catalogue)
+from ngts_transmission.storage import (catalogue_store, pack_catalogue,
+                                       unpack_catalogue, migrate_catalogue)
+from ngts_transmission.transmission import Photometry
+from ngts_transmission.watching import ref_catalogue_exists
+
+
+@pytest.fixture
+def arrays():
+    return [np.array([1., 2., 3.]), np.array([4., 5., 6.]),
+            np.array([3., 3., 3.]), np.array([1E4, 2E4, 3E4])]
+
+
+@pytest.fixture
+def cursor():
+    return mock.MagicMock(name='cursor', spec=Cursor)
+
+
+@pytest.fixture
+def blob_storage():
+    catalogue_store.use('blob')
+    yield catalogue_store
+    catalogue_store.use('rows')
+
+
+def test_round_trip(arrays):
+    unpacked = unpack_catalogue(pack_catalogue(arrays))
+    assert len(unpacked) == 4
+    for expected, found in zip(arrays, unpacked):
+        assert np.array_equal(expected, found)
+
+
+def test_unpacked_without_copying(arrays):
+    blob = pack_catalogue(arrays)
+    unpacked = unpack_catalogue(blob)
+    assert all(not array.flags.owndata for array in unpacked)
+    assert all(not array.flags.writeable for array in unpacked)
+    assert unpacked[0].flags.c_contiguous
+
+
+def test_record_size(arrays):
+    assert len(pack_catalogue(arrays)) == 16 + 4 * 3 * 8
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda blob: blob[:10],
+    lambda blob: blob[:-8],
+    lambda blob: b'XXXX' + blob[4:],
+])
+def test_corrupt_records_rejected(arrays, corrupt):
+    with pytest.raises(ValueError):
+        unpack_catalogue(corrupt(pack_catalogue(arrays)))
+
+
+def test_catalogue_stored_as_one_record(blob_storage, cursor):
+    rows = [TransmissionCatalogueEntry(
+        ref_image_id=10101, x_coordinate=float(i), y_coordinate=2. * i,
+        inc_prescan=1, flux_adu=1E4, aperture_radius=3.) for i in range(5)]
+    store_catalogue(rows, cursor)
+
+    delete, insert = [call[0] for call in cursor.execute.call_args_list]
+    assert delete[1] == (10101,)
+    assert 'insert into transmission_catalogues' in insert[0]
+    ref_image_id, nsources, inc_prescan, blob = insert[1]
+    assert (ref_image_id, nsources, inc_prescan) == (10101, 5, 1)
+    x, y, radius, flux = unpack_catalogue(blob)
+    assert list(x) == [0., 1., 2., 3., 4.]
+    assert list(y) == [0., 2., 4., 6., 8.]
+
+
+def test_photometry_loaded_from_record(blob_storage, cursor, arrays):
+    cursor.fetchone.return_value = (pack_catalogue(arrays),)
+    catalogue = Photometry.from_database(cursor, 10101)
+    assert 'transmission_catalogues' in cursor.execute.call_args[0][0]
+    assert np.array_equal(catalogue.x, arrays[0])
+    assert np.array_equal(catalogue.flux, arrays[3])
+
+
+def test_missing_record_loads_empty(blob_storage, cursor):
+    cursor.fetchone.return_value = None
+    assert catalogue_store.load(cursor, 10101) == []
+
+
+def test_existence_checked_in_storage_table(blob_storage, cursor):
+    cursor.__iter__.return_value = [(1,)]
+    assert ref_catalogue_exists(cursor, 10101)
+    assert 'from transmission_catalogues' in cursor.execute.call_args[0][0]
+
+
+def test_rows_migrated_and_verified(cursor, arrays):
+    cursor.fetchall.return_value = [row + (0,) for row in zip(*arrays)]
+
+    def fetchone():
+        inserted = [call[0][1] for call in cursor.execute.call_args_list
+                    if 'insert' in call[0][0]]
+        return (inserted[-1][3],)
+
+    cursor.fetchone.side_effect = fetchone
+    assert migrate_catalogue(cursor, 10101) == 3
+    insert = [call[0] for call in cursor.execute.call_args_list
+              if 'insert' in call[0][0]][-1]
+    assert insert[1][:3] == (10101, 3, 0)
+
+
+def test_migrating_missing_catalogue_fails(cursor):
+    cursor.fetchall.return_value = []
+    with pytest.raises(ValueError):
+        migrate_catalogue(cursor, 10101)
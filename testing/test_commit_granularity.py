@@ -0,0 +1,114 @@
+import mock
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission import watching
+from ngts_transmission.leases import JobLeases, LeaseLost
+from ngts_transmission.watching import Job, commit_in_groups
+
+
+class FakeConnection(object):
+    '''
+    Records the outcome of each transaction, as `with connection` does
+    '''
+
+    def __init__(self):
+        self.outcomes = []
+
+    def __enter__(self):
+        return mock.MagicMock(name='cursor', spec=Cursor)
+
+    def __exit__(self, exc_type, *args):
+        self.outcomes.append('rollback' if exc_type else 'commit')
+
+
+@pytest.fixture
+def jobs():
+    return [Job(job_id=i, filename='IMAGE{}.fits'.format(i)) for i in range(5)]
+
+
+def processed_groups(process):
+    return [[job.job_id for job in call[0][1]]
+            for call in process.call_args_list]
+
+
+def test_commit_per_batch(jobs):
+    connection, process = FakeConnection(), mock.Mock()
+    assert commit_in_groups(connection, jobs, process) == 1
+    assert processed_groups(process) == [[0, 1, 2, 3, 4]]
+    assert connection.outcomes == ['commit']
+
+
+def test_commit_every_n_jobs(jobs):
+    connection, process = FakeConnection(), mock.Mock()
+    timings = []
+    assert commit_in_groups(connection, jobs, process, commit_every=2,
+                            timings=timings) == 3
+    assert processed_groups(process) == [[0, 1], [2, 3], [4]]
+    assert connection.outcomes == ['commit'] * 3
+    assert len(timings) == 3
+
+
+def test_failed_group_keeps_earlier_commits(jobs):
+    connection = FakeConnection()
+    process = mock.Mock(side_effect=[None, RuntimeError('lost connection')])
+    watching.known_ref_ids.add(10101)
+
+    with pytest.raises(RuntimeError):
+        commit_in_groups(connection, jobs, process, commit_every=2)
+
+    assert connection.outcomes == ['commit', 'rollback']
+    assert processed_groups(process) == [[0, 1], [2, 3]]
+    assert not watching.known_ref_ids
+
+
+def test_no_jobs_no_transaction():
+    connection, process = FakeConnection(), mock.Mock()
+    assert commit_in_groups(connection, [], process, commit_every=2) == 0
+    assert not process.called
+
+
+def test_jobs_with_lost_leases_skipped(jobs):
+    connection, process = FakeConnection(), mock.Mock()
+    leases = mock.Mock(spec=JobLeases)
+    leases.renew.side_effect = [set([0]), set()]
+
+    assert commit_in_groups(connection, jobs[:4], process, commit_every=2,
+                            leases=leases) == 1
+
+    assert processed_groups(process) == [[0]]
+    # The renewals are committed on their own, before each group
+    assert connection.outcomes == ['commit', 'commit', 'commit']
+    leases.release.assert_called_once()
+
+
+def test_group_rolled_back_when_lease_lost(jobs):
+    connection, process = FakeConnection(), mock.Mock()
+    leases = mock.Mock(spec=JobLeases)
+    leases.renew.side_effect = lambda cursor, job_ids: set(job_ids)
+    leases.confirm.side_effect = [LeaseLost(set([1])), None]
+
+    assert commit_in_groups(connection, jobs[:4], process, commit_every=2,
+                            leases=leases) == 1
+
+    assert processed_groups(process) == [[0, 1], [2, 3]]
+    assert connection.outcomes == ['commit', 'rollback', 'commit', 'commit']
+    leases.release.assert_called_once()
+
+
+def test_pipelined_watcher_commits_every_n_jobs(jobs):
+    connection = FakeConnection()
+    with mock.patch.object(watching, 'count_pending_jobs', return_value=5), \
+            mock.patch.object(watching, 'fetch_transmission_jobs',
+                              return_value=jobs), \
+            mock.patch.object(watching, 'process_jobs_pipelined',
+                              autospec=True) as process:
+        assert watching.watcher_loop_step(
+            connection, pipeline_depth=2, prefetch_threads=2,
+            commit_every=2) == (5, 5)
+
+    assert processed_groups(process) == [[0, 1], [2, 3], [4]]
+    for call in process.call_args_list:
+        assert call[1] == {'depth': 2, 'prefetch_threads': 2}
+    # The fetch, then one transaction per group
+    assert connection.outcomes == ['commit'] * 4
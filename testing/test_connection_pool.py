@@ -0,0 +1,175 @@
+import threading
+import pytest
+import pymysql
+
+from ngts_transmission.db import (ConnectionPool, PoolExhausted,
+                                  is_connection_error)
+
+
+def gone_away():
+    return pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.pings = 0
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+        if not self.alive:
+            raise gone_away()
+
+    def close(self):
+        self.closed = True
+
+
+class Connector(object):
+
+    def __init__(self):
+        self.made = []
+
+    def __call__(self):
+        self.made.append(FakeConnection())
+        return self.made[-1]
+
+
+@pytest.fixture
+def connector():
+    return Connector()
+
+
+def test_connections_reused(connector):
+    pool = ConnectionPool(connector)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(connector.made) == 1
+
+
+def test_pool_bounded(connector):
+    pool = ConnectionPool(connector, max_size=2)
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolExhausted):
+        pool.acquire(timeout=0.01)
+
+    def give_back():
+        pool.release(held[0])
+
+    threading.Timer(0.05, give_back).start()
+    assert pool.acquire(timeout=5) is held[0]
+    assert len(connector.made) == 2
+
+
+def test_idle_connection_checked(connector):
+    pool = ConnectionPool(connector, check_interval=0)
+    with pool.connection() as connection:
+        pass
+    connection.alive = False
+    with pool.connection() as replacement:
+        pass
+    assert connection.pings == 1 and connection.closed
+    assert replacement is not connection
+
+
+def test_recently_used_connection_not_checked(connector):
+    pool = ConnectionPool(connector, check_interval=60)
+    with pool.connection() as connection:
+        pass
+    with pool.connection():
+        pass
+    assert connection.pings == 0
+
+
+def test_lost_connection_discarded(connector):
+    pool = ConnectionPool(connector)
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as lost:
+            raise gone_away()
+    assert lost.closed
+    with pool.connection() as connection:
+        assert connection is not lost
+
+
+def test_query_error_keeps_connection(connector):
+    pool = ConnectionPool(connector)
+    with pytest.raises(pymysql.err.ProgrammingError):
+        with pool.connection() as connection:
+            raise pymysql.err.ProgrammingError(1064, 'Syntax error')
+    assert not connection.closed
+    assert pool.stats()[0]['errors'] == 1
+
+
+def test_idempotent_calls_retried(connector):
+    pool = ConnectionPool(connector, retries=2, retry_wait=0)
+    calls = []
+
+    def fn(connection):
+        calls.append(connection)
+        if len(calls) < 3:
+            raise gone_away()
+        return 'done'
+
+    assert pool.call(fn, idempotent=True) == 'done'
+    assert len(set(map(id, calls))) == 3
+
+
+def test_other_calls_not_retried(connector):
+    pool = ConnectionPool(connector, retries=2, retry_wait=0)
+    calls = []
+
+    def fn(connection):
+        calls.append(connection)
+        raise gone_away()
+
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.call(fn)
+    assert len(calls) == 1
+
+
+def test_failed_connect_frees_slot():
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise pymysql.err.OperationalError(2003, 'Cannot connect')
+        return FakeConnection()
+
+    pool = ConnectionPool(connect, max_size=1)
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.acquire()
+    assert pool.acquire(timeout=0) is not None
+
+
+def test_usage_stats(connector):
+    pool = ConnectionPool(connector)
+    for _ in range(3):
+        with pool.connection():
+            pass
+    stats, = pool.stats()
+    assert stats['connection'] == 1
+    assert stats['checkouts'] == 3
+    assert stats['seconds_in_use'] >= 0
+
+
+def test_forked_process_starts_empty(connector):
+    pool = ConnectionPool(connector)
+    with pool.connection() as parent:
+        pass
+    pool.pid = -1
+    with pool.connection() as child:
+        pass
+    assert child is not parent
+    assert not parent.closed
+
+
+def test_connection_errors():
+    assert is_connection_error(gone_away())
+    assert is_connection_error(pymysql.err.InterfaceError(0, ''))
+    assert not is_connection_error(pymysql.err.OperationalError(1205, 'Lock'))
+    assert not is_connection_error(ValueError())
@@ -0,0 +1,40 @@
+import numpy as np
+from astropy.io import fits
+import pytest
+
+from ngts_transmission.transmission import Photometry, cutout_bounds
+
+
+@pytest.fixture
+def catalogue():
+    rng = np.random.RandomState(42)
+    n = 50
+    return Photometry(rng.uniform(300, 700, n), rng.uniform(200, 600, n),
+                      np.ones(n) * 3., np.ones(n))
+
+
+@pytest.fixture
+def filename(tmpdir, catalogue):
+    fname = str(tmpdir.join('frame.fits'))
+    rng = np.random.RandomState(1)
+    data = rng.normal(1000., 10., (1024, 1040))
+    yy, xx = np.mgrid[:1024, :1040]
+    for x, y in zip(catalogue.x, catalogue.y):
+        data += 5E3 * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / 4.)
+    fits.PrimaryHDU(data).writeto(fname)
+    return fname
+
+
+def test_cutout_bounds_clipped():
+    assert cutout_bounds(np.array([5., 50.]), np.array([10., 90.]), 8.,
+                         (100, 60)) == (1, 100, 0, 60)
+    assert cutout_bounds(np.array([30.]), np.array([40.]), 3.,
+                         (100, 60)) == (36, 45, 26, 35)
+
+
+def test_cutout_matches_full_frame(filename, catalogue):
+    full = Photometry.extract_from_file(filename, catalogue, 4., 8.,
+                                        cutout=False)
+    cutout = Photometry.extract_from_file(filename, catalogue, 4., 8.,
+                                          cutout=True)
+    assert np.allclose(full.flux, cutout.flux, rtol=1E-12)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from ngts_transmission.catalogue import (isolated_index, filter_source_table,
+                                         EdgeFilter, FluxFilter,
+                                         IsolationFilter)
+
+
+@pytest.fixture
+def source_table():
+    rng = np.random.RandomState(42)
+    nsources = 2000
+    table = np.zeros(nsources, dtype=[('X_coordinate', np.float64),
+                                      ('Y_coordinate', np.float64),
+                                      ('Aper_flux_3', np.float64)])
+    table['X_coordinate'] = rng.uniform(0, 2048, nsources)
+    table['Y_coordinate'] = rng.uniform(0, 2048, nsources)
+    table['Aper_flux_3'] = rng.uniform(0, 1E5, nsources)
+    return table
+
+
+def brute_force_isolated(x, y, radius):
+    index = np.zeros_like(x, dtype=bool)
+    for i in np.arange(x.size):
+        distance = np.hypot(x - x[i], y - y[i])
+        index[i] = (distance <= radius).sum() == 1
+    return index
+
+
+def test_isolated_index_matches_brute_force(source_table):
+    x, y = source_table['X_coordinate'], source_table['Y_coordinate']
+    expected = brute_force_isolated(x, y, radius=30.)
+    assert not expected.all()
+    assert np.all(isolated_index(x, y, radius=30.) == expected)
+
+
+def test_isolated_index_subset_uses_all_neighbours():
+    x = np.array([100., 103., 500.])
+    y = np.array([100., 100., 500.])
+    subset = np.array([True, False, True])
+    index = isolated_index(x, y, radius=6., subset=subset)
+    assert list(index) == [False, False, True]
+
+
+def test_isolated_index_empty():
+    assert isolated_index(np.array([]), np.array([])).size == 0
+
+
+def test_default_filters(source_table):
+    result = filter_source_table(source_table, radius=6.)
+    assert len(result) > 0
+    assert np.all(result['X_coordinate'] > 532)
+    assert np.all(result['X_coordinate'] < 1536)
+    assert np.all(result['Y_coordinate'] > 512)
+    assert np.all(result['Y_coordinate'] < 1536)
+    assert np.all(result['Aper_flux_3'] >= 2E3)
+    assert np.all(result['Aper_flux_3'] <= 90E3)
+
+
+def test_configurable_filters(source_table):
+    filters = [EdgeFilter(edge_margin=0), FluxFilter(flux_lim_low=0.,
+                                                     flux_lim_high=np.inf),
+               IsolationFilter(radius=0.)]
+    result = filter_source_table(source_table, filters=filters)
+    assert len(result) == len(source_table[source_table['X_coordinate'] > 20])
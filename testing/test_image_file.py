@@ -0,0 +1,136 @@
+import bz2
+import os
+import mock
+import numpy as np
+from astropy.io import fits
+import pytest
+
+from ngts_transmission.cache import LRUCache
+from ngts_transmission.image import ImageFile, image_context, read_header
+
+
+@pytest.fixture
+def filename(tmpdir):
+    fname = str(tmpdir.join('test.fits'))
+    phdu = fits.PrimaryHDU(np.arange(20, dtype=np.int16).reshape(4, 5))
+    phdu.header['IMAGE_ID'] = 10101
+    phdu.writeto(fname)
+    return fname
+
+
+@pytest.fixture
+def compressed_filename(filename):
+    fname = filename + '.bz2'
+    with open(filename, 'rb') as infile:
+        with bz2.BZ2File(fname, 'wb') as outfile:
+            outfile.write(infile.read())
+    return fname
+
+
+def test_read_uncompressed(filename):
+    with ImageFile(filename) as image:
+        assert image.header['IMAGE_ID'] == 10101
+        assert image.data.sum() == 190
+        assert image.bytes_decompressed == 0
+
+
+def test_compressed_data_decompressed_once(compressed_filename):
+    with mock.patch('ngts_transmission.image.bz2', wraps=bz2) as bz2_module:
+        with ImageFile(compressed_filename) as image:
+            assert image.data.sum() == 190
+            assert image.data.sum() == 190
+            assert image.header['IMAGE_ID'] == 10101
+
+    assert bz2_module.BZ2File.call_count == 1
+    assert image.bytes_decompressed == 2 * 2880
+
+
+def test_compressed_header_only(compressed_filename):
+    with ImageFile(compressed_filename) as image:
+        assert image.header['IMAGE_ID'] == 10101
+        assert image._hdulist is None
+    assert image.bytes_decompressed == 2880
+
+
+def test_header_cached_by_path_and_mtime(compressed_filename):
+    cache = LRUCache()
+    with mock.patch('ngts_transmission.image.bz2', wraps=bz2) as bz2_module:
+        for _ in range(2):
+            header = read_header(compressed_filename, cache=cache)
+            assert header['IMAGE_ID'] == 10101
+    assert bz2_module.BZ2File.call_count == 1
+
+    stat = os.stat(compressed_filename)
+    os.utime(compressed_filename, (stat.st_atime, stat.st_mtime + 10))
+    read_header(compressed_filename, cache=cache)
+    assert cache.stats()['misses'] == 2
+
+
+def test_header_spanning_blocks(tmpdir):
+    fname = str(tmpdir.join('long.fits'))
+    phdu = fits.PrimaryHDU(np.zeros((4, 5)))
+    for i in range(100):
+        phdu.header['KEY{}'.format(i)] = i
+    phdu.header['AGREFIMG'] = 20202
+    phdu.writeto(fname)
+    assert read_header(fname, cache=None)['AGREFIMG'] == 20202
+
+
+def test_truncated_header(tmpdir):
+    fname = str(tmpdir.join('truncated.fits'))
+    with open(fname, 'wb') as outfile:
+        outfile.write(b'SIMPLE  =                    T' + b' ' * 50)
+    with pytest.raises(IOError):
+        read_header(fname, cache=None)
+
+
+def test_shape_from_header(filename):
+    with ImageFile(filename) as image:
+        assert image.shape == (4, 5)
+        assert image._data is None
+
+
+def test_image_context_reuses_open_image(filename):
+    with ImageFile(filename) as image:
+        with image_context('other.fits', image) as context_image:
+            assert context_image is image
+
+
+@pytest.fixture
+def scaled_filename(tmpdir):
+    fname = str(tmpdir.join('scaled.fits'))
+    data = np.arange(100 * 30, dtype=np.uint16).reshape(100, 30) + 30000
+    fits.PrimaryHDU(data).writeto(fname)
+    return fname
+
+
+def compress(filename):
+    fname = filename + '.bz2'
+    with open(filename, 'rb') as infile:
+        with bz2.BZ2File(fname, 'wb') as outfile:
+            outfile.write(infile.read())
+    return fname
+
+
+def test_section_uncompressed(scaled_filename):
+    expected = fits.getdata(scaled_filename)[10:20, 5:15]
+    with ImageFile(scaled_filename) as image:
+        assert np.all(image.section(10, 20, 5, 15) == expected)
+
+
+def test_section_compressed_stops_early(scaled_filename):
+    expected = fits.getdata(scaled_filename)[10:20, 5:15]
+    with ImageFile(compress(scaled_filename)) as image:
+        section = image.section(10, 20, 5, 15)
+        assert np.all(section == expected)
+        assert image.bytes_decompressed == 2880 + 20 * 30 * 2
+        assert image._hdulist is None
+
+
+def test_section_kept_until_closed(scaled_filename):
+    image = ImageFile(compress(scaled_filename))
+    first = image.section(10, 20, 5, 15)
+    assert image.section(10, 20, 5, 15) is first
+    assert image.bytes_decompressed == 2880 + 20 * 30 * 2
+    image.close()
+    assert image.section(10, 20, 5, 15) is not first
@@ -0,0 +1,97 @@
+import mock
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission.leases import JobLeases, LeaseLost
+from ngts_transmission.scheduling import BATCH_SIZE
+from ngts_transmission.watching import (fetch_transmission_jobs, JOB_QUERY,
+                                        count_pending_jobs,
+                                        LEASED_JOB_QUERY, Job)
+
+
+@pytest.fixture
+def cursor():
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+    cursor.rowcount = 0
+    return cursor
+
+
+@pytest.fixture
+def leases():
+    return JobLeases(owner='aux01:123', duration=60)
+
+
+def test_claim_nothing(cursor, leases):
+    assert leases.claim(cursor, []) == set()
+    assert not cursor.execute.called
+
+
+def test_claim_queries(cursor, leases):
+    cursor.fetchall.return_value = [(1,), (3,)]
+    assert leases.claim(cursor, [3, 1, 2]) == set([1, 3])
+
+    (reclaim, reclaim_args), (claim, claim_args), (owned, owned_args) = [
+        call[0] for call in cursor.execute.call_args_list]
+    assert 'expires <= now()' in reclaim
+    assert reclaim_args == ['aux01:123', 60, 1, 2, 3]
+    assert 'on duplicate key update' in claim
+    assert claim_args == [1, 'aux01:123', 60, 2, 'aux01:123', 60,
+                          3, 'aux01:123', 60]
+    assert owned_args == [1, 2, 3, 'aux01:123']
+
+
+def test_release_only_own_leases(cursor, leases):
+    leases.release(cursor)
+    query, args = cursor.execute.call_args[0]
+    assert args == ('aux01:123',)
+    assert 'job_queue.job_id is null' in query
+
+
+def test_renew_only_own_leases(cursor, leases):
+    cursor.fetchall.return_value = [(1,)]
+    assert leases.renew(cursor, [2, 1]) == set([1])
+    (renew, renew_args), (_, owned_args) = [
+        call[0] for call in cursor.execute.call_args_list]
+    assert 'owner = %s' in renew and 'expires <=' not in renew
+    assert renew_args == [60, 1, 2, 'aux01:123']
+    assert owned_args == [1, 2, 'aux01:123']
+
+
+def test_confirm_raises_when_lease_lost(cursor, leases):
+    cursor.fetchall.return_value = [(1,)]
+    with pytest.raises(LeaseLost) as excinfo:
+        leases.confirm(cursor, [1, 2])
+    assert excinfo.value.job_ids == set([2])
+
+
+def test_default_owner_is_unique_per_process():
+    with mock.patch('ngts_transmission.leases.os.getpid', return_value=42):
+        assert JobLeases().owner.endswith(':42')
+
+
+def test_fetch_without_leases(cursor):
+    cursor.fetchall.return_value = [(1, 'file=a.fits')]
+    assert fetch_transmission_jobs(cursor) == [Job(1, 'a.fits')]
+    cursor.execute.assert_called_once_with(JOB_QUERY, (BATCH_SIZE,))
+
+
+def test_fetch_returns_only_claimed_jobs(cursor):
+    cursor.fetchall.return_value = [(1, 'file=a.fits'), (2, 'file=b.fits')]
+    leases = mock.Mock(spec=JobLeases)
+    leases.claim.return_value = set([2])
+
+    jobs = fetch_transmission_jobs(cursor, leases=leases)
+
+    cursor.execute.assert_called_once_with(LEASED_JOB_QUERY,
+                                           (BATCH_SIZE,))
+    leases.claim.assert_called_once_with(cursor, [1, 2])
+    assert [job.job_id for job in jobs] == [2]
+
+
+def test_backlog_excludes_leased_jobs(cursor, leases):
+    cursor.fetchone.return_value = (4,)
+    assert count_pending_jobs(cursor, leases=leases) == 4
+    query = cursor.execute.call_args[0][0]
+    assert 'transmission_job_lease' in query
+    count_pending_jobs(cursor)
+    assert 'transmission_job_lease' not in cursor.execute.call_args[0][0]
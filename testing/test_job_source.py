@@ -0,0 +1,93 @@
+import time
+
+import mock
+import pytest
+
+from ngts_transmission import watching
+from ngts_transmission.jobsource import (PollingSource, SocketSource,
+                                         DirectorySource, notify,
+                                         build_job_source)
+
+
+def test_polling_source_sleeps():
+    with mock.patch('ngts_transmission.jobsource.time.sleep') as sleep:
+        assert PollingSource(interval=5).wait() is False
+    sleep.assert_called_once_with(5)
+
+
+def test_socket_source_wakes_on_notification(tmpdir):
+    path = str(tmpdir.join('watcher.sock'))
+    with SocketSource(path, interval=10) as source:
+        assert notify(path)
+        assert notify(path)
+
+        start = time.time()
+        assert source.wait() is True
+        assert time.time() - start < 1
+
+        # Both notifications are consumed by a single wakeup
+        source.interval = 0.01
+        assert source.wait() is False
+
+
+def test_notify_without_listener(tmpdir):
+    assert notify(str(tmpdir.join('missing.sock'))) is False
+
+
+def test_directory_source_wakes_on_new_file(tmpdir):
+    incoming = tmpdir.mkdir('incoming')
+    source = DirectorySource([str(incoming)], interval=10, scan_interval=0.01)
+    # Guard against coarse filesystem timestamps
+    time.sleep(0.01)
+    incoming.join('IMAGE001.fits').write('')
+
+    start = time.time()
+    assert source.wait() is True
+    assert time.time() - start < 1
+
+    source.interval = 0.05
+    assert source.wait() is False
+
+
+def test_directory_source_wakes_on_file_in_subdirectory(tmpdir):
+    das = tmpdir.mkdir('das01')
+    das.mkdir('action106266_observeField')
+    source = DirectorySource([str(das)], interval=10, scan_interval=0.01)
+
+    # A new action directory, then a frame in it
+    time.sleep(0.01)
+    action = das.mkdir('action106267_observeField')
+    assert source.wait() is True
+    time.sleep(0.01)
+    action.join('IMAGE001.fits').write('')
+
+    source.interval = 1
+    start = time.time()
+    assert source.wait() is True
+    assert time.time() - start < 1
+
+
+def test_build_job_source(tmpdir):
+    assert isinstance(build_job_source('poll'), PollingSource)
+    assert build_job_source('poll', interval=0.5).interval == 0.5
+    with pytest.raises(ValueError):
+        build_job_source('directory')
+    with pytest.raises(ValueError):
+        build_job_source('carrier-pigeon')
+
+
+@pytest.mark.parametrize('polls,waits', [
+    ([(20, 20), (5, 5)], 1),
+    ([(5, 30), (5, 5)], 1),
+    ([(5, 5), (5, 5)], 2),
+    ([(0, 30), (0, 30)], 2),
+])
+def test_watcher_waits_only_when_caught_up(polls, waits):
+    job_source = mock.Mock(spec=PollingSource)
+    job_source.wait.side_effect = [False, KeyboardInterrupt]
+    with mock.patch.dict('sys.modules', {'Pyro4': mock.Mock()}), \
+            mock.patch.object(watching, 'watcher_loop_step',
+                              side_effect=polls + [KeyboardInterrupt]):
+        with pytest.raises(KeyboardInterrupt):
+            watching.watcher(mock.MagicMock(), job_source=job_source)
+    assert job_source.wait.call_count == waits
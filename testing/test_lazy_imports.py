@@ -0,0 +1,23 @@
+import subprocess
+import sys
+import pytest
+
+HEAVY = ['astropy', 'photutils', 'scipy', 'Pyro4']
+
+
+@pytest.mark.parametrize('module', [
+    'ngts_transmission.db',
+    'ngts_transmission.transmission',
+    'ngts_transmission.catalogue',
+    'ngts_transmission.watching',
+])
+def test_heavy_dependencies_imported_lazily(module):
+    code = 'import sys, {}; print(" ".join(sorted(sys.modules)))'.format(
+        module)
+    loaded = subprocess.check_output([sys.executable, '-c', code]).split()
+    assert [name for name in HEAVY if name.encode() in loaded] == []
+
+
+def test_log_file_opened_on_first_record():
+    from ngts_transmission import logs
+    assert logs.fh.delay
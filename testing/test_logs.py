@@ -0,0 +1,157 @@
+import logging
+import multiprocessing
+import mock
+import threading
+import pytest
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ngts_transmission import logs
+from ngts_transmission.logs import (logger, configure_logging,
+                                    parse_log_levels, debug_sampled,
+                                    LogSampler)
+from ngts_transmission.metrics import Metrics
+from ngts_transmission.parallel import build_worker_pool
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.threads.add(threading.current_thread().name)
+        self.records.append(self.format(record))
+
+
+@pytest.fixture
+def handler():
+    handler = RecordingHandler()
+    yield handler
+    configure_logging(handlers=[logs.fh, logs.ch])
+
+
+def test_synchronous_by_default(handler):
+    configure_logging(handlers=[handler])
+    logger.info('Job %s done', 1)
+    assert handler.records == ['Job 1 done']
+    assert handler.threads == set([threading.current_thread().name])
+
+
+def test_asynchronous_written_by_listener(handler):
+    configure_logging(handlers=[handler], asynchronous=True)
+    if logs.logging_state.queue_handler is None:
+        pytest.skip('No queue handlers')
+    logger.info('Job %s done', 1)
+    logs.logging_state.stop_async()
+    assert handler.records == ['Job 1 done']
+    assert threading.current_thread().name not in handler.threads
+
+
+def log_from_worker(message):
+    logger.info(message)
+
+
+def test_worker_records_written(tmpdir):
+    if logs.QueueHandler is None:
+        pytest.skip('No queue handlers')
+    if multiprocessing.get_start_method() != 'fork':
+        pytest.skip('Workers only inherit the handlers when forked')
+    filename = str(tmpdir.join('transmission.log'))
+    configure_logging(handlers=[logging.FileHandler(filename)],
+                      asynchronous=True)
+    try:
+        logger.info('From the parent')
+        pool = build_worker_pool(1)
+        pool.apply(log_from_worker, ('From a worker',))
+        pool.close()
+        pool.join()
+    finally:
+        configure_logging(handlers=[logs.fh, logs.ch])
+    with open(filename) as infile:
+        lines = infile.read().splitlines()
+    assert 'From the parent' in lines
+    assert 'From a worker' in lines
+
+
+def test_queued_records_not_formatted():
+    if logs.QueueHandler is None:
+        pytest.skip('No queue handlers')
+    queue_handler = logs.DeferredQueueHandler(queue.Queue())
+    record = logger.makeRecord(logger.name, logging.INFO, __file__, 0,
+                               'Job %s done', (1,), None)
+    prepared = queue_handler.prepare(record)
+    assert (prepared.msg, prepared.args) == ('Job %s done', (1,))
+
+
+def test_full_queue_drops_records():
+    if logs.QueueHandler is None:
+        pytest.skip('No queue handlers')
+    queue_handler = logs.DeferredQueueHandler(queue.Queue(maxsize=1))
+    metrics = Metrics(prefix='test')
+    with mock.patch('ngts_transmission.metrics.metrics', metrics):
+        for i in range(3):
+            queue_handler.handle(logger.makeRecord(
+                logger.name, logging.INFO, __file__, 0, 'Message %s', (i,),
+                None))
+    assert queue_handler.dropped == 2
+    assert metrics.counters[('log_records_dropped', ())] == 2
+    assert queue_handler.queue.get().getMessage() == 'Message 0'
+
+
+def test_full_queue_writes_warnings(handler):
+    if logs.QueueHandler is None:
+        pytest.skip('No queue handlers')
+    queue_handler = logs.DeferredQueueHandler(queue.Queue(maxsize=1),
+                                              [handler])
+    for level in (logging.INFO, logging.WARNING, logging.ERROR):
+        queue_handler.handle(logger.makeRecord(
+            logger.name, level, __file__, 0, 'Level %s', (level,), None))
+    assert queue_handler.dropped == 0
+    assert handler.records == ['Level 30', 'Level 40']
+    assert queue_handler.queue.qsize() == 1
+
+
+def test_subsystem_levels(handler):
+    configure_logging(handlers=[handler], level='WARNING',
+                      subsystem_levels={'test_logs': 'DEBUG'})
+    assert logger.isEnabledFor(logging.DEBUG)
+    logger.debug('Kept')
+    configure_logging(handlers=[handler], level='DEBUG',
+                      subsystem_levels={'test_logs': 'WARNING'})
+    logger.info('Dropped')
+    logger.warning('Also kept')
+    assert handler.records == ['Kept', 'Also kept']
+
+
+def test_debug_sampled(handler):
+    configure_logging(handlers=[handler], sample_every=3)
+    for i in range(7):
+        debug_sampled('row', 'Row %s', i)
+    assert handler.records == ['Row 0', 'Row 3', 'Row 6']
+
+
+def test_debug_sampled_skipped_when_disabled(handler):
+    configure_logging(handlers=[handler], level='INFO')
+    debug_sampled('row', 'Row %s', 0)
+    assert handler.records == []
+    assert logs.sample.counts == {}
+
+
+def test_sampler_keys_independent():
+    sample = LogSampler(every=2)
+    assert [sample('a'), sample('b'), sample('a'), sample('b')] == [
+        True, True, False, False]
+    assert not LogSampler(every=0)('a')
+
+
+def test_parse_log_levels():
+    assert parse_log_levels(None) == ('DEBUG', {})
+    assert parse_log_levels(['INFO', 'db=debug']) == (
+        'INFO', {'db': logging.DEBUG})
+    with pytest.raises(ValueError):
+        parse_log_levels(['db=LOUD'])
@@ -0,0 +1,91 @@
+import json
+import mock
+import numpy as np
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission.metrics import Histogram, Metrics
+from ngts_transmission import watching
+from ngts_transmission.watching import Job, upload_results
+
+
+@pytest.fixture
+def metrics():
+    return Metrics(prefix='test')
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for value in range(1, 101):
+        histogram.observe(float(value))
+    summary = histogram.summary()
+    assert summary['count'] == 100
+    assert summary['sum'] == 5050.
+    assert np.isclose(summary['p50'], 50.5)
+    assert np.isclose(summary['p99'], 99.01)
+
+
+def test_histogram_window():
+    histogram = Histogram(window=10)
+    for value in range(100):
+        histogram.observe(float(value))
+    assert histogram.count == 100
+    assert histogram.quantiles()[0.5] == 94.5
+
+
+def test_timer_records_failures(metrics):
+    with pytest.raises(ValueError):
+        with metrics.timer('photometry'):
+            raise ValueError('bad image')
+    histogram, = metrics.snapshot()['histograms']
+    assert histogram['name'] == 'stage_seconds'
+    assert histogram['labels'] == {'stage': 'photometry'}
+    assert histogram['count'] == 1
+
+
+def test_prometheus_text(metrics):
+    metrics.observe('stage_seconds', 0.5, stage='upload')
+    metrics.set_gauge('backlog', 12)
+    metrics.increment('jobs_completed', 3)
+    lines = metrics.render_prometheus().splitlines()
+    assert '# TYPE test_stage_seconds summary' in lines
+    assert 'test_stage_seconds{stage="upload",quantile="0.95"} 0.5' in lines
+    assert 'test_stage_seconds_count{stage="upload"} 1' in lines
+    assert 'test_backlog 12' in lines
+    assert '# TYPE test_jobs_completed counter' in lines
+    assert 'test_jobs_completed 3' in lines
+
+
+def test_write_json(metrics, tmpdir):
+    metrics.set_gauge('backlog', 4)
+    path = str(tmpdir.join('metrics.json'))
+    metrics.write(path)
+    metrics.set_gauge('backlog', 2)
+    metrics.write(path)
+    with open(path) as infile:
+        snapshot = json.load(infile)
+    assert snapshot['gauges'] == [
+        {'name': 'backlog', 'labels': {}, 'value': 2}]
+    # Only the final file is left behind
+    assert tmpdir.listdir() == [tmpdir.join('metrics.json')]
+
+
+def test_job_submitted_time():
+    job = Job.from_row((1, 'file=IMAGE1.fits', 1000))
+    assert job.submitted == 1000.
+    assert Job.from_row((1, 'file=IMAGE1.fits')).submitted is None
+
+
+def test_queue_latency_recorded(metrics):
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+    completed = [(Job(1, 'IMAGE1.fits', submitted=1000.), None),
+                 (Job(2, 'IMAGE2.fits'), None)]
+    with mock.patch.object(watching, 'metrics', metrics), \
+            mock.patch.object(watching.time, 'time', return_value=1012.):
+        upload_results(cursor, completed)
+
+    latency = [h for h in metrics.snapshot()['histograms']
+               if h['name'] == 'queue_latency_seconds']
+    assert latency[0]['count'] == 1
+    assert latency[0]['p50'] == 12.
+    assert metrics.counters[('jobs_completed', ())] == 2
@@ -0,0 +1,70 @@
+import numpy as np
+from astropy.io import fits
+import pytest
+
+from ngts_transmission.detection import detect_sources, native_source_detect
+from ngts_transmission.catalogue import DETECTORS
+
+
+@pytest.fixture
+def positions():
+    # Well separated grid of stars, away from the image edges
+    yy, xx = np.mgrid[40:220:30, 40:220:30]
+    rng = np.random.RandomState(3)
+    x = xx.ravel() + rng.uniform(-0.5, 0.5, xx.size)
+    y = yy.ravel() + rng.uniform(-0.5, 0.5, yy.size)
+    return x, y
+
+
+@pytest.fixture
+def image(positions):
+    rng = np.random.RandomState(7)
+    data = rng.normal(1000., 5., (256, 260))
+    yy, xx = np.mgrid[:256, :260]
+    for x, y in zip(*positions):
+        data += 5E3 * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / 4.)
+    return data
+
+
+def test_recovers_positions(image, positions):
+    table = detect_sources(image, n_pixels=2, threshold=3, fwhmfilt=1.5,
+                           aperture_radius=3)
+    assert table.dtype.names == ('X_coordinate', 'Y_coordinate',
+                                 'Aper_flux_3')
+    assert len(table) == positions[0].size
+
+    x, y = positions
+    for row in table:
+        # imcore convention: pixel coordinates are 1-indexed
+        separation = np.hypot(x + 1 - row['X_coordinate'],
+                              y + 1 - row['Y_coordinate'])
+        assert separation.min() < 0.1
+    assert (table['Aper_flux_3'] > 0).all()
+
+
+def test_minimum_pixel_count(image):
+    image = image.copy()
+    image[10, 250] += 1E4
+    loose = detect_sources(image, n_pixels=1, threshold=10, fwhmfilt=0.1,
+                           aperture_radius=3)
+    strict = detect_sources(image, n_pixels=4, threshold=10, fwhmfilt=0.1,
+                            aperture_radius=3)
+    assert len(loose) == len(strict) + 1
+
+
+def test_blank_image():
+    data = np.random.RandomState(1).normal(1000., 5., (128, 128))
+    table = detect_sources(data, n_pixels=50, threshold=10, fwhmfilt=1.5,
+                           aperture_radius=3)
+    assert len(table) == 0
+
+
+def test_reads_file(tmpdir, image):
+    fname = str(tmpdir.join('frame.fits'))
+    fits.PrimaryHDU(image).writeto(fname)
+    from_file = DETECTORS['native'](fname, n_pixels=2, threshold=3,
+                                    fwhmfilt=1.5, aperture_radius=3)
+    assert np.array_equal(from_file,
+                          detect_sources(image, n_pixels=2, threshold=3,
+                                         fwhmfilt=1.5, aperture_radius=3))
+    assert DETECTORS['native'] is native_source_detect
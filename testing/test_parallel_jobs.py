@@ -0,0 +1,115 @@
+import mock
+import numpy as np
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission import watching
+from ngts_transmission.watching import Job, process_jobs_in_pool
+from ngts_transmission.transmission import Photometry, TransmissionEntry
+
+
+class SynchronousResult(object):
+
+    def __init__(self, fn, args):
+        self.fn, self.args = fn, args
+
+    def get(self):
+        return self.fn(*self.args)
+
+
+class SynchronousPool(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, fn, args):
+        self.calls.append((fn, args))
+        return SynchronousResult(fn, args)
+
+
+@pytest.fixture
+def cursor():
+    return mock.MagicMock(name='cursor', spec=Cursor)
+
+
+@pytest.fixture
+def jobs():
+    return [Job(job_id=i, filename='IMAGE{}.fits'.format(i)) for i in range(3)]
+
+
+@pytest.fixture
+def patched():
+    headers = {
+        'IMAGE0.fits': {'image_id': 0, 'agrefimg': 10101},
+        'IMAGE1.fits': {'image_id': 1, 'agrefimg': 10101},
+        'IMAGE2.fits': {'image_id': 2, 'agrefimg': 20202},
+    }
+    catalogue = Photometry(*[np.ones(2)] * 4)
+    with mock.patch.object(Job, 'real_filename',
+                           new_callable=mock.PropertyMock) as real_filename, \
+            mock.patch.object(watching, 'read_header',
+                              side_effect=headers.get), \
+            mock.patch.object(watching, 'ref_catalogue_exists',
+                              return_value=False), \
+            mock.patch.object(watching, 'ref_image_path',
+                              side_effect=lambda ref_id, cursor: ref_id), \
+            mock.patch.object(watching, 'catalogue_task') as catalogue_task, \
+            mock.patch.object(watching, 'store_catalogue') as store_catalogue, \
+            mock.patch.object(watching, 'query_for_ref_image_id',
+                              side_effect=lambda image_id, cursor: image_id), \
+            mock.patch.object(watching.Photometry, 'from_database',
+                              return_value=catalogue), \
+            mock.patch.object(watching, 'build_lock'), \
+            mock.patch.object(watching, 'transmission_task') as task:
+        # Job.real_filename is a property, so return the filename by job
+        real_filename.side_effect = ['IMAGE0.fits', 'IMAGE1.fits',
+                                     'IMAGE2.fits']
+        yield mock.Mock(catalogue_task=catalogue_task,
+                        store_catalogue=store_catalogue,
+                        transmission_task=task)
+
+
+def removed_job_ids(cursor):
+    return [call[0][1][0] for call in cursor.execute.call_args_list
+            if 'delete from job_queue' in call[0][0]]
+
+
+def test_catalogue_built_once_per_reference(cursor, jobs, patched):
+    pool = SynchronousPool()
+    process_jobs_in_pool(cursor, jobs, pool)
+    assert sorted(args[0] for args, _ in
+                  patched.catalogue_task.call_args_list) == [10101, 20202]
+    assert patched.store_catalogue.call_count == 2
+    assert removed_job_ids(cursor) == [0, 1, 2]
+
+
+def test_failed_jobs_are_not_removed(cursor, jobs, patched):
+    entry = TransmissionEntry(**{key: 1 for key in TransmissionEntry._fields})
+    patched.transmission_task.side_effect = [entry, ValueError('bad'), entry]
+    process_jobs_in_pool(cursor, jobs, SynchronousPool())
+    assert removed_job_ids(cursor) == [0, 2]
+    inserts = [call for call in cursor.execute.call_args_list
+               if 'insert into transmission_log' in call[0][0]]
+    assert len(inserts) == 1
+    assert len(inserts[0][0][1]) == 2 * len(TransmissionEntry._fields)
+
+
+def test_failed_catalogue_skips_jobs(cursor, jobs, patched):
+    patched.catalogue_task.side_effect = lambda filename: (
+        [] if filename == 10101 else 1 / 0)
+    process_jobs_in_pool(cursor, jobs, SynchronousPool())
+    assert removed_job_ids(cursor) == [0, 1]
+
+
+def test_batch_upload_falls_back_to_single_rows(cursor, jobs):
+    good = TransmissionEntry(**{key: 1 for key in TransmissionEntry._fields})
+    bad = good._replace(image_id=2)
+    completed = [(jobs[0], good), (jobs[1], None), (jobs[2], bad)]
+
+    def execute(query, args=None):
+        if 'insert' in query and 2 in args:
+            raise ValueError('duplicate entry')
+    cursor.execute.side_effect = execute
+
+    watching.upload_results(cursor, completed)
+    assert removed_job_ids(cursor) == [0, 1]
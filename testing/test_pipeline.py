@@ -0,0 +1,110 @@
+import threading
+import mock
+import numpy as np
+import pytest
+from astropy.io import fits
+from pymysql.cursors import Cursor
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ngts_transmission import watching
+from ngts_transmission.pipeline import Stage
+from ngts_transmission.parallel import transmission_task
+from ngts_transmission.transmission import Photometry, TransmissionEntry
+from ngts_transmission.watching import Job, process_jobs_pipelined
+
+
+def run_stage(fn, items, maxsize=0):
+    outbox = queue.Queue()
+    stage = Stage('test', fn, outbox, maxsize=maxsize).start()
+    for item in items:
+        stage.put(item)
+    stage.stop()
+    stage.join()
+    return [outbox.get() for _ in items], stage.stats()
+
+
+def test_stage_results_in_order():
+    results, stats = run_stage(lambda x: 1. / x, [1, 2, 0, 4])
+    assert [(item, result) for item, result, _ in results] == [
+        (1, 1.), (2, 0.5), (0, None), (4, 0.25)]
+    assert isinstance(results[2][2], ZeroDivisionError)
+    assert stats['items'] == 4
+    assert 0 <= stats['utilisation'] <= 1
+
+
+def test_stage_inbox_is_bounded():
+    release = threading.Event()
+    outbox = queue.Queue()
+    stage = Stage('test', lambda x: release.wait(), outbox, maxsize=2).start()
+    for item in range(3):
+        stage.put(item)
+    assert stage.inbox.full()
+    release.set()
+    stage.stop()
+    stage.join()
+    assert stage.stats()['max_depth'] <= 2
+
+
+@pytest.fixture
+def catalogue():
+    rng = np.random.RandomState(5)
+    return Photometry(rng.uniform(20, 100, 10), rng.uniform(20, 100, 10),
+                      np.ones(10) * 3., np.ones(10) * 1E4,
+                      ref_image_id=10101)
+
+
+@pytest.fixture
+def jobs(tmpdir, catalogue):
+    yy, xx = np.mgrid[:128, :128]
+    jobs = []
+    for i in range(4):
+        data = np.random.RandomState(i).normal(1000., 10., (128, 128))
+        for x, y in zip(catalogue.x, catalogue.y):
+            data += 5E3 * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / 4.)
+        header = fits.Header()
+        header['image_id'] = i
+        # The last image is not autoguided
+        if i < 3:
+            header['agrefimg'] = 10101
+        filename = str(tmpdir.join('IMAGE{}.fits'.format(i)))
+        fits.PrimaryHDU(data, header=header).writeto(filename)
+        jobs.append(Job(job_id=i, filename=filename))
+    jobs.append(Job(job_id=4, filename=str(tmpdir.join('missing.fits'))))
+    return jobs
+
+
+@pytest.fixture
+def cursor():
+    return mock.MagicMock(name='cursor', spec=Cursor)
+
+
+def test_pipelined_jobs(cursor, jobs, catalogue):
+    with mock.patch.object(watching, 'ensure_ref_catalogue'), \
+            mock.patch.object(watching, 'query_for_ref_image_id'), \
+            mock.patch.object(watching.Photometry, 'from_database',
+                              return_value=catalogue):
+        stats = process_jobs_pipelined(cursor, jobs, depth=1)
+
+    removed = [call[0][1][0] for call in cursor.execute.call_args_list
+               if 'delete from job_queue' in call[0][0]]
+    # The missing file is left in the queue
+    assert sorted(removed) == [0, 1, 2, 3]
+
+    inserts = [call[0][1] for call in cursor.execute.call_args_list
+               if 'insert into transmission_log' in call[0][0]]
+    assert len(inserts) == 1
+    nfields = len(TransmissionEntry._fields)
+    uploaded = [TransmissionEntry(*inserts[0][i:i + nfields])
+                for i in range(0, len(inserts[0]), nfields)]
+    expected = [transmission_task(
+        job.filename, job.job_id, catalogue.ref_image_id,
+        (catalogue.x, catalogue.y, catalogue.radius, catalogue.flux),
+        watching.RADIUS_INNER, watching.RADIUS_OUTER) for job in jobs[:3]]
+    assert uploaded == expected
+
+    assert [s['name'] for s in stats] == ['prepare', 'prefetch',
+                                          'photometry', 'upload']
+    assert stats[2]['max_depth'] <= 1
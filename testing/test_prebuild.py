@@ -0,0 +1,138 @@
+import mock
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission import prebuild
+from ngts_transmission.db import ConnectionPool
+from ngts_transmission.prebuild import (CataloguePrebuilder, is_das_node,
+                                        paladin_running)
+
+
+class SynchronousResult(object):
+
+    def __init__(self, fn, args, kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+
+    def get(self):
+        return self.fn(*self.args, **self.kwargs)
+
+
+class SynchronousPool(object):
+
+    def apply_async(self, fn, args, kwargs=None):
+        return SynchronousResult(fn, args, kwargs or {})
+
+
+class FakeConnection(object):
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self.cursor
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.fixture
+def cursor():
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+    cursor.fetchall.return_value = [(20202, 'REF2.fits'), (10101, 'REF1.fits')]
+    return cursor
+
+
+@pytest.fixture
+def db_pool(cursor):
+    return ConnectionPool(lambda: FakeConnection(cursor))
+
+
+@pytest.fixture
+def patched():
+    def catalogue_task(filename, detector):
+        if filename.endswith('REF1.fits'):
+            raise IOError('Corrupt file')
+        return [mock.Mock(ref_image_id=20202)]
+
+    with mock.patch.object(prebuild, 'catalogue_task',
+                           side_effect=catalogue_task) as task, \
+            mock.patch.object(prebuild, 'ref_catalogue_exists',
+                              return_value=False) as exists, \
+            mock.patch.object(prebuild, 'build_lock'), \
+            mock.patch.object(prebuild, 'store_catalogue') as store:
+        yield mock.Mock(catalogue_task=task, ref_catalogue_exists=exists,
+                        store_catalogue=store)
+
+
+def test_das_nodes_detected():
+    assert is_das_node('ngts-das03')
+    assert not is_das_node('ngts-par-ds')
+
+
+def test_paladin_process_detected(tmpdir):
+    tmpdir.mkdir('1').join('cmdline').write(b'python\0watcher.py\0',
+                                            mode='wb')
+    assert not paladin_running(str(tmpdir))
+    tmpdir.mkdir('2').join('cmdline').write(b'/usr/local/bin/Paladin\0',
+                                            mode='wb')
+    assert paladin_running(str(tmpdir))
+
+
+def test_builds_bounded_by_workers(db_pool, cursor, patched):
+    prebuilder = CataloguePrebuilder(db_pool, SynchronousPool(),
+                                     workers=1)
+    assert prebuilder.step() == 1
+    assert patched.catalogue_task.call_count == 1
+    assert cursor.execute.call_args[0][1] == (prebuild.LOOKBACK, 1)
+
+
+def test_failed_reference_not_retried_immediately(db_pool, cursor, patched):
+    prebuilder = CataloguePrebuilder(db_pool, SynchronousPool(),
+                                     workers=2)
+    assert prebuilder.step() == 1
+    assert list(prebuilder.failed) == [10101]
+
+    patched.catalogue_task.reset_mock()
+    prebuilder.step()
+    built = [call[0][0] for call in patched.catalogue_task.call_args_list]
+    assert built == ['/ngts/autoguider_ref/REF2.fits']
+
+
+def recorded_failures(cursor):
+    return [call[0][1] for call in cursor.execute.call_args_list
+            if 'insert into transmission_catalogue_failures' in call[0][0]]
+
+
+def test_failure_recorded(db_pool, cursor, patched):
+    prebuilder = CataloguePrebuilder(db_pool, SynchronousPool(), workers=2,
+                                     retry_time=600, max_attempts=4)
+    prebuilder.step()
+    (ref_image_id, retry_time, permanent, reason, max_attempts), = \
+        recorded_failures(cursor)
+    assert (ref_image_id, retry_time, permanent) == (10101, 600, False)
+    assert reason == 'Corrupt file'
+    assert max_attempts == 4
+
+
+def test_empty_catalogue_never_retried(db_pool, cursor, patched):
+    patched.catalogue_task.side_effect = lambda filename, detector: []
+    prebuilder = CataloguePrebuilder(db_pool, SynchronousPool(), workers=2)
+    assert prebuilder.step() == 0
+    assert [args[:3] for args in recorded_failures(cursor)] == [
+        (20202, prebuild.RETRY_TIME, True), (10101, prebuild.RETRY_TIME, True)]
+
+
+def test_only_recent_references_considered(db_pool, cursor, patched):
+    prebuilder = CataloguePrebuilder(db_pool, SynchronousPool(), lookback=50)
+    prebuilder.missing_catalogues(cursor)
+    query, args = cursor.execute.call_args[0]
+    assert args == (50, 1)
+    assert 'f.permanent = 0' in query
+
+
+def test_catalogue_built_elsewhere_not_stored(db_pool, cursor, patched):
+    patched.ref_catalogue_exists.return_value = True
+    prebuilder = CataloguePrebuilder(db_pool, SynchronousPool(),
+                                     workers=2)
+    assert prebuilder.step() == 0
+    assert not patched.store_catalogue.called
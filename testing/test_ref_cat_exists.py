@@ -23,3 +23,28 @@ def test_query_for_reference_ids(cursor, ref_id):
 def test_query_no_ref_catalogue_exists(cursor, ref_id):
     cursor.__iter__.return_value = []
     assert ref_catalogue_exists(cursor, ref_id) == False
+
+
+def test_point_lookup_for_ref_id(cursor, ref_id):
+    cursor.__iter__.return_value = [(1,),]
+    ref_catalogue_exists(cursor, ref_id)
+    assert cursor.execute.call_args[0][1] == (ref_id,)
+
+
+def test_known_ref_ids_skip_query(cursor, ref_id):
+    known_ref_ids = set()
+    cursor.__iter__.return_value = [(1,),]
+    assert ref_catalogue_exists(cursor, ref_id, known_ref_ids=known_ref_ids)
+    assert known_ref_ids == {ref_id}
+
+    cursor.__iter__.return_value = []
+    assert ref_catalogue_exists(cursor, ref_id, known_ref_ids=known_ref_ids)
+    assert cursor.execute.call_count == 1
+
+
+def test_missing_ref_ids_not_remembered(cursor, ref_id):
+    known_ref_ids = set()
+    cursor.__iter__.return_value = []
+    assert not ref_catalogue_exists(cursor, ref_id,
+                                    known_ref_ids=known_ref_ids)
+    assert known_ref_ids == set()
@@ -0,0 +1,64 @@
+import mock
+import numpy as np
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission.cache import ReferenceCatalogueCache
+from ngts_transmission.transmission import Photometry
+
+
+@pytest.fixture
+def cache():
+    return ReferenceCatalogueCache(maxsize=2)
+
+
+@pytest.fixture
+def cursor():
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+    cursor.fetchall.return_value = [(1., 2., 3., 100.), (4., 5., 3., 200.)]
+    return cursor
+
+
+def arrays(value):
+    return [np.array([value])] * 4
+
+
+def test_miss_then_hit(cache):
+    assert cache.get(10101) is None
+    cache.put(10101, arrays(1.))
+    assert cache.get(10101)[0][0] == 1.
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_evicted(cache):
+    cache.put(1, arrays(1.))
+    cache.put(2, arrays(2.))
+    cache.get(1)
+    cache.put(3, arrays(3.))
+    assert 1 in cache
+    assert 2 not in cache
+    assert cache.stats()['evictions'] == 1
+
+
+def test_invalidate(cache):
+    cache.put(1, arrays(1.))
+    cache.put(2, arrays(2.))
+    cache.invalidate(1)
+    assert 1 not in cache and 2 in cache
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_cached_arrays_are_read_only(cache):
+    cache.put(1, arrays(1.))
+    with pytest.raises(ValueError):
+        cache.get(1)[0][0] = 5.
+
+
+def test_from_database_queries_once(cache, cursor):
+    first = Photometry.from_database(cursor, 10101, cache=cache)
+    second = Photometry.from_database(cursor, 10101, cache=cache)
+    assert cursor.execute.call_count == 1
+    assert np.all(first.x == second.x)
+    assert list(second.flux) == [100., 200.]
@@ -0,0 +1,123 @@
+import mock
+import pytest
+from pymysql.cursors import Cursor
+
+from ngts_transmission.scheduling import CameraPriorityPolicy
+from ngts_transmission.watching import Job, fetch_transmission_jobs
+
+
+def frame(job_id, camera_id, minute, second=0):
+    return Job(job_id, '/ngts/das01/action1_observeField/'
+               'IMAGE{}201509202{:03d}{:02d}.fits'.format(camera_id, minute,
+                                                          second))
+
+
+@pytest.fixture
+def jobs():
+    # Newest first, as returned by the job query
+    return [
+        frame(6, 801, 359, 30),
+        frame(5, 801, 359),
+        frame(4, 801, 358, 30),
+        frame(3, 802, 358),
+        frame(2, 801, 357),
+        frame(1, 802, 356),
+    ]
+
+
+def job_ids(jobs):
+    return [job.job_id for job in jobs]
+
+
+def test_newest_frame_per_camera_first(jobs):
+    policy = CameraPriorityPolicy(batch_size=4)
+    schedule = policy.schedule(jobs, backlog=6)
+    assert job_ids(schedule.selected) == [6, 3, 5, 4]
+    assert job_ids(schedule.deferred) == [2, 1]
+    assert schedule.shed == []
+
+
+def test_no_shedding_below_threshold(jobs):
+    policy = CameraPriorityPolicy(shed='defer', backlog_threshold=10)
+    assert job_ids(policy.schedule(jobs, backlog=6).selected) == \
+        [6, 3, 5, 4, 2, 1]
+
+
+def test_defer_older_frames(jobs):
+    policy = CameraPriorityPolicy(shed='defer', backlog_threshold=5)
+    schedule = policy.schedule(jobs, backlog=6)
+    assert job_ids(schedule.selected) == [6, 3]
+    assert job_ids(schedule.deferred) == [5, 4, 2, 1]
+    assert schedule.shed == []
+
+
+def test_deferred_frames_held_back(jobs):
+    policy = CameraPriorityPolicy(shed='defer', backlog_threshold=5)
+    policy.schedule(jobs, backlog=6)
+
+    # 6 and 3 were processed, and three new frames arrived
+    queued = [frame(9, 802, 359), frame(8, 801, 359, 50),
+              frame(7, 801, 359, 40)] + jobs[1:3] + jobs[4:]
+    schedule = policy.schedule(queued, backlog=7)
+    assert job_ids(schedule.selected) == [9, 8, 7]
+    assert job_ids(schedule.deferred) == [5, 4, 2, 1]
+
+    # Nothing new, so the older frames stay queued
+    schedule = policy.schedule(queued[3:], backlog=6)
+    assert schedule.selected == []
+
+
+def test_deferred_frames_fill_batch():
+    jobs = [frame(job_id, 801, 359, 50 - job_id) for job_id in range(10)]
+    policy = CameraPriorityPolicy(shed='defer', backlog_threshold=5,
+                                  batch_size=3)
+    policy.schedule(jobs[-1:], backlog=10)
+    schedule = policy.schedule(jobs, backlog=10)
+    assert job_ids(schedule.selected) == [0, 1, 2]
+    # Frames beyond the batch are not held back by the moved front
+    schedule = policy.schedule(jobs[3:], backlog=10)
+    assert job_ids(schedule.selected) == [3, 4, 5]
+
+
+def test_deferred_frames_released_below_threshold(jobs):
+    policy = CameraPriorityPolicy(shed='defer', backlog_threshold=5)
+    policy.schedule(jobs, backlog=6)
+    schedule = policy.schedule(jobs[1:], backlog=5)
+    assert job_ids(schedule.selected) == [5, 3, 4, 2, 1]
+
+
+def test_subsample_older_frames(jobs):
+    policy = CameraPriorityPolicy(shed='subsample', backlog_threshold=5,
+                                  spacing=60.)
+    schedule = policy.schedule(jobs, backlog=6)
+    # 5 was taken in the same minute as 6, which is kept
+    assert job_ids(schedule.selected) == [6, 3, 4, 2, 1]
+    assert job_ids(schedule.shed) == [5]
+
+
+def test_unrecognised_names_never_shed():
+    jobs = [Job(2, 'b.fits'), Job(1, 'a.fits')]
+    policy = CameraPriorityPolicy(shed='subsample', backlog_threshold=0)
+    schedule = policy.schedule(jobs, backlog=2)
+    assert job_ids(schedule.selected) == [2, 1]
+
+
+def test_invalid_shed_mode():
+    with pytest.raises(ValueError):
+        CameraPriorityPolicy(shed='drop')
+
+
+def test_shed_jobs_removed_from_queue(jobs):
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+    cursor.fetchall.return_value = [
+        (job.job_id, 'file={}'.format(job.filename)) for job in jobs]
+    policy = CameraPriorityPolicy(shed='subsample', backlog_threshold=5,
+                                  window=50)
+
+    fetched = fetch_transmission_jobs(cursor, policy=policy, backlog=6)
+
+    assert cursor.execute.call_args_list[0][0][1] == (50,)
+    assert job_ids(fetched) == [6, 3, 4, 2, 1]
+    removed = [call[0][1] for call in cursor.execute.call_args_list
+               if 'delete from job_queue' in call[0][0]]
+    assert removed == [(5,)]
@@ -1,6 +1,10 @@
+import mock
+import pymysql
 import pytest
+from pymysql.cursors import Cursor
 
-from ngts_transmission.db import raw_create_table
+from ngts_transmission.db import (raw_create_table, raw_create_indexes,
+                                  create_indexes)
 
 
 def test_create_table():
@@ -15,3 +19,37 @@ def test_handle_missing_key():
 
     with pytest.raises(KeyError):
         raw_create_table('test', schema_def)
+
+
+def test_create_indexes():
+    index_def = {'test': {'b_idx': ['b'], 'a_idx': ['a', 'c']}}
+
+    expected = ['create index a_idx on test (a, c)',
+                'create index b_idx on test (b)']
+    assert raw_create_indexes('test', index_def) == expected
+
+
+def test_no_indexes():
+    assert raw_create_indexes('test', {}) == []
+
+
+def test_existing_indexes_skipped():
+    index_def = {'test': {'b_idx': ['b'], 'a_idx': ['a']}}
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+
+    def execute(query, args=None):
+        if 'a_idx' in query:
+            raise pymysql.err.OperationalError(
+                1061, "Duplicate key name 'a_idx'")
+    cursor.execute.side_effect = execute
+
+    assert create_indexes(cursor, 'test', index_def) == ['b_idx']
+    assert cursor.execute.call_count == 2
+
+
+def test_other_index_errors_raised():
+    cursor = mock.MagicMock(name='cursor', spec=Cursor)
+    cursor.execute.side_effect = pymysql.err.OperationalError(
+        1072, "Key column 'a' doesn't exist in table")
+    with pytest.raises(pymysql.err.OperationalError):
+        create_indexes(cursor, 'test', {'test': {'a_idx': ['a']}})